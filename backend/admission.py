@@ -0,0 +1,171 @@
+"""
+LLM调用的准入控制
+所有LLM调用共享 LLM_MAX_CONCURRENCY 个并发名额。名额用尽时按优先级排队：
+比赛无线电 > 比赛解说/策略 > 休闲聊天 > 后台任务。每个优先级的等待队列有上限，
+预计等待超过该级别的时限（或排队超时）时直接拒绝，返回429和Retry-After，而不是让请求无限排队。
+"""
+
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from fastapi import HTTPException
+
+from metrics import Counter, Gauge, Histogram
+from request_metrics import current_route
+
+RADIO = "radio"
+NARRATION = "narration"
+CHAT = "chat"
+BACKGROUND = "background"
+PRIORITIES = [RADIO, NARRATION, CHAT, BACKGROUND]   # 从高到低
+
+# 各级别的最长排队时间（秒）和队列上限
+ADMISSION_DEADLINES: Dict[str, float] = {
+    RADIO: float(os.getenv("ADMISSION_DEADLINE_RADIO", "3")),
+    NARRATION: float(os.getenv("ADMISSION_DEADLINE_NARRATION", "10")),
+    CHAT: float(os.getenv("ADMISSION_DEADLINE_CHAT", "20")),
+    BACKGROUND: float(os.getenv("ADMISSION_DEADLINE_BACKGROUND", "60")),
+}
+ADMISSION_QUEUE_LIMITS: Dict[str, int] = {
+    RADIO: int(os.getenv("ADMISSION_QUEUE_RADIO", "64")),
+    NARRATION: int(os.getenv("ADMISSION_QUEUE_NARRATION", "32")),
+    CHAT: int(os.getenv("ADMISSION_QUEUE_CHAT", "128")),
+    BACKGROUND: int(os.getenv("ADMISSION_QUEUE_BACKGROUND", "16")),
+}
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+
+# 路由模板 -> 优先级；未列出的路由按聊天处理
+ROUTE_PRIORITIES: Dict[str, str] = {
+    "/api/chat/driver_response": RADIO,
+    "/api/chat/driver_response/stream": RADIO,
+    "/api/chat/driver_response/batch": RADIO,
+    "/team/instruction": RADIO,
+    "/api/race/llm_strategy": NARRATION,
+    "/api/race/generate_event": NARRATION,
+    "/api/race/strategy_analysis": NARRATION,
+    "/race/simulate": NARRATION,
+    "/chat": CHAT,
+    "/chat/stream": CHAT,
+}
+
+ADMISSION_QUEUE_DEPTH = Gauge("llm_admission_queue_depth", "LLM calls waiting for a slot", ["priority"])
+ADMISSION_WAIT = Histogram(
+    "llm_admission_wait_seconds", "Time LLM calls waited for a slot", ["priority"],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+ADMISSION_DECISIONS = Counter("llm_admission_total", "Admission decisions", ["priority", "outcome"])
+ADMISSION_IN_FLIGHT = Gauge("llm_admission_in_flight", "LLM calls holding a slot")
+
+_priority_override: ContextVar[Optional[str]] = ContextVar("llm_priority", default=None)
+
+
+class AdmissionRejected(HTTPException):
+    """LLM名额不足被拒绝；聊天端点原样抛出（429 + Retry-After），比赛相关调用改用规则引擎降级"""
+
+    def __init__(self, priority: str, retry_after: float, reason: str):
+        seconds = max(1, math.ceil(retry_after))
+        super().__init__(
+            status_code=429,
+            detail=f"LLM繁忙（{priority}，{reason}），请{seconds}秒后重试",
+            headers={"Retry-After": str(seconds)},
+        )
+        self.priority = priority
+        self.retry_after = seconds
+
+
+def set_priority(priority: Optional[str]):
+    """为当前上下文（如后台任务）指定优先级，覆盖按路由的默认值"""
+    _priority_override.set(priority)
+
+
+def current_priority() -> str:
+    return _priority_override.get() or ROUTE_PRIORITIES.get(current_route(), CHAT)
+
+
+class AdmissionController:
+    def __init__(self, capacity: int = LLM_MAX_CONCURRENCY):
+        self.capacity = capacity
+        self.in_flight = 0
+        self.avg_hold = 1.0   # 名额平均占用时间（秒，指数滑动平均），用于估算排队时间
+        self._queues: Dict[str, deque] = {priority: deque() for priority in PRIORITIES}
+
+    def estimated_wait(self, priority: str) -> float:
+        """排在前面（同级及更高优先级）的请求都拿到名额所需的大致时间"""
+        ahead = sum(len(self._queues[p]) for p in PRIORITIES[:PRIORITIES.index(priority) + 1])
+        return (ahead + 1) * self.avg_hold / self.capacity
+
+    async def acquire(self, priority: str):
+        """取得一个名额；排不上时抛出 AdmissionRejected"""
+        ahead_or_equal = PRIORITIES[:PRIORITIES.index(priority) + 1]
+        if self.in_flight < self.capacity and not any(self._queues[p] for p in ahead_or_equal):
+            self._admit(priority, 0.0)
+            return
+
+        deadline = ADMISSION_DEADLINES[priority]
+        queue = self._queues[priority]
+        if len(queue) >= ADMISSION_QUEUE_LIMITS[priority]:
+            ADMISSION_DECISIONS.labels(priority, "shed_queue_full").inc()
+            raise AdmissionRejected(priority, self.estimated_wait(priority), "队列已满")
+        expected = self.estimated_wait(priority)
+        if expected > deadline:
+            ADMISSION_DECISIONS.labels(priority, "shed_deadline").inc()
+            raise AdmissionRejected(priority, expected, "预计等待超时")
+
+        waiter = asyncio.get_running_loop().create_future()
+        queue.append(waiter)
+        ADMISSION_QUEUE_DEPTH.labels(priority).set(len(queue))
+        started = time.monotonic()
+        try:
+            await asyncio.wait({waiter}, timeout=deadline)
+        except asyncio.CancelledError:
+            # 被取消时若名额已经转交过来，需要归还
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                self._abandon(priority, waiter)
+            raise
+        if not waiter.done():
+            self._abandon(priority, waiter)
+            ADMISSION_DECISIONS.labels(priority, "shed_timeout").inc()
+            raise AdmissionRejected(priority, self.estimated_wait(priority), "排队超时")
+        # release() 转交名额时已经计入 in_flight
+        ADMISSION_WAIT.labels(priority).observe(time.monotonic() - started)
+        ADMISSION_DECISIONS.labels(priority, "admitted").inc()
+
+    def release(self, held: Optional[float] = None):
+        """归还名额；有人排队时按优先级直接转交"""
+        if held is not None:
+            self.avg_hold += 0.1 * (held - self.avg_hold)
+        for priority in PRIORITIES:
+            queue = self._queues[priority]
+            while queue:
+                waiter = queue.popleft()
+                ADMISSION_QUEUE_DEPTH.labels(priority).set(len(queue))
+                if not waiter.done():
+                    waiter.set_result(None)
+                    return
+        self.in_flight -= 1
+        ADMISSION_IN_FLIGHT.set(self.in_flight)
+
+    def _admit(self, priority: str, waited: float):
+        self.in_flight += 1
+        ADMISSION_IN_FLIGHT.set(self.in_flight)
+        ADMISSION_WAIT.labels(priority).observe(waited)
+        ADMISSION_DECISIONS.labels(priority, "admitted").inc()
+
+    def _abandon(self, priority: str, waiter: asyncio.Future):
+        waiter.cancel()
+        queue = self._queues[priority]
+        try:
+            queue.remove(waiter)
+        except ValueError:
+            pass
+        ADMISSION_QUEUE_DEPTH.labels(priority).set(len(queue))
+
+
+admission = AdmissionController()
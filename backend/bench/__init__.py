@@ -0,0 +1,3 @@
+"""
+端点压测工具：本地LLM替身服务、压测场景与基线比较
+"""
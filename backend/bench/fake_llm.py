@@ -0,0 +1,176 @@
+"""
+本地OpenAI兼容替身服务
+实现 POST /v1/chat/completions（含 stream=true），可配置首字延迟、生成速度、错误率和坏JSON比例，
+并按系统提示模拟上游前缀缓存（usage.prompt_tokens_details.cached_tokens），
+用于在没有真实LLM供应商的情况下压测各端点。
+
+    python -m bench.fake_llm --port 9100 --latency-ms 300 --tokens-per-second 80 --error-rate 0.02
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from dataclasses import dataclass
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+@dataclass
+class FakeLLMConfig:
+    latency_ms: float = 200.0          # 首个token前的延迟
+    tokens_per_second: float = 100.0   # 生成速度，0表示不限速
+    error_rate: float = 0.0            # 返回HTTP 500的比例
+    malformed_rate: float = 0.0        # 返回截断JSON的比例
+    chars_per_token: int = 4
+    seed: int = 0
+
+
+DRIVER_REPLY = {
+    "response": "收到，轮胎状态良好，我会继续保持节奏，下一圈开始推进。",
+    "mood": "focused",
+    "confidence": 0.82,
+    "strategyImpact": {"paceMultiplier": 1.02, "description": "节奏略有提升"},
+    "teamRadioMessage": "Copy, pushing now.",
+}
+
+STRATEGY_REPLY = {
+    "strategyUpdates": [{"carId": "ferrari_charles_leclerc", "newStrategy": {"paceK": 1.01, "plannedPitLaps": [24]}}],
+    "teamRadio": [
+        {"teamName": "Ferrari", "driverName": "Leclerc", "message": "前胎温度有点高，控制一下。", "teamColor": "#DC143C"},
+        {"teamName": "Mercedes", "driverName": "Hamilton", "message": "Plan B, box this lap.", "teamColor": "#00D2BE"},
+    ],
+    "eventPredictions": [{"type": "pit_window", "probability": 0.6}],
+    "analysis": "中性胎起步、硬胎收尾的一停策略最稳妥。",
+    "recommendations": [],
+    "riskAssessment": "中等",
+}
+
+CHAT_REPLY = "这是一个很好的问题。让我们先想一想：你所说的“正义”究竟指什么？"
+
+
+def reply_for(messages) -> str:
+    """按提示词选择固定回复，保证各端点拿到结构正确的内容"""
+    text = " ".join(str(m.get("content", "")) for m in messages)
+    if "strategyUpdates" in text or "recommendations" in text:
+        return json.dumps(STRATEGY_REPLY, ensure_ascii=False)
+    if "JSON" in text:
+        return json.dumps(DRIVER_REPLY, ensure_ascii=False)
+    return CHAT_REPLY
+
+
+def create_app(config: FakeLLMConfig) -> FastAPI:
+    app = FastAPI(title="Fake LLM")
+    rng = random.Random(config.seed)
+    stats = {"requests": 0, "errors": 0, "malformed": 0, "promptTokens": 0, "cachedTokens": 0}
+    seen_prefixes = set()
+
+    def chunks(content: str):
+        step = max(1, config.chars_per_token)
+        return [content[i:i + step] for i in range(0, len(content), step)]
+
+    def cached_tokens(messages) -> int:
+        """模拟上游前缀缓存：系统提示与之前的请求完全相同时计为命中"""
+        if not messages or messages[0].get("role") != "system":
+            return 0
+        prefix = str(messages[0].get("content", ""))
+        if prefix in seen_prefixes:
+            return len(prefix) // config.chars_per_token
+        if len(seen_prefixes) < 1024:
+            seen_prefixes.add(prefix)
+        return 0
+
+    async def pace(n_tokens: int):
+        if config.tokens_per_second > 0:
+            await asyncio.sleep(n_tokens / config.tokens_per_second)
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["requests"] += 1
+        await asyncio.sleep(config.latency_ms / 1000)
+
+        if rng.random() < config.error_rate:
+            stats["errors"] += 1
+            return JSONResponse({"error": {"message": "injected failure", "type": "server_error"}}, status_code=500)
+
+        content = reply_for(body.get("messages", []))
+        if rng.random() < config.malformed_rate:
+            stats["malformed"] += 1
+            content = content[:max(1, len(content) // 2)]
+
+        pieces = chunks(content)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        model = body.get("model", "fake")
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in body.get("messages", [])) // config.chars_per_token
+        cached = cached_tokens(body.get("messages", []))
+        stats["promptTokens"] += prompt_tokens
+        stats["cachedTokens"] += cached
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(pieces),
+                 "total_tokens": prompt_tokens + len(pieces),
+                 "prompt_tokens_details": {"cached_tokens": cached}}
+
+        if not body.get("stream"):
+            await pace(len(pieces))
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage,
+            }
+
+        async def stream():
+            for piece in pieces:
+                chunk = {
+                    "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                await pace(1)
+            final = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage,
+            }
+            yield f"data: {json.dumps(final)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="本地OpenAI兼容替身服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=200.0)
+    parser.add_argument("--tokens-per-second", type=float, default=100.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = FakeLLMConfig(
+        latency_ms=args.latency_ms,
+        tokens_per_second=args.tokens_per_second,
+        error_rate=args.error_rate,
+        malformed_rate=args.malformed_rate,
+        seed=args.seed,
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+关键词分类微基准
+对比旧实现与单次扫描的自动机。旧实现原样保留了改动前的三处代码（聊天技能检测、driver_response
+的不当用词/技术指令判断、规则引擎的不当用词/指令分类），各自用自己的关键词表逐类 any(k in text)；
+自动机用统一后的关键词表一次扫描得到全部结果。
+两者的关键词表本来就不完全一致（规则引擎的不当用词表更短、指令匹配区分大小写、"save" 单独成词等），
+结果不同的样例会逐条列出，而不是当作错误。
+
+本机（单核）实测：按单个调用点比较（每个请求实际只经过一处），自动机反而慢一到三成
+（旧约 5–6 µs、自动机约 6–7 µs 每条消息）；只有三处结果都要算时才更快（约 17 µs 对 8 µs）。
+消息很短时 str 的 in 由C实现，逐字符的Python循环难以胜出。这次改动的收益是关键词表统一、三处结果一致，
+性能上基本持平（每条消息约差 1 µs，相对一次LLM调用可以忽略）。
+
+    cd backend
+    python -m bench.keyword_bench --number 20000
+"""
+
+import argparse
+import timeit
+
+from keyword_classifier import (
+    SKILL_KEYWORDS, classifier, detect_skill, instruction_type, is_profane,
+)
+
+MESSAGES = [
+    "你好",
+    "什么是正义？为什么人们总是追求它？",
+    "Box box, pit this lap for hards",
+    "我最近很焦虑，不知道如何坚持下去",
+    "push push push, attack the car ahead, gap is 0.8s",
+    "保持节奏，注意轮胎温度，后面的车在DRS范围内",
+    "帮我写一首关于赛道和梦想的诗歌",
+    "damn it, what the hell was that strategy",
+    "Lap 34, fuel is marginal, save fuel through sector 2 and lift and coast into turn 1 " * 3,
+    "给我讲一个有趣的F1故事，最好是关于雨战超车的",
+    "拼死一搏，死守位置",
+    "Save the tyres for the last stint",
+]
+
+ALL_SKILLS = list(SKILL_KEYWORDS)
+
+
+# ---- 改动前的实现（原样保留，包括各自的关键词表） ----
+def legacy_detect_skill_usage(message, character_skills):
+    """main.detect_skill_usage"""
+    message_lower = message.lower()
+    knowledge_keywords = ["什么是", "如何", "为什么", "解释", "告诉我", "问题", "疑问"]
+    emotional_keywords = ["难过", "困惑", "害怕", "担心", "焦虑", "帮助", "安慰", "鼓励"]
+    creative_keywords = ["写", "创作", "诗歌", "故事", "剧本", "灵感", "文学"]
+    racing_keywords = ["赛车", "策略", "技巧", "比赛", "赛道", "轮胎", "超车", "f1", "formula"]
+    humor_keywords = ["有趣", "幽默", "搞笑", "轻松", "开心", "娱乐"]
+    motivational_keywords = ["励志", "激励", "成功", "梦想", "坚持", "突破", "挑战"]
+
+    if any(keyword in message_lower for keyword in knowledge_keywords) and "知识问答" in character_skills:
+        return "知识问答"
+    elif any(keyword in message_lower for keyword in emotional_keywords) and "情感支持" in character_skills:
+        return "情感支持"
+    elif any(keyword in message_lower for keyword in creative_keywords) and "创意写作" in character_skills:
+        return "创意写作"
+    elif any(keyword in message_lower for keyword in racing_keywords) and "赛车策略" in character_skills:
+        return "赛车策略"
+    elif any(keyword in message_lower for keyword in humor_keywords) and "幽默互动" in character_skills:
+        return "幽默互动"
+    elif any(keyword in message_lower for keyword in motivational_keywords) and "励志指导" in character_skills:
+        return "励志指导"
+    return None
+
+
+def legacy_driver_flags(message):
+    """llm_endpoints.build_driver_prompt 中的判断"""
+    profanity_words = ['草泥马', '傻逼', '白痴', '蠢货', 'fuck', 'shit', 'damn', '滚', '死', '操']
+    technical_words = ['进站', 'pit', 'box', '推进', 'push', 'attack', '防守', 'defend', '节油', 'save fuel']
+    is_profanity = any(word in message.lower() for word in profanity_words)
+    is_technical = any(word in message.lower() for word in technical_words)
+    return is_profanity, is_technical
+
+
+def legacy_detect_profanity(text):
+    """F1StrategyAI._detect_profanity"""
+    profanity_words = ['草泥马', '傻逼', '白痴', '蠢货', 'fuck', 'shit', 'damn']
+    return any(word in text.lower() for word in profanity_words)
+
+
+def legacy_classify_instruction(text):
+    """F1StrategyAI._classify_instruction"""
+    if any(word in text for word in ['进站', 'pit', 'box']):
+        return 'pit'
+    elif any(word in text for word in ['推进', '加速', 'push', 'attack']):
+        return 'push'
+    elif any(word in text for word in ['防守', '保持', 'defend', 'hold']):
+        return 'defend'
+    elif any(word in text for word in ['节油', '省油', 'fuel', 'save']):
+        return 'fuel_save'
+    return 'general'
+
+
+def legacy(text: str):
+    """旧实现中三处调用点各算一遍"""
+    skill = legacy_detect_skill_usage(text, ALL_SKILLS)
+    driver_profane, technical = legacy_driver_flags(text)
+    rule_profane = legacy_detect_profanity(text)
+    instruction = legacy_classify_instruction(text)
+    return {"skill": skill, "driverProfane": driver_profane, "technical": technical,
+            "ruleProfane": rule_profane, "instruction": instruction}
+
+
+def single_pass(text: str):
+    """新实现：一次扫描，三处调用点共用结果"""
+    categories = classifier.classify(text)
+    profane = is_profane(categories)
+    instruction = instruction_type(categories)
+    return {"skill": detect_skill(categories, ALL_SKILLS), "driverProfane": profane, "technical": instruction is not None,
+            "ruleProfane": profane, "instruction": instruction or "general"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="关键词分类微基准")
+    parser.add_argument("--number", type=int, default=20000, help="每种实现的重复次数（每次处理全部样例消息）")
+    args = parser.parse_args()
+
+    for text in MESSAGES:
+        old, new = legacy(text), single_pass(text)
+        diff = {key: (old[key], new[key]) for key in old if old[key] != new[key]}
+        if diff:
+            print(f"结果不同 {text[:40]!r}: " + ", ".join(f"{k} 旧={a} 新={b}" for k, (a, b) in diff.items()))
+
+    # 每个请求只经过其中一处调用点，逐处对比才是请求路径上的真实差别；"全部" 为三处各算一遍的合计
+    def flags(text):
+        categories = classifier.classify(text)
+        return is_profane(categories), instruction_type(categories)
+
+    pairs = [
+        ("聊天技能", lambda t: legacy_detect_skill_usage(t, ALL_SKILLS),
+         lambda t: detect_skill(classifier.classify(t), ALL_SKILLS)),
+        ("车手回应", legacy_driver_flags, flags),
+        ("规则引擎", lambda t: (legacy_detect_profanity(t), legacy_classify_instruction(t)), flags),
+        ("全部", legacy, single_pass),
+    ]
+    print(f"{'调用点':<8} {'旧 µs/条':>10} {'自动机 µs/条':>12} {'比值':>6}")
+    for name, old_fn, new_fn in pairs:
+        timings = []
+        for fn in (old_fn, new_fn):
+            seconds = min(timeit.repeat(lambda: [fn(text) for text in MESSAGES], number=args.number, repeat=3))
+            timings.append(seconds / (args.number * len(MESSAGES)) * 1e6)
+        print(f"{name:<8} {timings[0]:10.2f} {timings[1]:12.2f} {timings[1] / timings[0]:6.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""
+端点压测
+启动本地LLM替身服务和后端（独立的临时数据目录），按递增并发运行各场景，
+输出吞吐量和 p50/p95/p99 延迟；可保存为基线，并与已保存的基线比较以发现性能回退。
+
+    cd backend
+    python -m bench.run_bench --concurrency 1,8,32 --requests 200 --save-baseline local
+    python -m bench.run_bench --compare local --tolerance 0.25
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import httpx
+import numpy as np
+
+from bench.scenarios import SCENARIOS, Scenario, prepare
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"服务未就绪: {url}")
+
+
+class Servers:
+    """在子进程中运行LLM替身服务和后端"""
+
+    def __init__(self, args):
+        self.args = args
+        self.processes: List[subprocess.Popen] = []
+        self.workdir = tempfile.mkdtemp(prefix="f1-bench-")
+        self.base_url = ""
+
+    def __enter__(self):
+        llm_port, api_port = free_port(), free_port()
+        self.processes.append(subprocess.Popen([
+            sys.executable, "-m", "bench.fake_llm", "--port", str(llm_port),
+            "--latency-ms", str(self.args.llm_latency_ms),
+            "--tokens-per-second", str(self.args.llm_tokens_per_second),
+            "--error-rate", str(self.args.llm_error_rate),
+            "--malformed-rate", str(self.args.llm_malformed_rate),
+        ], cwd=BACKEND_DIR))
+        wait_ready(f"http://127.0.0.1:{llm_port}/stats")
+
+        env = {
+            **os.environ,
+            "PYTHONPATH": BACKEND_DIR,
+            "OPENAI_API_KEY": "bench-key",
+            "OPENAI_BASE_URL": f"http://127.0.0.1:{llm_port}/v1",
+            "RACE_RECORDING": "0",
+        }
+        # 后端以临时目录为工作目录，data/ 不会污染仓库
+        self.processes.append(subprocess.Popen([
+            sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(api_port),
+            "--log-level", "warning", "--no-access-log",
+        ], cwd=self.workdir, env=env))
+        self.base_url = f"http://127.0.0.1:{api_port}"
+        wait_ready(f"{self.base_url}/characters")
+        return self
+
+    def __exit__(self, *exc):
+        for process in reversed(self.processes):
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict:
+    total = len(latencies) + errors
+    result = {
+        "requests": total,
+        "errors": errors,
+        "errorRate": round(errors / total, 4) if total else 0.0,
+        "throughput": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+    }
+    if latencies:
+        p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+        result.update({"p50Ms": round(float(p50), 2), "p95Ms": round(float(p95), 2), "p99Ms": round(float(p99), 2)})
+    return result
+
+
+async def run_level(client: httpx.AsyncClient, scenario: Scenario, token: Optional[str],
+                    concurrency: int, total: int) -> Dict:
+    """闭环压测：concurrency个worker共同完成total个请求"""
+    headers = {"Authorization": f"Bearer {token}"} if scenario.auth and token else {}
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                response = await client.request(
+                    scenario.method, scenario.path, headers=headers,
+                    json=scenario.body(i) if scenario.body else None,
+                    params=scenario.params(i) if scenario.params else None,
+                )
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+async def run_all(base_url: str, scenario_names: List[str], levels: List[int], requests: int) -> Dict:
+    limits = httpx.Limits(max_connections=max(levels) * 2, max_keepalive_connections=max(levels) * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120.0, limits=limits) as client:
+        token = await prepare(client)
+        results: Dict[str, Dict] = {}
+        for name in scenario_names:
+            scenario = SCENARIOS[name]
+            results[name] = {}
+            for level in levels:
+                stats = await run_level(client, scenario, token, level, requests)
+                results[name][str(level)] = stats
+                print(format_row(name, level, stats), flush=True)
+        return results
+
+
+def format_row(name: str, level: int, stats: Dict) -> str:
+    return (f"{name:<16} c={level:<4} rps={stats['throughput']:>8.1f}  "
+            f"p50={stats.get('p50Ms', 0):>8.1f}ms  p95={stats.get('p95Ms', 0):>8.1f}ms  "
+            f"p99={stats.get('p99Ms', 0):>8.1f}ms  err={stats['errorRate']:.2%}")
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """p95变慢或吞吐下降超过容差、错误率上升时视为回退"""
+    regressions = []
+    for name, levels in results.items():
+        for level, stats in levels.items():
+            base = baseline.get(name, {}).get(level)
+            if not base:
+                continue
+            if base.get("p95Ms") and stats.get("p95Ms", 0) > base["p95Ms"] * (1 + tolerance):
+                regressions.append(f"{name} c={level}: p95 {base['p95Ms']}ms -> {stats['p95Ms']}ms")
+            if base.get("throughput") and stats["throughput"] < base["throughput"] * (1 - tolerance):
+                regressions.append(f"{name} c={level}: throughput {base['throughput']} -> {stats['throughput']} rps")
+            if stats["errorRate"] > base.get("errorRate", 0) + 0.01:
+                regressions.append(f"{name} c={level}: error rate {base.get('errorRate', 0):.2%} -> {stats['errorRate']:.2%}")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="后端端点压测")
+    parser.add_argument("--base-url", help="压测已运行的后端（不启动子进程）")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="逗号分隔的场景名")
+    parser.add_argument("--concurrency", default="1,8,32,64", help="逗号分隔的并发级别")
+    parser.add_argument("--requests", type=int, default=200, help="每个并发级别的请求数")
+    parser.add_argument("--llm-latency-ms", type=float, default=200.0)
+    parser.add_argument("--llm-tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--llm-malformed-rate", type=float, default=0.0)
+    parser.add_argument("--output", help="把结果写入JSON文件")
+    parser.add_argument("--save-baseline", metavar="NAME", help="保存为 bench/baselines/NAME.json")
+    parser.add_argument("--compare", metavar="NAME", help="与 bench/baselines/NAME.json 比较")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="允许的相对回退比例")
+    args = parser.parse_args()
+
+    names = [name for name in args.scenarios.split(",") if name]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"未知场景: {', '.join(unknown)}")
+    levels = [int(level) for level in args.concurrency.split(",") if level]
+
+    if args.base_url:
+        results = asyncio.run(run_all(args.base_url, names, levels, args.requests))
+    else:
+        with Servers(args) as servers:
+            results = asyncio.run(run_all(servers.base_url, names, levels, args.requests))
+
+    report = {
+        "createdAt": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "requests": args.requests,
+            "llmLatencyMs": args.llm_latency_ms,
+            "llmTokensPerSecond": args.llm_tokens_per_second,
+            "llmErrorRate": args.llm_error_rate,
+            "llmMalformedRate": args.llm_malformed_rate,
+            "cpuCount": os.cpu_count(),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        os.makedirs(BASELINES_DIR, exist_ok=True)
+        with open(os.path.join(BASELINES_DIR, f"{args.save_baseline}.json"), "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        with open(os.path.join(BASELINES_DIR, f"{args.compare}.json"), encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline["results"], args.tolerance)
+        if regressions:
+            print("\n性能回退：")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("\n未发现超过容差的性能回退")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
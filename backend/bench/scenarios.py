@@ -0,0 +1,84 @@
+"""
+压测场景
+每个场景描述一个端点及其请求体生成方式；需要登录的场景使用 prepare() 得到的token。
+"""
+
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+import httpx
+
+BENCH_USER = {"username": "bench_user", "email": "bench@example.com", "password": "bench-password"}
+
+CHAT_MESSAGES = ["什么是美德？", "我们如何知道自己知道什么？", "勇气和鲁莽有什么区别？", "正义是否总是有利的？"]
+RADIO_MESSAGES = ["保持节奏，轮胎还能坚持几圈", "Box box, 这圈进站", "前面的车在掉速，准备超车", "注意燃油管理"]
+
+
+@dataclass
+class Scenario:
+    name: str
+    method: str
+    path: str
+    body: Optional[Callable[[int], Dict]] = None
+    params: Optional[Callable[[int], Dict]] = None
+    auth: bool = False
+    tags: List[str] = field(default_factory=list)
+
+
+def _classification() -> List[Dict]:
+    from race_engine import RaceEngine
+
+    engine = RaceEngine(seed=1)
+    engine.run_to_lap(20)
+    return engine.classification()
+
+
+CLASSIFICATION = _classification()
+
+
+def driver_response_body(i: int) -> Dict:
+    return {
+        "message": RADIO_MESSAGES[i % len(RADIO_MESSAGES)],
+        "driverId": "charles_leclerc",
+        "driverName": "Charles Leclerc",
+        "teamContext": {"name": "Ferrari", "position": 3, "currentLap": 20 + i % 30, "totalLaps": 57,
+                        "tyreCondition": "medium", "tyreWear": 0.35, "fuelLevel": "normal", "gap": "+1.20s"},
+        "raceContext": {"phase": "race", "weather": {"condition": "dry"}, "raceFlag": "green"},
+    }
+
+
+def llm_strategy_body(i: int) -> Dict:
+    # 同一圈的并发请求会被合并，圈数轮换以覆盖合并与未合并两种情况
+    return {
+        "context": {},
+        "currentLap": 20 + i % 8,
+        "weather": {"condition": "dry", "trackTemp": 42},
+        "classification": CLASSIFICATION,
+        "phase": "race",
+    }
+
+
+SCENARIOS: Dict[str, Scenario] = {
+    "login": Scenario("login", "POST", "/login",
+                      body=lambda i: {"username": BENCH_USER["username"], "password": BENCH_USER["password"]}),
+    "chat": Scenario("chat", "POST", "/chat", auth=True, tags=["llm"],
+                     body=lambda i: {"character_id": "socrates", "message": CHAT_MESSAGES[i % len(CHAT_MESSAGES)]}),
+    "conversations": Scenario("conversations", "GET", "/conversations", auth=True,
+                              params=lambda i: {"limit": 20}),
+    "driver_response": Scenario("driver_response", "POST", "/api/chat/driver_response", tags=["llm"],
+                                body=driver_response_body),
+    "llm_strategy": Scenario("llm_strategy", "POST", "/api/race/llm_strategy", tags=["llm"],
+                             body=llm_strategy_body),
+}
+
+
+async def prepare(client: httpx.AsyncClient) -> str:
+    """注册（已存在则忽略）并登录压测用户，预先写入几条对话，返回token"""
+    await client.post("/register", json=BENCH_USER)
+    response = await client.post("/login", json={"username": BENCH_USER["username"], "password": BENCH_USER["password"]})
+    response.raise_for_status()
+    token = response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    for message in CHAT_MESSAGES:
+        await client.post("/chat", json={"character_id": "socrates", "message": message}, headers=headers)
+    return token
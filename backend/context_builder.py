@@ -0,0 +1,185 @@
+"""
+按token预算组装对话上下文
+从对话尾部取最近的消息，按角色的token预算从新到旧装入；装不下的早期消息折叠进滚动摘要。
+摘要保存在对话旁的 <conversation_id>.summary 文件中，记录覆盖到的时间戳；每次从该时间戳之后读取，
+滑出最近窗口或超出预算的消息都等待折叠。窗口溢出时才在后台重新生成摘要，并把最近对话一并折叠到
+预算的 SUMMARY_KEEP_RATIO 以下，之后要再积累大半个预算才会再次溢出；当前请求直接使用已有摘要，不等待LLM。
+"""
+
+import asyncio
+import contextvars
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from admission import BACKGROUND, AdmissionRejected, set_priority
+from llm_client import chat_completion
+from metrics import Counter, Histogram
+from request_metrics import set_character
+
+CHAT_CONTEXT_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS", "1200"))
+DRIVER_CONTEXT_TOKENS = int(os.getenv("DRIVER_CONTEXT_TOKENS", "600"))
+CHAT_CONTEXT_SCAN_MESSAGES = int(os.getenv("CHAT_CONTEXT_SCAN_MESSAGES", "40"))
+# 摘要之后最多读取的消息数；正常情况下未覆盖的消息不会超过 窗口 + 一批，只有从未摘要过的长对话会被截断
+CHAT_SUMMARY_SCAN_MESSAGES = int(os.getenv("CHAT_SUMMARY_SCAN_MESSAGES", "400"))
+SUMMARY_MIN_NEW_MESSAGES = int(os.getenv("SUMMARY_MIN_NEW_MESSAGES", "4"))
+# 滞后：窗口溢出时把最近对话一并折叠，只保留历史预算的这一比例；比例越低摘要越少、每次合并越多
+SUMMARY_KEEP_RATIO = float(os.getenv("SUMMARY_KEEP_RATIO", "0.3"))
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL") or os.getenv("CHAT_MODEL", "x-ai/grok-4-fast")
+SUMMARY_MAX_TOKENS = 300
+SUMMARY_MESSAGE_CHARS = 800   # 送去摘要的单条消息截断长度
+SUMMARY_BATCH_MESSAGES = 40   # 每次摘要最多合并的消息数，积压更多时由后续请求分批继续
+
+# 各角色的历史token预算（长篇回复的角色给得多一些），未列出的用 CHAT_CONTEXT_TOKENS
+CONTEXT_BUDGETS: Dict[str, int] = {
+    "socrates": 1500,
+    "harry_potter": 1500,
+    "shakespeare": 2000,
+}
+
+MESSAGE_OVERHEAD_TOKENS = 4
+
+CONTEXT_TOKENS = Histogram(
+    "chat_context_tokens", "Estimated history tokens sent with each chat (summary included)",
+    buckets=(50, 100, 250, 500, 750, 1000, 1500, 2000, 3000, 5000),
+)
+CONTEXT_DROPPED = Counter("chat_context_dropped_messages_total", "History messages left out because of the token budget")
+SUMMARY_RUNS = Counter("chat_summary_runs_total", "Rolling summary regenerations", ["outcome"])
+
+SUMMARY_SYSTEM_PROMPT = """你负责为一段角色扮演对话维护滚动摘要。
+把已有摘要和新增的对话合并成一份新的摘要：保留用户的身份、关心的话题、双方达成的结论和尚未回答的问题，
+省略寒暄和修辞。用中文，不超过300字，只输出摘要正文。"""
+
+# 正在生成摘要的对话，避免同一对话并发重复生成
+_summarizing: set = set()
+_background_tasks: set = set()
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算token数：中日韩字符约1字1 token，其余约4字符1 token
+    （UTF-8下非ASCII字符多为3字节，用字节数差值估算其个数，避免逐字符遍历）"""
+    if not text:
+        return 0
+    n_chars = len(text)
+    n_wide = (len(text.encode("utf-8")) - n_chars) // 2
+    return n_wide + (n_chars - n_wide + 3) // 4
+
+
+def message_tokens(message: Dict) -> int:
+    return estimate_tokens(str(message.get("content", ""))) + MESSAGE_OVERHEAD_TOKENS
+
+
+def budget_for(character_id: str) -> int:
+    return CONTEXT_BUDGETS.get(character_id, CHAT_CONTEXT_TOKENS)
+
+
+def fit_messages(messages: List[Dict], budget: int) -> Tuple[List[Dict], List[Dict], int]:
+    """从新到旧装入预算，返回 (保留的消息, 装不下的早期消息, 保留部分的token数)；
+    保留部分不以助手消息开头，避免上下文从半轮对话开始"""
+    used = 0
+    start = len(messages)
+    while start > 0:
+        cost = message_tokens(messages[start - 1])
+        if used + cost > budget:
+            break
+        used += cost
+        start -= 1
+    while start < len(messages) and messages[start].get("role") == "assistant":
+        used -= message_tokens(messages[start])
+        start += 1
+    return messages[start:], messages[:start], used
+
+
+def build_history(store, conversation_id: str, character_id: str) -> List[Dict]:
+    """返回插在系统提示之后的上下文消息：可选的摘要 + 预算内的最近对话"""
+    summary = store.read_summary(conversation_id)
+    summary_text = (summary or {}).get("summary", "")
+
+    # 只读取摘要 covered_until 之后的消息：最近窗口内的装入预算，更早滑出窗口的等待折叠进摘要
+    covered_until = (summary or {}).get("covered_until") or None
+    history = store.tail(conversation_id, CHAT_SUMMARY_SCAN_MESSAGES, after=covered_until)
+    split = max(0, len(history) - CHAT_CONTEXT_SCAN_MESSAGES)
+    older, recent = history[:split], history[split:]
+
+    budget = budget_for(character_id)
+    summary_cost = estimate_tokens(summary_text) + MESSAGE_OVERHEAD_TOKENS if summary_text else 0
+    history_budget = max(0, budget - summary_cost)
+    kept, dropped, used = fit_messages(recent, history_budget)
+    CONTEXT_DROPPED.inc(len(older) + len(dropped))
+    CONTEXT_TOKENS.observe(used + summary_cost)
+
+    # 窗口溢出时重新生成摘要，并把保留部分也折叠到低水位（滞后），避免每溢出一轮就调用一次LLM；
+    # 积压过多时从最早的一批开始
+    uncovered = older + dropped
+    if uncovered:
+        _, folded, _ = fit_messages(kept, int(history_budget * SUMMARY_KEEP_RATIO))
+        end = min(len(uncovered) + len(folded), SUMMARY_BATCH_MESSAGES)
+        # 覆盖位置按时间戳记录：批次不能止于与下一条相同的时间戳（旧数据中同一轮的两条消息可能相同），否则下一条会被永久跳过
+        while 0 < end < len(history) and history[end].get("timestamp") == history[end - 1].get("timestamp"):
+            end += 1
+        if end >= SUMMARY_MIN_NEW_MESSAGES:
+            schedule_summary(store, conversation_id, character_id, summary_text, history[:end])
+
+    messages = []
+    if summary_text:
+        messages.append({"role": "system", "content": f"【之前的对话摘要】\n{summary_text}"})
+    messages.extend({"role": msg["role"], "content": msg["content"]} for msg in kept)
+    return messages
+
+
+def schedule_summary(store, conversation_id: str, character_id: str, previous: str, new_messages: List[Dict]):
+    """在后台重新生成摘要；同一对话同时只跑一个"""
+    if conversation_id in _summarizing:
+        return
+    _summarizing.add(conversation_id)
+    # 在空的上下文中创建任务（任务复制创建时的上下文），摘要调用不计入当前请求的追踪和路由指标
+    task = contextvars.Context().run(
+        asyncio.get_running_loop().create_task,
+        regenerate_summary(store, conversation_id, character_id, previous, new_messages),
+    )
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def regenerate_summary(store, conversation_id: str, character_id: str, previous: str, new_messages: List[Dict]):
+    set_character(character_id)
+    set_priority(BACKGROUND)
+    lines = []
+    for msg in new_messages:
+        speaker = "用户" if msg.get("role") == "user" else "角色"
+        lines.append(f"{speaker}：{str(msg.get('content', ''))[:SUMMARY_MESSAGE_CHARS]}")
+    prompt = f"已有摘要：\n{previous or '（无）'}\n\n新增对话：\n" + "\n".join(lines)
+    try:
+        response = await chat_completion(
+            model=SUMMARY_MODEL,
+            messages=[
+                {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt},
+            ],
+            max_tokens=SUMMARY_MAX_TOKENS,
+            temperature=0.3,
+        )
+        text = (response.choices[0].message.content or "").strip()
+        if not text:
+            raise ValueError("empty summary")
+        store.write_summary(conversation_id, {
+            "summary": text,
+            "covered_until": new_messages[-1].get("timestamp", ""),
+            "updated_at": datetime.utcnow().isoformat(),
+        })
+        SUMMARY_RUNS.labels("ok").inc()
+    except AdmissionRejected:
+        SUMMARY_RUNS.labels("shed").inc()   # 下次对话时重试
+    except Exception as e:
+        SUMMARY_RUNS.labels("error").inc()
+        print(f"摘要生成失败 {conversation_id}: {e}")
+    finally:
+        _summarizing.discard(conversation_id)
+
+
+def fit_driver_history(conversation_history: Optional[List[Dict]]) -> List[Dict]:
+    """车手无线电历史只按预算截取最近部分（没有摘要）"""
+    if not conversation_history:
+        return []
+    kept, _, _ = fit_messages(conversation_history, DRIVER_CONTEXT_TOKENS)
+    return kept
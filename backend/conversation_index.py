@@ -0,0 +1,113 @@
+"""
+对话目录索引
+按用户记录每个对话的角色、最后一条消息预览和时间戳，支持游标分页和角色过滤，
+列表查询无需扫描对话文件。由 ConversationStore 在每次写入时维护。
+"""
+
+import base64
+import json
+from typing import Dict, List, Optional, Tuple
+
+from db import SQLiteDatabase
+
+PREVIEW_LENGTH = 100
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id TEXT PRIMARY KEY,
+    user TEXT NOT NULL,
+    character_id TEXT NOT NULL,
+    last_message TEXT NOT NULL DEFAULT '',
+    timestamp TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_conversations_user_ts
+    ON conversations (user, timestamp DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_conversations_user_character_ts
+    ON conversations (user, character_id, timestamp DESC, id DESC);
+CREATE TABLE IF NOT EXISTS index_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class ConversationIndex:
+    def __init__(self, db: SQLiteDatabase):
+        self.db = db
+        self.db.executescript(_SCHEMA)
+
+    def record(self, conversation_id: str, user: str, character_id: str, messages: List[Dict]):
+        """写入对话后更新索引（新增或更新最后一条消息）"""
+        if not messages:
+            return
+        last = messages[-1]
+        self.db.execute(
+            """
+            INSERT INTO conversations (id, user, character_id, last_message, timestamp)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                last_message = excluded.last_message,
+                timestamp = excluded.timestamp
+            """,
+            (
+                conversation_id,
+                user,
+                character_id,
+                last.get("content", "")[:PREVIEW_LENGTH],
+                last.get("timestamp", ""),
+            ),
+        )
+
+    def list(self, user: str, limit: int = 20, cursor: Optional[str] = None,
+             character_id: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """按时间倒序分页列出用户对话，返回 (条目, 下一页游标)"""
+        sql = "SELECT id, character_id, last_message, timestamp FROM conversations WHERE user = ?"
+        params: list = [user]
+        if character_id:
+            sql += " AND character_id = ?"
+            params.append(character_id)
+        if cursor:
+            timestamp, last_id = self._decode_cursor(cursor)
+            sql += " AND (timestamp < ? OR (timestamp = ? AND id < ?))"
+            params.extend([timestamp, timestamp, last_id])
+        sql += " ORDER BY timestamp DESC, id DESC LIMIT ?"
+        params.append(limit + 1)
+
+        rows = [dict(row) for row in self.db.execute(sql, params).fetchall()]
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = self._encode_cursor(rows[-1]["timestamp"], rows[-1]["id"])
+        return rows, next_cursor
+
+    def rebuild(self, store) -> int:
+        """从对话文件全量重建索引（首次启用索引时回填）"""
+        count = 0
+        for conversation_id in store.list_ids():
+            header = store.read_header(conversation_id)
+            if not header or not header.get("user"):
+                continue
+            last = store.tail(conversation_id, 1)
+            self.record(conversation_id, header["user"], header.get("character_id", ""), last)
+            count += 1
+        self.db.execute(
+            "INSERT OR REPLACE INTO index_meta (key, value) VALUES ('backfilled', '1')"
+        )
+        return count
+
+    def needs_backfill(self) -> bool:
+        row = self.db.execute("SELECT value FROM index_meta WHERE key = 'backfilled'").fetchone()
+        return row is None
+
+    @staticmethod
+    def _encode_cursor(timestamp: str, conversation_id: str) -> str:
+        raw = json.dumps([timestamp, conversation_id], ensure_ascii=False).encode("utf-8")
+        return base64.urlsafe_b64encode(raw).decode("ascii")
+
+    @staticmethod
+    def _decode_cursor(cursor: str) -> Tuple[str, str]:
+        try:
+            timestamp, conversation_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        except Exception:
+            raise ValueError("Invalid cursor")
+        return str(timestamp), str(conversation_id)
@@ -0,0 +1,321 @@
+"""
+追加写入的JSONL对话存储
+每个对话一个 <conversation_id>.jsonl 文件：首行为header记录，之后每行一条消息记录。
+写入只追加不重写，读取最近N条消息时从文件尾部反向读取，单条消息的成本与对话长度无关。
+旧版整文件 .json 对话在首次追加时自动迁移，也可用 migrate_conversations.py 批量迁移。
+"""
+
+import functools
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from metrics import Histogram
+
+try:
+    import fcntl
+except ImportError:  # Windows 下退化为进程内锁
+    fcntl = None
+
+FORMAT_VERSION = 1
+LOG_SUFFIX = ".jsonl"
+LEGACY_SUFFIX = ".json"
+SUMMARY_SUFFIX = ".summary"   # 滚动摘要旁路文件（不能用 .json 结尾，否则会被当成旧格式对话）
+_TAIL_BLOCK_SIZE = 8192
+_LOCK_STRIPES = 64   # 进程内写锁按对话ID哈希分片，数量固定，不随对话数增长
+
+_timestamp_lock = threading.Lock()
+_last_timestamp = datetime.min
+
+CONVERSATION_IO = Histogram(
+    "conversation_io_seconds", "Conversation file I/O time", ["op"],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25),
+)
+
+
+def _timed(op: str):
+    """记录方法耗时到 conversation_io_seconds"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                CONVERSATION_IO.labels(op).observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def message_timestamps(count: int) -> List[str]:
+    """为一批新消息生成严格递增的时间戳（进程内跨批次也递增）。
+    滚动摘要按时间戳记录覆盖位置，时钟粒度粗时同一轮的两条消息也不能相同"""
+    global _last_timestamp
+    with _timestamp_lock:
+        start = max(datetime.utcnow(), _last_timestamp + timedelta(microseconds=1))
+        stamps = [start + timedelta(microseconds=i) for i in range(count)]
+        if stamps:
+            _last_timestamp = stamps[-1]
+    return [stamp.isoformat(timespec="microseconds") for stamp in stamps]
+
+
+class ConversationStore:
+    def __init__(self, directory: str, fsync: bool = False, index=None):
+        self.directory = directory
+        self.fsync = fsync
+        self.index = index  # 可选的 ConversationIndex，每次写入后同步更新
+        self._locks = [threading.Lock() for _ in range(_LOCK_STRIPES)]
+        os.makedirs(directory, exist_ok=True)
+
+    # ---- 路径 ----
+    def path(self, conversation_id: str) -> str:
+        return os.path.join(self.directory, self._safe_id(conversation_id) + LOG_SUFFIX)
+
+    def legacy_path(self, conversation_id: str) -> str:
+        return os.path.join(self.directory, self._safe_id(conversation_id) + LEGACY_SUFFIX)
+
+    def summary_path(self, conversation_id: str) -> str:
+        return os.path.join(self.directory, self._safe_id(conversation_id) + SUMMARY_SUFFIX)
+
+    def exists(self, conversation_id: str) -> bool:
+        return os.path.exists(self.path(conversation_id)) or os.path.exists(self.legacy_path(conversation_id))
+
+    def list_ids(self) -> List[str]:
+        """列出所有对话ID（含尚未迁移的旧格式文件）"""
+        ids = set()
+        for filename in os.listdir(self.directory):
+            if filename.endswith(LOG_SUFFIX):
+                ids.add(filename[:-len(LOG_SUFFIX)])
+            elif filename.endswith(LEGACY_SUFFIX):
+                ids.add(filename[:-len(LEGACY_SUFFIX)])
+        return sorted(ids)
+
+    # ---- 写入 ----
+    @_timed("append")
+    def append(self, conversation_id: str, messages: List[Dict], user: str, character_id: str):
+        """原子追加一批消息；对话不存在时先写入header"""
+        path = self.path(conversation_id)
+        if not os.path.exists(path):
+            if os.path.exists(self.legacy_path(conversation_id)):
+                self.migrate_legacy(conversation_id)
+            else:
+                self._create(path, user, character_id)
+        header = self.read_header(conversation_id) or {}
+
+        payload = "".join(self._encode({"type": "message", **msg}) for msg in messages).encode("utf-8")
+        with self._lock(conversation_id):
+            fd = os.open(path, os.O_RDWR | os.O_APPEND)
+            try:
+                if fcntl:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                # 上次写入若在行中途崩溃，先补齐换行，坏行在读取时被跳过
+                size = os.fstat(fd).st_size
+                if size and os.pread(fd, 1, size - 1) != b"\n":
+                    payload = b"\n" + payload
+                self._write_all(fd, payload)
+            finally:
+                os.close(fd)
+
+        if self.index is not None:
+            self.index.record(conversation_id, header.get("user", user),
+                              header.get("character_id", character_id), messages)
+
+    def _create(self, path: str, user: str, character_id: str):
+        header = {
+            "type": "header",
+            "version": FORMAT_VERSION,
+            "user": user,
+            "character_id": character_id,
+            "created_at": datetime.utcnow().isoformat(),
+        }
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            return
+        try:
+            self._write_all(fd, self._encode(header).encode("utf-8"))
+        finally:
+            os.close(fd)
+
+    def _write_all(self, fd: int, data: bytes):
+        view = memoryview(data)
+        while view:
+            written = os.write(fd, view)
+            view = view[written:]
+        if self.fsync:
+            os.fsync(fd)
+
+    # ---- 读取 ----
+    def read_header(self, conversation_id: str) -> Optional[Dict]:
+        path = self.path(conversation_id)
+        if not os.path.exists(path):
+            legacy = self._load_legacy(conversation_id)
+            if legacy is None:
+                return None
+            return {"type": "header", "user": legacy.get("user"), "character_id": legacy.get("character_id")}
+        with open(path, "r", encoding="utf-8") as f:
+            record = self._decode(f.readline())
+        return record if record and record.get("type") == "header" else None
+
+    @_timed("tail")
+    def tail(self, conversation_id: str, n: int, after: Optional[str] = None) -> List[Dict]:
+        """返回最近n条消息（按时间顺序）；指定after时只返回时间戳晚于它的消息"""
+        if n <= 0:
+            return []
+        path = self.path(conversation_id)
+        if not os.path.exists(path):
+            legacy = self._load_legacy(conversation_id)
+            messages = legacy["messages"] if legacy else []
+            if after is not None:
+                messages = [msg for msg in messages if msg.get("timestamp", "") > after]
+            return messages[-n:]
+
+        messages: List[Dict] = []
+        for line in self._reverse_lines(path):
+            record = self._decode(line)
+            if record and record.get("type") == "message":
+                if after is not None and record.get("timestamp", "") <= after:
+                    break
+                messages.append(self._strip(record))
+                if len(messages) >= n:
+                    break
+        messages.reverse()
+        return messages
+
+    @_timed("read_all")
+    def read_all(self, conversation_id: str) -> Tuple[Optional[Dict], List[Dict]]:
+        """读取header和全部消息"""
+        path = self.path(conversation_id)
+        if not os.path.exists(path):
+            legacy = self._load_legacy(conversation_id)
+            if legacy is None:
+                return None, []
+            return self.read_header(conversation_id), legacy.get("messages", [])
+
+        header, messages = None, []
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                record = self._decode(line)
+                if not record:
+                    continue
+                if record.get("type") == "header":
+                    header = record
+                elif record.get("type") == "message":
+                    messages.append(self._strip(record))
+        return header, messages
+
+    # ---- 滚动摘要 ----
+    def read_summary(self, conversation_id: str) -> Optional[Dict]:
+        try:
+            with open(self.summary_path(conversation_id), "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return record if isinstance(record, dict) else None
+
+    def write_summary(self, conversation_id: str, summary: Dict):
+        """整体替换摘要文件（先写临时文件再原子替换）"""
+        path = self.summary_path(conversation_id)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _reverse_lines(self, path: str) -> Iterator[str]:
+        """从文件尾部按块反向产出各行"""
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            position = f.tell()
+            remainder = b""
+            while position > 0:
+                read_size = min(_TAIL_BLOCK_SIZE, position)
+                position -= read_size
+                f.seek(position)
+                block = f.read(read_size) + remainder
+                lines = block.split(b"\n")
+                remainder = lines[0]
+                for line in reversed(lines[1:]):
+                    if line:
+                        yield line.decode("utf-8", errors="replace")
+            if remainder:
+                yield remainder.decode("utf-8", errors="replace")
+
+    # ---- 旧格式迁移 ----
+    def _load_legacy(self, conversation_id: str) -> Optional[Dict]:
+        legacy_path = self.legacy_path(conversation_id)
+        if not os.path.exists(legacy_path):
+            return None
+        with open(legacy_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def migrate_legacy(self, conversation_id: str, remove_legacy: bool = True) -> bool:
+        """把旧版 .json 对话转换为 .jsonl；先写唯一的临时文件，再以硬链接原子发布（已存在则不覆盖）。
+        多个进程同时迁移同一对话时只有一个生效，返回是否由本次调用完成迁移"""
+        path = self.path(conversation_id)
+        try:
+            legacy = self._load_legacy(conversation_id)
+        except FileNotFoundError:   # 其他进程刚迁移完并删除了旧文件
+            return False
+        if legacy is None or os.path.exists(path):
+            return False
+
+        messages = legacy.get("messages", [])
+        header = {
+            "type": "header",
+            "version": FORMAT_VERSION,
+            "user": legacy.get("user"),
+            "character_id": legacy.get("character_id"),
+            "created_at": messages[0].get("timestamp") if messages else datetime.utcnow().isoformat(),
+        }
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(self._encode(header))
+                for msg in messages:
+                    f.write(self._encode({"type": "message", **msg}))
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp_path, 0o644)
+            try:
+                # 与 os.replace 不同，目标已存在时失败，不会覆盖其他进程迁移后追加的消息
+                os.link(tmp_path, path)
+            except FileExistsError:
+                return False
+        finally:
+            os.remove(tmp_path)
+        if remove_legacy:
+            try:
+                os.remove(self.legacy_path(conversation_id))
+            except FileNotFoundError:
+                pass
+        return True
+
+    # ---- 工具 ----
+    def _lock(self, conversation_id: str) -> threading.Lock:
+        return self._locks[hash(conversation_id) % _LOCK_STRIPES]
+
+    @staticmethod
+    def _safe_id(conversation_id: str) -> str:
+        if not conversation_id or "/" in conversation_id or "\\" in conversation_id or conversation_id.startswith("."):
+            raise ValueError(f"Invalid conversation id: {conversation_id!r}")
+        return conversation_id
+
+    @staticmethod
+    def _encode(record: Dict) -> str:
+        return json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+    @staticmethod
+    def _decode(line: str) -> Optional[Dict]:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            return None
+        return record if isinstance(record, dict) else None
+
+    @staticmethod
+    def _strip(record: Dict) -> Dict:
+        return {k: v for k, v in record.items() if k != "type"}
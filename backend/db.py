@@ -0,0 +1,36 @@
+"""
+SQLite连接工具
+每个线程一个连接，启用WAL以支持多worker并发读写
+"""
+
+import os
+import sqlite3
+import threading
+
+DB_PATH = os.getenv("APP_DB_PATH", os.path.join("data", "app.db"))
+
+
+class SQLiteDatabase:
+    def __init__(self, path: str = DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    def execute(self, sql: str, params=()) -> sqlite3.Cursor:
+        return self.connection().execute(sql, params)
+
+    def executescript(self, script: str):
+        self.connection().executescript(script)
@@ -0,0 +1,194 @@
+"""
+容错的增量JSON解析器
+逐块喂入LLM流式输出，边生成边推送顶层字符串字段的增量文本，并在每个顶层字段闭合时立即交付其值
+"""
+
+import json
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+_SIMPLE_ESCAPES = {
+    '"': '"', '\\': '\\', '/': '/',
+    'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t',
+}
+
+_FENCE = "```json"
+
+
+class IncrementalJSONParser:
+    """
+    解析单个顶层JSON对象。
+
+    feed() 返回事件列表：
+    - ("delta", key, text)：stream_keys 中的字符串字段新增的文本
+    - ("field", key, value)：某个顶层字段已完整
+
+    若输出不是JSON（例如模型直接回复纯文本），plain_text 置为True，调用方应按文本处理。
+    允许对象前出现 ```json 代码块标记。
+    """
+
+    def __init__(self, stream_keys: Iterable[str] = ()):
+        self.stream_keys = set(stream_keys)
+        self.fields: Dict[str, Any] = {}
+        self.text = ""
+        self.plain_text = False
+        self.done = False
+
+        self._state = "seek"
+        self._prefix = ""
+        self._key = ""
+        self._str = []
+        self._escape: Optional[str] = None
+        self._high_surrogate: Optional[int] = None
+        self._raw = []
+        self._depth = 0
+        self._raw_in_string = False
+        self._raw_escape = False
+
+    def feed(self, chunk: str) -> List[Tuple[str, str, Any]]:
+        self.text += chunk
+        if self.plain_text or self.done:
+            return []
+
+        events: List[Tuple[str, str, Any]] = []
+        delta = []
+        for ch in chunk:
+            state = self._state
+            if state == "seek":
+                if ch == "{":
+                    self._state = "key_or_end"
+                    continue
+                self._prefix += ch
+                stripped = self._prefix.strip().lower()
+                if stripped and not _FENCE.startswith(stripped) and not stripped.startswith(_FENCE):
+                    self.plain_text = True
+                    return events
+            elif state == "key_or_end":
+                if ch == '"':
+                    self._state = "key"
+                    self._str = []
+                elif ch == "}":
+                    self._finish()
+                    break
+            elif state == "key":
+                text = self._read_string_char(ch)
+                if text is None:
+                    self._key = "".join(self._str)
+                    self._state = "colon"
+                else:
+                    self._str.append(text)
+            elif state == "colon":
+                if ch == ":":
+                    self._state = "value_start"
+            elif state == "value_start":
+                if ch.isspace():
+                    continue
+                if ch == '"':
+                    self._state = "string_value"
+                    self._str = []
+                elif ch in "{[":
+                    self._state = "nested_value"
+                    self._raw = [ch]
+                    self._depth = 1
+                    self._raw_in_string = False
+                    self._raw_escape = False
+                else:
+                    self._state = "literal_value"
+                    self._raw = [ch]
+            elif state == "string_value":
+                text = self._read_string_char(ch)
+                if text is None:
+                    if delta:
+                        events.append(("delta", self._key, "".join(delta)))
+                        delta = []
+                    self._complete_field("".join(self._str), events)
+                else:
+                    self._str.append(text)
+                    if text and self._key in self.stream_keys:
+                        delta.append(text)
+            elif state == "nested_value":
+                self._raw.append(ch)
+                if self._raw_in_string:
+                    if self._raw_escape:
+                        self._raw_escape = False
+                    elif ch == "\\":
+                        self._raw_escape = True
+                    elif ch == '"':
+                        self._raw_in_string = False
+                elif ch == '"':
+                    self._raw_in_string = True
+                elif ch in "{[":
+                    self._depth += 1
+                elif ch in "}]":
+                    self._depth -= 1
+                    if self._depth == 0:
+                        self._complete_field(self._loads("".join(self._raw)), events)
+            elif state == "literal_value":
+                if ch in ",}" or ch.isspace():
+                    self._complete_field(self._loads("".join(self._raw).strip()), events)
+                    if ch == "}":
+                        self._finish()
+                        break
+                    if ch == ",":
+                        self._state = "key_or_end"
+                else:
+                    self._raw.append(ch)
+            elif state == "after_value":
+                if ch == ",":
+                    self._state = "key_or_end"
+                elif ch == "}":
+                    self._finish()
+                    break
+
+        if delta:
+            events.append(("delta", self._key, "".join(delta)))
+        return events
+
+    def result(self) -> Optional[Dict[str, Any]]:
+        """解析结果；对象未闭合时只要已拿到任意完整字段也返回（截断容错），否则返回None"""
+        if self.plain_text:
+            return None
+        if self.done or self.fields:
+            return dict(self.fields)
+        return None
+
+    def _complete_field(self, value: Any, events: List[Tuple[str, str, Any]]):
+        self.fields[self._key] = value
+        events.append(("field", self._key, value))
+        self._state = "after_value"
+
+    def _finish(self):
+        self.done = True
+        self._state = "done"
+
+    def _read_string_char(self, ch: str) -> Optional[str]:
+        """处理字符串中的一个字符；返回解码后的文本片段（可能为空串），遇到结束引号返回None"""
+        if self._escape is not None:
+            self._escape += ch
+            if self._escape[0] == "u":
+                if len(self._escape) < 5:
+                    return ""
+                code = int(self._escape[1:], 16)
+                self._escape = None
+                if 0xD800 <= code < 0xDC00:
+                    self._high_surrogate = code
+                    return ""
+                if 0xDC00 <= code < 0xE000 and self._high_surrogate is not None:
+                    code = 0x10000 + ((self._high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+                self._high_surrogate = None
+                return chr(code)
+            text = _SIMPLE_ESCAPES.get(ch, ch)
+            self._escape = None
+            return text
+        if ch == "\\":
+            self._escape = ""
+            return ""
+        if ch == '"':
+            return None
+        return ch
+
+    @staticmethod
+    def _loads(raw: str) -> Any:
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return raw
@@ -0,0 +1,129 @@
+"""
+关键词分类器
+把技能、不当用词、车队指令等关键词集合在启动时编译成一个Aho-Corasick自动机（展开为DFA），
+对小写化后的文本只扫描一遍即可得到命中的全部类别；中英文关键词统一处理。
+聊天技能检测、车手无线电的不当言论/指令识别都通过这里，结果保持一致。
+"""
+
+from collections import deque
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, Optional
+
+# 技能关键词，按检测优先级排列
+SKILL_KEYWORDS: Dict[str, List[str]] = {
+    "知识问答": ["什么是", "如何", "为什么", "解释", "告诉我", "问题", "疑问"],
+    "情感支持": ["难过", "困惑", "害怕", "担心", "焦虑", "帮助", "安慰", "鼓励"],
+    "创意写作": ["写", "创作", "诗歌", "故事", "剧本", "灵感", "文学"],
+    "赛车策略": ["赛车", "策略", "技巧", "比赛", "赛道", "轮胎", "超车", "f1", "formula"],
+    "幽默互动": ["有趣", "幽默", "搞笑", "轻松", "开心", "娱乐"],
+    "励志指导": ["励志", "激励", "成功", "梦想", "坚持", "突破", "挑战"],
+}
+
+# 只用多字词：单字"死""滚""操"会误伤"拼死一搏""死守位置""操控"等正常用语
+PROFANITY_KEYWORDS: List[str] = ["草泥马", "傻逼", "白痴", "蠢货", "fuck", "shit", "damn", "滚开", "滚蛋", "去死", "操你"]
+
+# 车队指令关键词，按优先级排列（同时命中时取靠前的）
+INSTRUCTION_KEYWORDS: Dict[str, List[str]] = {
+    "pit": ["进站", "pit", "box"],
+    "push": ["推进", "加速", "push", "attack"],
+    "defend": ["防守", "保持", "defend", "hold"],
+    "fuel_save": ["节油", "省油", "save fuel", "fuel save", "fuel saving"],
+}
+
+PROFANITY = "profanity"
+
+
+def skill_category(skill: str) -> str:
+    return f"skill:{skill}"
+
+
+def instruction_category(instruction: str) -> str:
+    return f"instruction:{instruction}"
+
+
+class KeywordClassifier:
+    """多模式匹配：category -> 关键词列表，classify() 返回文本命中的类别集合"""
+
+    def __init__(self, keyword_sets: Dict[str, Iterable[str]]):
+        goto: List[Dict[str, int]] = [{}]
+        outputs: List[FrozenSet[str]] = [frozenset()]
+        for category, keywords in keyword_sets.items():
+            for keyword in keywords:
+                state = 0
+                for ch in keyword.lower():
+                    nxt = goto[state].get(ch)
+                    if nxt is None:
+                        nxt = len(goto)
+                        goto[state][ch] = nxt
+                        goto.append({})
+                        outputs.append(frozenset())
+                    state = nxt
+                outputs[state] = outputs[state] | {category}
+
+        # 按BFS计算失败链接，并把失败转移并入goto，得到无需回溯的DFA
+        # （浅层状态先处理，goto[fail[state]] 此时已是完整的一行）
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            children = list(goto[state].items())
+            if state:
+                outputs[state] = outputs[state] | outputs[fail[state]]
+                for ch, target in goto[fail[state]].items():
+                    goto[state].setdefault(ch, target)
+            for ch, nxt in children:
+                fail[nxt] = goto[fail[state]].get(ch, 0) if state else 0
+                queue.append(nxt)
+
+        self._goto = goto
+        self._outputs = outputs
+        self.categories = frozenset(keyword_sets)
+
+    def classify(self, text: str) -> FrozenSet[str]:
+        """单次扫描，返回命中的类别"""
+        goto, outputs = self._goto, self._outputs
+        state = 0
+        found = set()
+        for ch in text.lower():
+            state = goto[state].get(ch, 0)
+            if outputs[state]:
+                found.update(outputs[state])
+                if len(found) == len(self.categories):
+                    break
+        return frozenset(found)
+
+
+def _default_keyword_sets() -> Dict[str, List[str]]:
+    keyword_sets: Dict[str, List[str]] = {skill_category(skill): words for skill, words in SKILL_KEYWORDS.items()}
+    keyword_sets[PROFANITY] = PROFANITY_KEYWORDS
+    keyword_sets.update({instruction_category(name): words for name, words in INSTRUCTION_KEYWORDS.items()})
+    return keyword_sets
+
+
+classifier = KeywordClassifier(_default_keyword_sets())
+
+
+@lru_cache(maxsize=1024)
+def classify(text: str) -> FrozenSet[str]:
+    """对消息分类（同一条消息在一次请求中可能被多处使用，结果缓存）"""
+    return classifier.classify(text)
+
+
+def detect_skill(categories: FrozenSet[str], character_skills: Iterable[str]) -> Optional[str]:
+    """按优先级返回角色具备且被命中的第一个技能"""
+    for skill in SKILL_KEYWORDS:
+        if skill_category(skill) in categories and skill in character_skills:
+            return skill
+    return None
+
+
+def is_profane(categories: FrozenSet[str]) -> bool:
+    return PROFANITY in categories
+
+
+def instruction_type(categories: FrozenSet[str]) -> Optional[str]:
+    """按优先级返回指令类型，未命中返回None"""
+    for name in INSTRUCTION_KEYWORDS:
+        if instruction_category(name) in categories:
+            return name
+    return None
@@ -0,0 +1,353 @@
+"""
+进程级共享的异步LLM客户端
+所有端点复用同一个httpx连接池，上游并发数由准入控制（admission.py）按优先级分配。
+可配置多个上游（LLM_ENDPOINTS），按观测延迟选择主上游；主上游超过其p90延迟仍未返回时，
+向第二个上游发送对冲请求，先返回者胜出、另一个被取消。连续失败的上游被暂时摘除。
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from typing import List, Optional
+
+import httpx
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+
+from admission import admission, current_priority
+from metrics import Counter, Gauge, Histogram
+from request_metrics import current_character, current_route
+from tracing import span
+
+load_dotenv()
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")
+# 多上游：逗号分隔的 base_url，可用 "base_url|api_key" 指定单独的密钥
+LLM_ENDPOINTS = os.getenv("LLM_ENDPOINTS", "")
+
+# 连接池配置（并发上限 LLM_MAX_CONCURRENCY 见 admission.py）
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "64"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "32"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+
+# 对冲与摘除配置
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "1") == "1"
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "2.0"))  # 样本不足时的对冲等待
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.05"))
+LLM_HEDGE_MIN_SAMPLES = 20
+LLM_LATENCY_WINDOW = 200
+LLM_EJECT_AFTER_FAILURES = int(os.getenv("LLM_EJECT_AFTER_FAILURES", "3"))
+LLM_EJECT_SECONDS = float(os.getenv("LLM_EJECT_SECONDS", "30"))
+LLM_EJECT_MAX_SECONDS = 300.0
+
+LLM_UPSTREAM_REQUESTS = Counter("llm_upstream_requests_total", "LLM upstream attempts", ["endpoint", "result"])
+LLM_HEDGES = Counter("llm_hedged_requests_total", "Hedged LLM requests by which attempt won", ["winner"])
+LLM_EJECTIONS = Counter("llm_endpoint_ejections_total", "Times an LLM endpoint was ejected", ["endpoint"])
+LLM_ENDPOINT_HEALTHY = Gauge("llm_endpoint_healthy", "1 if the LLM endpoint is in rotation", ["endpoint"])
+
+# 以下按 API路由/模型/AI角色 打标签
+LLM_LABELS = ["route", "model", "character"]
+LLM_LATENCY = Histogram("llm_request_seconds", "LLM call latency (whole response)", LLM_LABELS)
+LLM_TTFT = Histogram("llm_time_to_first_token_seconds", "Time to the first streamed token", LLM_LABELS)
+LLM_TOKENS = Counter("llm_tokens_total", "Tokens reported in response.usage (kind: prompt/completion/cached)", LLM_LABELS + ["kind"])
+LLM_ERRORS = Counter("llm_errors_total", "LLM calls that raised", LLM_LABELS)
+
+_http_client: Optional[httpx.AsyncClient] = None
+_endpoints: Optional[List["LLMEndpoint"]] = None
+
+
+class LLMEndpoint:
+    """一个上游及其健康状态（只在事件循环线程中更新）"""
+
+    def __init__(self, name: str, client: AsyncOpenAI):
+        self.name = name
+        self.client = client
+        self.latencies: deque = deque(maxlen=LLM_LATENCY_WINDOW)
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        LLM_ENDPOINT_HEALTHY.labels(name).set(1)
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.ejected_until
+
+    def p90(self) -> Optional[float]:
+        if len(self.latencies) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[int(len(ordered) * 0.9) - 1]
+
+    def hedge_delay(self) -> float:
+        p90 = self.p90()
+        return max(LLM_HEDGE_MIN_DELAY, p90 if p90 is not None else LLM_HEDGE_DEFAULT_DELAY)
+
+    def record_success(self, latency: float):
+        self.latencies.append(latency)
+        self.consecutive_failures = 0
+        self.ejections = 0
+        LLM_UPSTREAM_REQUESTS.labels(self.name, "ok").inc()
+        LLM_ENDPOINT_HEALTHY.labels(self.name).set(1)
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        LLM_UPSTREAM_REQUESTS.labels(self.name, "error").inc()
+        if self.consecutive_failures >= LLM_EJECT_AFTER_FAILURES:
+            # 反复被摘除时摘除时间翻倍
+            duration = min(LLM_EJECT_MAX_SECONDS, LLM_EJECT_SECONDS * (2 ** self.ejections))
+            self.ejected_until = time.monotonic() + duration
+            self.ejections += 1
+            self.consecutive_failures = 0
+            LLM_EJECTIONS.labels(self.name).inc()
+            LLM_ENDPOINT_HEALTHY.labels(self.name).set(0)
+
+    def record_cancelled(self, elapsed: float):
+        # 被取消的落败请求至少耗时elapsed，计入样本使慢上游排到后面
+        self.latencies.append(elapsed)
+        LLM_UPSTREAM_REQUESTS.labels(self.name, "cancelled").inc()
+
+
+def is_llm_configured() -> bool:
+    """是否配置了可用的API密钥"""
+    if LLM_ENDPOINTS.strip():
+        return True
+    return bool(OPENAI_API_KEY) and OPENAI_API_KEY != "your_openai_api_key_here"
+
+
+def _get_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(LLM_TIMEOUT, connect=10.0),
+        )
+    return _http_client
+
+
+def get_endpoints() -> List[LLMEndpoint]:
+    """获取（必要时创建）所有上游；它们共享同一个连接池"""
+    global _endpoints
+    if not is_llm_configured():
+        raise RuntimeError("LLM API not configured")
+    if _endpoints is None:
+        specs = [spec.strip() for spec in LLM_ENDPOINTS.split(",") if spec.strip()]
+        if not specs:
+            specs = [OPENAI_BASE_URL or ""]
+        endpoints = []
+        for spec in specs:
+            base_url, _, api_key = spec.partition("|")
+            kwargs = {"api_key": api_key or OPENAI_API_KEY, "http_client": _get_http_client(), "max_retries": 1}
+            if base_url:
+                kwargs["base_url"] = base_url
+            # 多上游时由对冲和故障转移代替SDK内部重试
+            if len(specs) > 1:
+                kwargs["max_retries"] = 0
+            endpoints.append(LLMEndpoint(base_url or "default", AsyncOpenAI(**kwargs)))
+        _endpoints = endpoints
+    return _endpoints
+
+
+def get_llm_client() -> AsyncOpenAI:
+    """主上游的客户端"""
+    return get_endpoints()[0].client
+
+
+def _ranked_endpoints() -> List[LLMEndpoint]:
+    """健康的上游在前，按p90延迟从低到高；全部被摘除时仍按摘除到期顺序尝试"""
+    endpoints = get_endpoints()
+    healthy = [e for e in endpoints if e.healthy]
+    healthy.sort(key=lambda e: e.p90() if e.p90() is not None else LLM_HEDGE_DEFAULT_DELAY)
+    ejected = sorted((e for e in endpoints if not e.healthy), key=lambda e: e.ejected_until)
+    return healthy + ejected
+
+
+async def _attempt(endpoint: LLMEndpoint, call):
+    started = time.perf_counter()
+    try:
+        result = await call(endpoint)
+    except asyncio.CancelledError:
+        endpoint.record_cancelled(time.perf_counter() - started)
+        raise
+    except Exception:
+        endpoint.record_failure()
+        raise
+    endpoint.record_success(time.perf_counter() - started)
+    return result
+
+
+async def _hedged(call, discard=None):
+    """
+    在主上游发起请求；超过其p90仍未完成时对下一个上游发起对冲请求，先成功者胜出。
+    某个尝试失败时立即转向下一个上游；所有上游都失败时抛出最后一个异常。
+    discard 用于释放同时完成的落败结果（如已打开的流）。
+    """
+    candidates = _ranked_endpoints()
+    if len(candidates) == 1 or not LLM_HEDGE_ENABLED:
+        last_error = None
+        for endpoint in candidates:
+            try:
+                return await _attempt(endpoint, call)
+            except Exception as e:
+                last_error = e
+        raise last_error
+
+    queue = list(candidates)
+    running = {}
+    hedged = False
+    last_error: Optional[BaseException] = None
+
+    def launch():
+        endpoint = queue.pop(0)
+        task = asyncio.ensure_future(_attempt(endpoint, call))
+        running[task] = endpoint
+        return endpoint
+
+    primary = launch()
+    hedge_at = time.monotonic() + primary.hedge_delay()
+    try:
+        while running:
+            timeout = None
+            if queue and len(running) == 1:
+                timeout = max(0.0, hedge_at - time.monotonic())
+            done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                # 主上游慢于其p90：发起对冲请求
+                launch()
+                hedged = True
+                continue
+            for task in done:
+                endpoint = running.pop(task)
+                if task.exception() is None:
+                    if hedged:
+                        LLM_HEDGES.labels("primary" if endpoint is primary else "hedge").inc()
+                    return task.result()
+                last_error = task.exception()
+            # 失败后立即转向下一个上游
+            if not running and queue:
+                launch()
+                hedge_at = time.monotonic() + running[next(iter(running))].hedge_delay()
+        raise last_error
+    finally:
+        # 取消落败的尝试并等待其结束，取回全部结果和异常（否则asyncio会报 "Task exception was never retrieved"）
+        for task in running:
+            task.cancel()
+        if running:
+            outcomes = await asyncio.gather(*running, return_exceptions=True)
+            if discard is not None:
+                for outcome in outcomes:
+                    if not isinstance(outcome, BaseException):
+                        await discard(outcome)
+
+
+def _labels(kwargs):
+    return current_route(), kwargs.get("model", "-"), current_character()
+
+
+def _field(obj, name):
+    """usage及其子字段可能是dict，也可能是对象（旧版SDK把未知字段放在model_extra里）"""
+    if obj is None:
+        return None
+    return obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+
+
+def record_usage(labels, usage):
+    """记录response.usage中的token数（流式时可能没有usage）"""
+    if usage is None:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        value = _field(usage, kind)
+        if value:
+            LLM_TOKENS.labels(*labels, kind.split("_")[0]).inc(value)
+    # 上游前缀缓存命中的prompt token（OpenAI兼容接口的 prompt_tokens_details.cached_tokens）
+    cached = _field(_field(usage, "prompt_tokens_details"), "cached_tokens")
+    if cached:
+        LLM_TOKENS.labels(*labels, "cached").inc(cached)
+
+
+async def chat_completion(**kwargs):
+    """取得准入名额后调用chat.completions.create（多上游时对冲）；名额不足时抛出 AdmissionRejected"""
+    get_endpoints()
+    labels = _labels(kwargs)
+    with span("llm_wait"):
+        await admission.acquire(current_priority())
+    started = time.perf_counter()
+    try:
+        try:
+            with span("llm"):
+                response = await _hedged(lambda endpoint: endpoint.client.chat.completions.create(**kwargs))
+        except Exception:
+            LLM_ERRORS.labels(*labels).inc()
+            raise
+        LLM_LATENCY.labels(*labels).observe(time.perf_counter() - started)
+    finally:
+        admission.release(time.perf_counter() - started)
+    record_usage(labels, getattr(response, "usage", None))
+    return response
+
+
+async def _open_stream(endpoint: LLMEndpoint, kwargs):
+    """打开流并读到首个内容块，返回 (stream, 首段文本)；首字时间计入上游延迟"""
+    stream = await endpoint.client.chat.completions.create(stream=True, **kwargs)
+    try:
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                return stream, chunk.choices[0].delta.content
+        return stream, ""
+    except BaseException:
+        await stream.response.aclose()
+        raise
+
+
+async def stream_chat_completion(**kwargs):
+    """流式调用，逐段产出增量文本；首字对冲，整个流期间占用一个准入名额"""
+    get_endpoints()
+    labels = _labels(kwargs)
+    with span("llm_wait"):
+        await admission.acquire(current_priority())
+    started = time.perf_counter()
+    try:
+        try:
+            with span("llm_ttft"):
+                stream, first = await _hedged(
+                    lambda endpoint: _open_stream(endpoint, kwargs),
+                    discard=lambda opened: opened[0].response.aclose(),
+                )
+        except Exception:
+            LLM_ERRORS.labels(*labels).inc()
+            raise
+        LLM_TTFT.labels(*labels).observe(time.perf_counter() - started)
+        try:
+            if first:
+                yield first
+            async for chunk in stream:
+                # 部分兼容服务在最后一个块中附带usage
+                record_usage(labels, getattr(chunk, "usage", None))
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+            LLM_LATENCY.labels(*labels).observe(time.perf_counter() - started)
+        finally:
+            await stream.response.aclose()
+    finally:
+        admission.release(time.perf_counter() - started)
+
+
+async def close_llm_client():
+    """关闭连接池（应用关闭时调用）"""
+    global _http_client, _endpoints
+    if _endpoints is not None:
+        for endpoint in _endpoints:
+            await endpoint.client.close()
+        _endpoints = None
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
@@ -2,30 +2,39 @@
 LLM驱动的F1比赛策略和对话端点
 """
 
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
-import openai
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from typing import List, Dict, Any, Callable, Optional
+import asyncio
+import inspect
 import json
+import os
 import random
+import re
 from datetime import datetime
+from functools import lru_cache
+from llm_client import chat_completion, stream_chat_completion
+from admission import AdmissionRejected
+from json_stream import IncrementalJSONParser
+from streaming import sse_event, SSE_HEADERS
+from singleflight import SingleFlight
+from strategy_optimizer import optimize_strategies, cars_from_grid, format_recommendations
+from response_cache import TTLCache, canonical_key, temperature_bucket, cache_bypassed
+from race_session import get_race_session
+from race_strategy import f1_ai
+from metrics import Counter
+from request_metrics import current_route, set_character
+from tracing import span
+from keyword_classifier import classify, is_profane, instruction_type
+from context_builder import fit_driver_history
+from radio_memory import radio_memory
 
 router = APIRouter()
 
-# 兼容OpenAI新版客户端或环境变量未配置场景
-try:
-    from openai import OpenAI
-    import os
-    OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-    OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")
-    openai_client = None
-    if OPENAI_API_KEY and OPENAI_API_KEY != "your_openai_api_key_here":
-        if OPENAI_BASE_URL:
-            openai_client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
-        else:
-            openai_client = OpenAI(api_key=OPENAI_API_KEY)
-except Exception:
-    openai_client = None
+DRIVER_BATCH_MAX = int(os.getenv("DRIVER_BATCH_MAX", "22"))
+# 全局负载由准入控制器限制，批内默认全部并发；设得更小只会让排在后面的车手多等几轮，可能超出无线电时限
+DRIVER_BATCH_CONCURRENCY = int(os.getenv("DRIVER_BATCH_CONCURRENCY") or DRIVER_BATCH_MAX)
 
 class StrategyAnalysisRequest(BaseModel):
     weather: str
@@ -34,26 +43,66 @@ class StrategyAnalysisRequest(BaseModel):
     circuit: str
     gridOrder: List[dict]
     currentStrategies: List[dict]
+    rollouts: Optional[int] = None  # 每个候选策略的蒙特卡洛推演次数
 
+# 带 sessionId 时比赛情境由服务端会话提供，客户端无需重复上传
 class DriverResponseRequest(BaseModel):
     message: str
     driverId: str
     driverName: str
-    teamContext: dict
-    raceContext: dict
+    teamContext: dict = {}
+    raceContext: dict = {}
+    sessionId: Optional[str] = None
+    radioSessionId: Optional[str] = None  # 不使用服务端会话时，由客户端为每场比赛生成，用于无线电记忆
+
+class DriverBatchItem(BaseModel):
+    driverId: str
+    driverName: str
+    teamContext: dict = {}
+    raceContext: dict = {}
+
+# 同一条消息发给多位车手；raceContext为共享情境，可被各车手的raceContext覆盖
+class DriverBatchRequest(BaseModel):
+    message: str
+    drivers: List[DriverBatchItem] = Field(..., min_length=1, max_length=DRIVER_BATCH_MAX)
+    raceContext: dict = {}
+    sessionId: Optional[str] = None
+    radioSessionId: Optional[str] = None
 
 class LLMStrategyRequest(BaseModel):
-    context: dict
-    currentLap: int
-    weather: dict
-    classification: List[dict]
-    phase: str
+    context: dict = {}
+    currentLap: Optional[int] = None
+    weather: Optional[dict] = None
+    classification: Optional[List[dict]] = None
+    phase: Optional[str] = None
+    sessionId: Optional[str] = None
 
 class RaceEventRequest(BaseModel):
     eventType: str
-    currentLap: int
-    classification: List[dict]
-    weather: dict
+    currentLap: Optional[int] = None
+    classification: Optional[List[dict]] = None
+    weather: Optional[dict] = None
+    sessionId: Optional[str] = None
+
+def with_session_context(request):
+    """用服务端会话补全比赛字段；既无会话又缺字段时返回422"""
+    if request.sessionId:
+        with span("session"):
+            session = get_race_session(request.sessionId)
+        if isinstance(request, DriverResponseRequest):
+            return request.model_copy(update={
+                'teamContext': {**request.teamContext, **session.team_context(request.driverId)},
+                'raceContext': {**request.raceContext, **session.race_context()},
+            })
+        fields = session.strategy_fields()
+        return request.model_copy(update={key: fields[key] for key in request.model_fields if key in fields})
+    if isinstance(request, DriverResponseRequest):
+        return request
+    missing = [key for key in ('currentLap', 'weather', 'classification', 'phase')
+               if key in request.model_fields and getattr(request, key) is None]
+    if missing:
+        raise HTTPException(status_code=422, detail=f"缺少字段 {', '.join(missing)}（或提供 sessionId）")
+    return request
 
 # F1车手个性数据库
 DRIVER_PERSONALITIES = {
@@ -96,32 +145,15 @@ TEAM_CULTURES = {
     }
 }
 
-async def generate_llm_response(prompt: str, context: Dict, conversation_history: List = None) -> Dict:
-    """
-    调用OpenAI GPT-4生成真实的F1对话和策略
-    """
-    try:
-        driver_id = context.get('driverId', '')
-        team_id = context.get('teamId', '')
-        current_lap = context.get('currentLap', 0)
-        position = context.get('position', 10)
-        
-        # 构建系统提示 - 更详细和真实
-        system_prompt = f"""你是{context.get('driverName', 'F1车手')}，一名专业的F1赛车手。
+@lru_cache(maxsize=64)
+def driver_system_prompt(driver_name: str, driver_id: str, team_id: str) -> str:
+    """车手的静态系统提示（人设、规则、格式），同一车手逐字节相同，便于上游前缀缓存"""
+    return f"""你是{driver_name}，一名专业的F1赛车手。
 
 【车手背景】
 个性特征：{json.dumps(DRIVER_PERSONALITIES.get(driver_id, {}), ensure_ascii=False)}
 车队文化：{json.dumps(TEAM_CULTURES.get(team_id, {}), ensure_ascii=False)}
 
-【当前比赛情况】
-- 比赛圈数：第{current_lap}圈 / 总{context.get('totalLaps', 57)}圈
-- 当前位置：P{position}
-- 与前车差距：{context.get('gap', '未知')}
-- 轮胎状况：{context.get('tyreCondition', '中性胎')}，磨损{context.get('tyreWear', 0)*100:.1f}%
-- 燃油水平：{context.get('fuelLevel', '正常')}
-- 赛道状况：{context.get('raceFlag', '绿旗')}
-- 天气条件：{json.dumps(context.get('weather', {}), ensure_ascii=False)}
-
 【对话规则】
 1. 保持车手的真实个性和专业素养
 2. 根据比赛情况调整回应的紧迫感和专业度
@@ -129,6 +161,7 @@ async def generate_llm_response(prompt: str, context: Dict, conversation_history
 4. 技术指令要给出专业的执行确认
 5. 可以表达情绪，但要符合F1车手的职业标准
 6. 回应要考虑当前比赛压力和位置
+7. 每条消息开头的【当前比赛情况】是最新的实时数据
 
 【回应格式】
 必须返回JSON格式：
@@ -143,96 +176,273 @@ async def generate_llm_response(prompt: str, context: Dict, conversation_history
   "teamRadioMessage": "向车队的回应消息（可选）"
 }}"""
 
-        # 构建对话消息
-        messages = [{"role": "system", "content": system_prompt}]
-        
-        # 添加对话历史
-        if conversation_history:
-            messages.extend(conversation_history[-6:])  # 最近6轮对话
+def race_situation(context: Dict) -> str:
+    """实时比赛情况，放在最后一条用户消息里"""
+    return f"""【当前比赛情况】
+- 比赛圈数：第{context.get('currentLap', 0)}圈 / 总{context.get('totalLaps', 57)}圈
+- 当前位置：P{context.get('position', 10)}
+- 与前车差距：{context.get('gap', '未知')}
+- 轮胎状况：{context.get('tyreCondition', '中性胎')}，磨损{context.get('tyreWear', 0)*100:.1f}%
+- 燃油水平：{context.get('fuelLevel', '正常')}
+- 赛道状况：{context.get('raceFlag', '绿旗')}
+- 天气条件：{json.dumps(context.get('weather', {}), ensure_ascii=False)}"""
+
+def build_llm_messages(prompt: str, context: Dict, conversation_history: List = None) -> List[Dict]:
+    """构建车手对话消息：静态系统提示在前，历史居中，实时比赛情况和本次提示在最后"""
+    system_prompt = driver_system_prompt(
+        context.get('driverName') or 'F1车手',
+        context.get('driverId') or '',
+        context.get('teamId') or '',
+    )
+    messages = [{"role": "system", "content": system_prompt}]
+    
+    # 添加对话历史（按token预算截取最近部分）
+    messages.extend(fit_driver_history(conversation_history))
+    
+    messages.append({"role": "user", "content": f"{race_situation(context)}\n\n{prompt}"})
+    return messages
+
+def clamp_strategy_impact(impact: Any) -> Any:
+    """确保策略影响在合理范围内"""
+    if isinstance(impact, dict) and impact.get('paceMultiplier'):
+        pace = impact['paceMultiplier']
+        impact['paceMultiplier'] = max(0.9, min(1.15, pace))
+    return impact
+
+def finalize_llm_result(result: Any) -> Dict:
+    """验证和补充必要字段"""
+    if not isinstance(result, dict):
+        raise ValueError("Invalid response format")
         
-        messages.append({"role": "user", "content": prompt})
-
-        # 调用OpenAI API
-        # 优先使用同步/异步客户端，兼容两种写法
-        result_text = ""
-        if openai_client:
-            resp = openai_client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=messages,
-                max_tokens=600,
-                temperature=0.85,
-            )
-            result_text = resp.choices[0].message.content.strip()
-        else:
-            response = await openai.ChatCompletion.acreate(
-                model="gpt-4",
-                messages=messages,
-                max_tokens=600,
-                temperature=0.85,
-                presence_penalty=0.1,
-                frequency_penalty=0.1
-            )
-            result_text = response.choices[0].message.content.strip()
+    result.setdefault('mood', 'professional')
+    result.setdefault('confidence', 0.8)
+    
+    if result.get('strategyImpact'):
+        clamp_strategy_impact(result['strategyImpact'])
+    
+    return result
+
+def text_llm_result(result_text: str) -> Dict:
+    """JSON解析失败时，使用文本作为回应"""
+    return {
+        "response": result_text,
+        "mood": "professional",
+        "confidence": 0.7,
+        "strategyImpact": None
+    }
+
+def fallback_llm_result(context: Dict) -> Dict:
+    """生成基于上下文的智能降级回应"""
+    current_lap = context.get('currentLap', 0)
+    position = context.get('position', 10)
+    
+    fallback_responses = {
+        'high_pressure': f"现在是第{current_lap}圈，我在P{position}，专注比赛中。有什么技术指令吗？",
+        'normal': f"收到，{context.get('driverName', '车手')}在线。当前P{position}位置，一切正常。",
+        'pit_window': f"轮胎感觉还可以，但如果你觉得需要进站，我随时准备。",
+        'defensive': f"后面的车在推进，我会保持防守位置。"
+    }
+    
+    # 根据比赛情况选择降级回应
+    if current_lap > 45:
+        fallback = fallback_responses['high_pressure']
+    elif position <= 3:
+        fallback = fallback_responses['defensive']
+    else:
+        fallback = fallback_responses['normal']
+    
+    return {
+        "response": fallback,
+        "mood": "professional",
+        "confidence": 0.6,
+        "strategyImpact": None
+    }
+
+LLM_MODEL = "gpt-4o-mini"
+LLM_JSON_FAILURES = Counter("llm_json_parse_failures_total", "LLM replies that were not the expected JSON", ["route"])
+LLM_FALLBACKS = Counter("llm_fallback_total", "Rule-engine/canned replies served instead of the LLM", ["route", "reason"])
+LLM_PARAMS = {"max_tokens": 600, "temperature": 0.85}
+
+# 各端点等待LLM的时限（秒，含排队）；超时即取消调用，改用规则引擎的结果
+LLM_DEADLINES = {
+    "driver_response": float(os.getenv("LLM_DEADLINE_DRIVER_RESPONSE", "4")),
+    "team_instruction": float(os.getenv("LLM_DEADLINE_TEAM_INSTRUCTION", "4")),
+    "llm_strategy": float(os.getenv("LLM_DEADLINE_STRATEGY", "8")),
+    "generate_event": float(os.getenv("LLM_DEADLINE_EVENT", "6")),
+    "race_simulate": float(os.getenv("LLM_DEADLINE_RACE_SIMULATE", "6")),
+    "strategy_analysis": float(os.getenv("LLM_DEADLINE_ANALYSIS", "12")),
+}
+# 流式接口中上述时限用于首字和相邻两段文本的间隔，整条流的时限为其倍数
+LLM_STREAM_TOTAL_FACTOR = float(os.getenv("LLM_STREAM_TOTAL_FACTOR", "3"))
+
+async def degraded_result(context: Dict, fallback: Optional[Callable], reason: str) -> Dict:
+    """LLM超时或失败时的结果：优先用对应的规则引擎生成，标记 degraded"""
+    LLM_FALLBACKS.labels(current_route(), reason).inc()
+    result = None
+    if fallback is not None:
+        try:
+            result = fallback()
+            if inspect.isawaitable(result):
+                result = await result
+        except Exception as e:
+            print(f"规则引擎降级失败: {e}")
+            result = None
+    if not isinstance(result, dict):
+        result = fallback_llm_result(context)
+    result['degraded'] = True
+    return result
+
+async def generate_llm_response(prompt: str, context: Dict, conversation_history: List = None,
+                                deadline: Optional[float] = None, fallback: Optional[Callable] = None) -> Dict:
+    """
+    调用OpenAI GPT-4生成真实的F1对话和策略
+    超过deadline秒（含排队）取消调用；超时、出错或被准入限流时返回fallback()（规则引擎）的结果
+    """
+    try:
+        with span("prompt"):
+            messages = build_llm_messages(prompt, context, conversation_history)
+
+        # 调用共享的异步LLM客户端（未配置时抛出异常，走降级回应）
+        resp = await asyncio.wait_for(
+            chat_completion(model=LLM_MODEL, messages=messages, **LLM_PARAMS), timeout=deadline
+        )
+        result_text = resp.choices[0].message.content.strip()
         
         # 尝试解析JSON
         try:
-            result = json.loads(result_text)
-            
-            # 验证和补充必要字段
-            if not isinstance(result, dict):
-                raise ValueError("Invalid response format")
-                
-            result.setdefault('mood', 'professional')
-            result.setdefault('confidence', 0.8)
-            
-            # 确保策略影响在合理范围内
-            if result.get('strategyImpact') and result['strategyImpact'].get('paceMultiplier'):
-                pace = result['strategyImpact']['paceMultiplier']
-                result['strategyImpact']['paceMultiplier'] = max(0.9, min(1.15, pace))
-            
-            return result
-            
+            return finalize_llm_result(json.loads(result_text))
         except (json.JSONDecodeError, ValueError):
-            # JSON解析失败，使用文本作为回应
-            return {
-                "response": result_text,
-                "mood": "professional",
-                "confidence": 0.7,
-                "strategyImpact": None
-            }
+            LLM_JSON_FAILURES.labels(current_route()).inc()
+            return text_llm_result(result_text)
+
+    except AdmissionRejected:
+        # 比赛相关调用（带fallback）被限流时同样降级；没有fallback时由端点返回429让客户端稍后重试
+        if fallback is None:
+            raise
+        return await degraded_result(context, fallback, "shed")
+    except asyncio.TimeoutError:
+        return await degraded_result(context, fallback, "timeout")
+    except Exception as e:
+        print(f"LLM调用错误: {e}")
+        return await degraded_result(context, fallback, "error")
 
+async def stream_deadline(chunks, deadline: Optional[float]):
+    """每段文本（含首字）都须在deadline秒内到达，整条流不超过 deadline*LLM_STREAM_TOTAL_FACTOR 秒；
+    超时抛出TimeoutError，结束时总会关闭上游流"""
+    loop = asyncio.get_running_loop()
+    end = loop.time() + deadline * LLM_STREAM_TOTAL_FACTOR if deadline else None
+    try:
+        while True:
+            timeout = deadline
+            if end is not None:
+                timeout = max(0.0, min(deadline, end - loop.time()))
+            try:
+                chunk = await asyncio.wait_for(chunks.__anext__(), timeout=timeout)
+            except StopAsyncIteration:
+                return
+            yield chunk
+    finally:
+        await chunks.aclose()
+
+async def stream_llm_response(prompt: str, context: Dict, conversation_history: List = None,
+                              deadline: Optional[float] = None, fallback: Optional[Callable] = None):
+    """
+    generate_llm_response的流式版本，产出 (event, data)：
+    - ("delta", {"text": ...})：response字段的增量文本
+    - ("field", {"name": ..., "value": ...})：mood/strategyImpact等字段闭合时立即交付
+    - ("result", {...})：最终完整结果（与非流式返回一致）
+    deadline限制首字和每段间隔（整条流另有总时限），超时或出错且尚未输出回应时改用fallback()的结果；
+    已输出部分回应时以已输出的文本结束，同样标记 degraded
+    """
+    parser = IncrementalJSONParser(stream_keys=["response"])
+    streamed = []
+    streamed_plain = 0
+    reason = None
+    try:
+        messages = build_llm_messages(prompt, context, conversation_history)
+        chunks = stream_chat_completion(model=LLM_MODEL, messages=messages, **LLM_PARAMS)
+        async for chunk in stream_deadline(chunks, deadline):
+            for kind, key, value in parser.feed(chunk):
+                if kind == "delta":
+                    streamed.append(value)
+                    yield "delta", {"text": value}
+                elif key != "response":
+                    if key == "strategyImpact":
+                        value = clamp_strategy_impact(value)
+                    yield "field", {"name": key, "value": value}
+            # 非JSON输出：直接把原文当作回应推送
+            if parser.plain_text:
+                text = parser.text.lstrip()
+                if len(text) > streamed_plain:
+                    streamed.append(text[streamed_plain:])
+                    yield "delta", {"text": text[streamed_plain:]}
+                    streamed_plain = len(text)
+    except AdmissionRejected:
+        if fallback is None:
+            raise
+        reason = "shed"
+    except asyncio.TimeoutError:
+        reason = "timeout"
     except Exception as e:
         print(f"LLM调用错误: {e}")
-        
-        # 生成基于上下文的智能降级回应
-        fallback_responses = {
-            'high_pressure': f"现在是第{current_lap}圈，我在P{position}，专注比赛中。有什么技术指令吗？",
-            'normal': f"收到，{context.get('driverName', '车手')}在线。当前P{position}位置，一切正常。",
-            'pit_window': f"轮胎感觉还可以，但如果你觉得需要进站，我随时准备。",
-            'defensive': f"后面的车在推进，我会保持防守位置。"
-        }
-        
-        # 根据比赛情况选择降级回应
-        if current_lap > 45:
-            fallback = fallback_responses['high_pressure']
-        elif position <= 3:
-            fallback = fallback_responses['defensive']
-        else:
-            fallback = fallback_responses['normal']
-        
-        return {
-            "response": fallback,
-            "mood": "professional",
-            "confidence": 0.6,
-            "strategyImpact": None
-        }
+        reason = "error"
+    if reason and not streamed:
+        result = await degraded_result(context, fallback, reason)
+        yield "delta", {"text": result.get("response", "")}
+        yield "result", result
+        return
+    if reason:
+        # 中途停顿或出错：客户端已收到部分回应，以已输出的文本收尾
+        LLM_FALLBACKS.labels(current_route(), reason).inc()
+        result = finalize_llm_result({**(parser.result() or {}), "response": "".join(streamed)})
+        result['degraded'] = True
+        yield "result", result
+        return
+
+    result = parser.result()
+    try:
+        result = finalize_llm_result(result)
+    except ValueError:
+        LLM_JSON_FAILURES.labels(current_route()).inc()
+        result = text_llm_result(parser.text.strip())
+    yield "result", result
+
+STRATEGY_ANALYSIS_CACHE = TTLCache(
+    "strategy_analysis",
+    maxsize=int(os.getenv("STRATEGY_ANALYSIS_CACHE_SIZE", "512")),
+    ttl=float(os.getenv("STRATEGY_ANALYSIS_CACHE_TTL", "600")),
+)
+
+def strategy_analysis_cache_key(request: StrategyAnalysisRequest) -> str:
+    """规范化策略分析请求：温度分桶、发车顺序按位次排列、策略按车辆排序"""
+    grid = sorted(request.gridOrder, key=lambda car: car.get('position', 0))
+    return canonical_key({
+        "circuit": request.circuit,
+        "raceLength": request.raceLength,
+        "weather": request.weather,
+        "trackTemp": temperature_bucket(request.trackTemp),
+        "gridOrder": [car.get('driver') for car in grid],
+        "currentStrategies": sorted(request.currentStrategies, key=lambda strat: str(strat.get('carId', ''))),
+        "rollouts": request.rollouts,
+    })
 
 @router.post("/api/race/strategy_analysis")
-async def strategy_analysis(request: StrategyAnalysisRequest):
+async def strategy_analysis(request: StrategyAnalysisRequest, http_request: Request, response: Response):
     """
-    LLM驱动的策略分析
+    LLM驱动的策略分析（相同条件的请求命中缓存，X-Cache响应头标明HIT/MISS/BYPASS）
     """
     try:
+        cache_key = strategy_analysis_cache_key(request)
+        bypass = cache_bypassed(http_request.headers)
+        if bypass:
+            STRATEGY_ANALYSIS_CACHE.record_bypass()
+        else:
+            hit, cached = STRATEGY_ANALYSIS_CACHE.get(cache_key)
+            if hit:
+                response.headers["X-Cache"] = "HIT"
+                return cached
+        response.headers["X-Cache"] = "BYPASS" if bypass else "MISS"
+
         prompt = f"""
 分析F1比赛策略：
 
@@ -262,54 +472,70 @@ async def strategy_analysis(request: StrategyAnalysisRequest):
             'circuit': request.circuit
         }
 
-        result = await generate_llm_response(prompt, context)
+        # LLM分析与蒙特卡洛策略优化并行执行
+        cars, strategies = cars_from_grid(request.gridOrder, request.currentStrategies)
+        result, optimization = await asyncio.gather(
+            generate_llm_response(
+                prompt, context, deadline=LLM_DEADLINES["strategy_analysis"],
+                fallback=lambda: f1_ai.rule_strategy_analysis({**context, 'raceLength': request.raceLength}),
+            ),
+            optimize_strategies(
+                cars,
+                strategies,
+                total_laps=request.raceLength,
+                weather=request.weather,
+                track_temp=request.trackTemp,
+                rollouts=request.rollouts,
+                seed=int(cache_key[:8], 16),
+            ),
+        )
         
         # 补充默认结构
-        return {
+        analysis = {
             "analysis": result.get("analysis", f"{request.circuit}在{request.trackTemp}°C条件下，轮胎衰减将是关键因素。"),
-            "recommendations": result.get("recommendations", [
-                {"driver": "Top 3", "suggestion": "保守一停策略", "impact": "确保积分"},
-                {"driver": "Mid-field", "suggestion": "激进二停", "impact": "争取更好位置"}
-            ]),
-            "riskAssessment": result.get("riskAssessment", ["轮胎衰减: 高", "超车难度: 中"])
+            "recommendations": result.get("recommendations") or format_recommendations(optimization),
+            "riskAssessment": result.get("riskAssessment", ["轮胎衰减: 高", "超车难度: 中"]),
+            "optimizedStrategies": optimization,
+            "degraded": bool(result.get("degraded"))
         }
 
+        # 只缓存LLM真正给出的分析和完整的优化结果，降级结果不缓存
+        if "analysis" in result and not result.get("degraded") and not optimization["partial"]:
+            STRATEGY_ANALYSIS_CACHE.set(cache_key, analysis)
+        return analysis
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"策略分析失败: {str(e)}")
 
-@router.post("/api/chat/driver_response")
-async def driver_response(request: DriverResponseRequest):
-    """
-    车手AI回应（真实反应，包含恶意输入处理）
-    """
-    try:
-        # 检测不当言论和指令类型
-        profanity_words = ['草泥马', '傻逼', '白痴', '蠢货', 'fuck', 'shit', 'damn', '滚', '死', '操']
-        technical_words = ['进站', 'pit', 'box', '推进', 'push', 'attack', '防守', 'defend', '节油', 'save fuel']
-        
-        is_profanity = any(word in request.message.lower() for word in profanity_words)
-        is_technical = any(word in request.message.lower() for word in technical_words)
-        
-        # 构建更详细的上下文
-        enhanced_context = {
-            'driverId': request.driverId,
-            'driverName': request.driverName,
-            'teamId': request.teamContext.get('name', '').lower().replace(' ', '_'),
-            'currentLap': request.teamContext.get('currentLap', 0),
-            'totalLaps': request.teamContext.get('totalLaps', 57),
-            'position': request.teamContext.get('position', 10),
-            'gap': request.teamContext.get('gap', '+0.00s'),
-            'tyreCondition': request.teamContext.get('tyreCondition', 'medium'),
-            'tyreWear': request.teamContext.get('tyreWear', 0),
-            'fuelLevel': request.teamContext.get('fuelLevel', 'normal'),
-            'weather': request.raceContext.get('weather', {}),
-            'raceFlag': request.raceContext.get('raceFlag', 'green'),
-            'phase': request.raceContext.get('phase', 'race')
-        }
+def build_driver_prompt(request: DriverResponseRequest):
+    """根据车手消息构建提示词和比赛上下文，返回 (prompt, enhanced_context)"""
+    # 检测不当言论和指令类型（与规则引擎共用同一个关键词分类器）
+    categories = classify(request.message)
+    is_profanity = is_profane(categories)
+    is_technical = instruction_type(categories) is not None
+    
+    # 构建更详细的上下文
+    enhanced_context = {
+        'driverId': request.driverId,
+        'driverName': request.driverName,
+        'teamId': request.teamContext.get('name', '').lower().replace(' ', '_'),
+        'currentLap': request.teamContext.get('currentLap', 0),
+        'totalLaps': request.teamContext.get('totalLaps', 57),
+        'position': request.teamContext.get('position', 10),
+        'gap': request.teamContext.get('gap', '+0.00s'),
+        'tyreCondition': request.teamContext.get('tyreCondition', 'medium'),
+        'tyreWear': request.teamContext.get('tyreWear', 0),
+        'fuelLevel': request.teamContext.get('fuelLevel', 'normal'),
+        'weather': request.raceContext.get('weather', {}),
+        'raceFlag': request.raceContext.get('raceFlag', 'green'),
+        'phase': request.raceContext.get('phase', 'race')
+    }
 
-        # 构建提示词
-        if is_profanity:
-            prompt = f"""用户刚才对你说了不当的话："{request.message}"
+    # 构建提示词
+    if is_profanity:
+        prompt = f"""用户刚才对你说了不当的话："{request.message}"
 
 作为一名专业的F1车手，你需要：
 1. 表达不满但保持职业素养
@@ -318,8 +544,8 @@ async def driver_response(request: DriverResponseRequest):
 
 当前你正在激烈的比赛中，压力很大，但必须保持专业。"""
 
-        elif is_technical:
-            prompt = f"""车队给你下达了技术指令："{request.message}"
+    elif is_technical:
+        prompt = f"""车队给你下达了技术指令："{request.message}"
 
 请根据当前比赛情况给出专业回应：
 - 如果是合理指令，确认执行
@@ -328,43 +554,174 @@ async def driver_response(request: DriverResponseRequest):
 
 这个指令可能会影响你的驾驶表现和比赛策略。"""
 
-        else:
-            prompt = f"""用户对你说："{request.message}"
+    else:
+        prompt = f"""用户对你说："{request.message}"
 
 请根据你的个性、当前比赛情况和压力水平做出真实回应。
 - 如果是闲聊，可以简短回应但要保持专注
 - 如果是鼓励，表达感谢并保持信心
 - 如果是质疑，专业地解释你的判断"""
 
-        # 获取对话历史
-        conversation_history = getattr(request, 'conversationHistory', [])
-        
-        result = await generate_llm_response(prompt, enhanced_context, conversation_history)
-        
-        # 确保返回格式正确
-        if not isinstance(result, dict):
-            result = {"response": str(result), "mood": "professional", "strategyImpact": None}
-        
-        # 添加额外的比赛情境信息
-        result['raceContext'] = {
-            'currentLap': enhanced_context['currentLap'],
-            'position': enhanced_context['position'],
-            'isUnderPressure': enhanced_context['currentLap'] > 40 or enhanced_context['position'] > 15,
-            'isPitWindow': enhanced_context['currentLap'] in [15, 16, 17, 35, 36, 37, 38, 39, 40]
-        }
-            
-        return result
+    return prompt, enhanced_context
+
+async def rule_driver_response(request: DriverResponseRequest) -> Dict:
+    """规则引擎生成的车手回应（LLM超时或失败时使用）"""
+    result = await f1_ai.generate_driver_response(request.message, {
+        'driverName': request.driverName,
+        'teamContext': request.teamContext,
+    })
+    return finalize_llm_result(result)
+
+def radio_memory_key(request: DriverResponseRequest) -> Optional[str]:
+    """无线电记忆按比赛区分：优先用服务端会话ID，否则用客户端生成的radioSessionId"""
+    return request.sessionId or request.radioSessionId
+
+def attach_race_context(result: Dict, enhanced_context: Dict) -> Dict:
+    """添加额外的比赛情境信息"""
+    result['raceContext'] = {
+        'currentLap': enhanced_context['currentLap'],
+        'position': enhanced_context['position'],
+        'isUnderPressure': enhanced_context['currentLap'] > 40 or enhanced_context['position'] > 15,
+        'isPitWindow': enhanced_context['currentLap'] in [15, 16, 17, 35, 36, 37, 38, 39, 40]
+    }
+    return result
 
+@router.post("/api/chat/driver_response")
+async def driver_response(request: DriverResponseRequest):
+    """
+    车手AI回应（真实反应，包含恶意输入处理）
+    """
+    request = with_session_context(request)
+    try:
+        return await respond_as_driver(request)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"车手回应生成失败: {str(e)}")
 
-@router.post("/api/race/llm_strategy")
-async def llm_strategy_update(request: LLMStrategyRequest):
+DRIVER_LABEL_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,32}")
+
+def set_driver_character(driver_id: str):
+    """以车手ID作为LLM指标的角色标签；ID由客户端提供，不规范的统一记为 driver，避免标签基数失控"""
+    set_character(driver_id if DRIVER_LABEL_PATTERN.fullmatch(driver_id or "") else "driver")
+
+async def respond_as_driver(request: DriverResponseRequest) -> Dict:
+    """单个车手的完整回应流程（请求已补全会话情境）"""
+    set_driver_character(request.driverId)
+    with span("classify"):
+        prompt, enhanced_context = build_driver_prompt(request)
+
+    # 对话历史来自服务端的无线电记忆
+    memory_key = radio_memory_key(request)
+    conversation_history = radio_memory.history(memory_key, request.driverId)
+    
+    result = await generate_llm_response(
+        prompt, enhanced_context, conversation_history,
+        deadline=LLM_DEADLINES["driver_response"], fallback=lambda: rule_driver_response(request),
+    )
+    
+    # 确保返回格式正确
+    if not isinstance(result, dict):
+        result = {"response": str(result), "mood": "professional", "strategyImpact": None}
+    
+    radio_memory.record(memory_key, request.driverId, request.message, result.get('response'))
+    return attach_race_context(result, enhanced_context)
+
+@router.post("/api/chat/driver_response/batch")
+async def driver_response_batch(request: DriverBatchRequest):
+    """
+    同一条消息并发发给多位车手（Server-Sent Events）
+    每位车手完成即推送：result（含index、driverId）或 error（仅该车手失败），最后发送 done
     """
-    实时策略更新和无线电生成
+    items = []
+    for driver in request.drivers:
+        item = DriverResponseRequest(
+            message=request.message,
+            driverId=driver.driverId,
+            driverName=driver.driverName,
+            teamContext=driver.teamContext,
+            raceContext={**request.raceContext, **driver.raceContext},
+            sessionId=request.sessionId,
+            radioSessionId=request.radioSessionId,
+        )
+        # 会话不存在时整批返回404，而不是每位车手各报一次错
+        items.append(with_session_context(item))
+
+    semaphore = asyncio.Semaphore(DRIVER_BATCH_CONCURRENCY)
+
+    async def run(index: int, item: DriverResponseRequest):
+        async with semaphore:
+            try:
+                return index, item, await respond_as_driver(item), None
+            except HTTPException as e:
+                return index, item, None, {"status": e.status_code, "detail": e.detail}
+            except Exception as e:
+                return index, item, None, {"status": 500, "detail": f"车手回应生成失败: {str(e)}"}
+
+    async def event_stream():
+        tasks = [asyncio.ensure_future(run(index, item)) for index, item in enumerate(items)]
+        errors = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                index, item, result, error = await next_done
+                if error is None:
+                    yield sse_event("result", {"index": index, "driverId": item.driverId, **result})
+                else:
+                    errors += 1
+                    yield sse_event("error", {"index": index, "driverId": item.driverId, **error})
+            yield sse_event("done", {"count": len(items), "errors": errors})
+        finally:
+            # 客户端中途断开时取消尚未完成的生成
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@router.post("/api/chat/driver_response/stream")
+async def driver_response_stream(request: DriverResponseRequest):
+    """
+    车手AI回应的流式版本（Server-Sent Events）
+    response文本边生成边推送（delta），mood/strategyImpact等字段一闭合即推送（field），最后发送完整结果（done）
     """
+    request = with_session_context(request)
+    set_driver_character(request.driverId)
     try:
-        prompt = f"""
+        prompt, enhanced_context = build_driver_prompt(request)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"车手回应生成失败: {str(e)}")
+
+    memory_key = radio_memory_key(request)
+    conversation_history = radio_memory.history(memory_key, request.driverId)
+
+    async def event_stream():
+        # 限流、超时或出错时由 stream_llm_response 降级为规则引擎的回应
+        async for event, data in stream_llm_response(
+            prompt, enhanced_context, conversation_history,
+            deadline=LLM_DEADLINES["driver_response"], fallback=lambda: rule_driver_response(request),
+        ):
+            if event == "result":
+                radio_memory.record(memory_key, request.driverId, request.message, data.get('response'))
+                yield sse_event("done", attach_race_context(data, enhanced_context))
+            else:
+                yield sse_event(event, data)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+llm_strategy_flight = SingleFlight("llm_strategy")
+
+def llm_strategy_key(request: LLMStrategyRequest) -> str:
+    """同一圈、阶段、天气和前十名排序视为等价请求（忽略持续变化的差距数值）"""
+    top10 = sorted(request.classification, key=lambda car: car.get('position', 0))[:10]
+    return canonical_key({
+        "lap": request.currentLap,
+        "phase": request.phase,
+        "weather": request.weather,
+        "top10": [[car.get('id'), car.get('currentTyre'), bool(car.get('inPit'))] for car in top10],
+    })
+
+async def generate_strategy_update(request: LLMStrategyRequest) -> Dict:
+    """调用LLM生成策略更新"""
+    prompt = f"""
 F1比赛实时策略分析：
 
 当前圈数：{request.currentLap}
@@ -380,11 +737,27 @@ F1比赛实时策略分析：
 格式：JSON，包含strategyUpdates、teamRadio、eventPredictions字段
 """
 
-        result = await generate_llm_response(prompt, {
-            'currentLap': request.currentLap,
-            'phase': request.phase,
-            'weather': request.weather
-        })
+    result = await generate_llm_response(prompt, {
+        'currentLap': request.currentLap,
+        'phase': request.phase,
+        'weather': request.weather
+    }, deadline=LLM_DEADLINES["llm_strategy"], fallback=lambda: f1_ai.rule_strategy_update({
+        'currentLap': request.currentLap,
+        'classification': request.classification,
+    }))
+    return result
+
+@router.post("/api/race/llm_strategy")
+async def llm_strategy_update(request: LLMStrategyRequest):
+    """
+    实时策略更新和无线电生成（观看同一场比赛的并发请求合并为一次LLM调用）
+    """
+    request = with_session_context(request)
+    try:
+        result = await llm_strategy_flight.do(
+            llm_strategy_key(request),
+            lambda: generate_strategy_update(request)
+        )
 
         # 补充默认结构
         return {
@@ -397,9 +770,12 @@ F1比赛实时策略分析：
                     "teamColor": "#DC143C"
                 }
             ]),
-            "eventPredictions": result.get("eventPredictions", [])
+            "eventPredictions": result.get("eventPredictions", []),
+            "degraded": bool(result.get("degraded"))
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"LLM策略更新失败: {str(e)}")
 
@@ -408,6 +784,7 @@ async def generate_race_event(request: RaceEventRequest):
     """
     LLM生成真实比赛事件
     """
+    request = with_session_context(request)
     try:
         prompt = f"""
 根据当前比赛情况生成真实的F1比赛事件：
@@ -435,9 +812,15 @@ async def generate_race_event(request: RaceEventRequest):
         result = await generate_llm_response(prompt, {
             'currentLap': request.currentLap,
             'weather': request.weather
-        })
+        }, deadline=LLM_DEADLINES["generate_event"], fallback=lambda: f1_ai.generate_race_event({
+            'currentLap': request.currentLap,
+            'weather': request.weather,
+            'classification': request.classification,
+        }))
 
         return result
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"事件生成失败: {str(e)}")
@@ -1,17 +1,37 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
-import json
+from typing import Any, Dict, List, Optional
+import asyncio
+import hmac
+import httpx
 import os
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-import openai
 from dotenv import load_dotenv
+from openai import APIError
 from race_strategy import f1_ai
-from llm_endpoints import router as llm_router
+from llm_endpoints import router as llm_router, LLM_DEADLINES, degraded_result
+from race_hub import router as race_hub_router
+from race_session import router as race_session_router
+from race_recorder import router as race_recorder_router
+from llm_client import chat_completion, stream_chat_completion, is_llm_configured, close_llm_client
+from streaming import sse_event, SSE_HEADERS
+from conversation_store import ConversationStore, message_timestamps
+from conversation_index import ConversationIndex
+from db import SQLiteDatabase
+from user_store import UserRepository
+from password_pool import PasswordHasherPool, PasswordPoolSaturated
+from metrics import render_metrics, METRICS_CONTENT_TYPE
+from strategy_optimizer import shutdown_optimizer
+from request_metrics import RequestMetricsMiddleware, monitor_event_loop_lag, set_character
+from tracing import TracingMiddleware, span, recent_traces
+from keyword_classifier import classify, detect_skill
+from context_builder import build_history
+from admission import AdmissionRejected
 
 load_dotenv()
 
@@ -25,29 +45,37 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# 阶段追踪（Server-Timing响应头）；最外层按路由记录延迟和状态码
+app.add_middleware(TracingMiddleware)
+app.add_middleware(RequestMetricsMiddleware)
 
 # 注册LLM端点
 app.include_router(llm_router)
+app.include_router(race_hub_router)
+app.include_router(race_session_router)
+app.include_router(race_recorder_router)
 
 # Security
 security = HTTPBearer()
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+password_pool = PasswordHasherPool(pwd_context)
 
 # Configuration
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")
-
-# Initialize OpenAI client
-openai_client = None
-if OPENAI_API_KEY and OPENAI_API_KEY != "your_openai_api_key_here":
-    from openai import OpenAI
-    if OPENAI_BASE_URL:
-        openai_client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
-    else:
-        openai_client = OpenAI(api_key=OPENAI_API_KEY)
+CHAT_MODEL = "x-ai/grok-4-fast"
+
+@app.on_event("startup")
+async def startup():
+    app.state.loop_lag_monitor = asyncio.create_task(monitor_event_loop_lag())
+
+@app.on_event("shutdown")
+async def shutdown():
+    app.state.loop_lag_monitor.cancel()
+    await close_llm_client()
+    password_pool.shutdown()
+    shutdown_optimizer()
 
 # Data models
 class UserCreate(BaseModel):
@@ -84,6 +112,7 @@ class TeamCommunicationRequest(BaseModel):
     team_id: str
     driver_id: str
     message_type: str  # instruction, question, update
+    context: Dict[str, Any] = {}  # 比赛上下文，message 为车队消息
 
 class StrategyAnalysisRequest(BaseModel):
     weather: str
@@ -116,10 +145,21 @@ CONVERSATIONS_DIR = os.path.join(DATA_DIR, "conversations")
 os.makedirs(DATA_DIR, exist_ok=True)
 os.makedirs(CONVERSATIONS_DIR, exist_ok=True)
 
-# Initialize users file if it doesn't exist
-if not os.path.exists(USERS_FILE):
-    with open(USERS_FILE, 'w') as f:
-        json.dump({}, f)
+app_db = SQLiteDatabase(os.path.join(DATA_DIR, "app.db"))
+conversation_index = ConversationIndex(app_db)
+conversation_store = ConversationStore(
+    CONVERSATIONS_DIR,
+    fsync=os.getenv("CONVERSATION_FSYNC", "0") == "1",
+    index=conversation_index,
+)
+
+# 首次启用索引时从已有对话文件回填
+if conversation_index.needs_backfill():
+    conversation_index.rebuild(conversation_store)
+
+user_repository = UserRepository(app_db)
+# 旧版 users.json 一次性导入（之后不再读写该文件）
+user_repository.import_json(USERS_FILE)
 
 # AI Characters configuration with enhanced skills
 CHARACTERS = {
@@ -270,22 +310,26 @@ CHARACTERS = {
 }
 
 # Utility functions
-def load_users():
-    try:
-        with open(USERS_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except:
-        return {}
-
-def save_users(users):
-    with open(USERS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(users, f, ensure_ascii=False, indent=2)
+def password_pool_busy():
+    return HTTPException(
+        status_code=503,
+        detail="Server busy, please retry",
+        headers={"Retry-After": "1"},
+    )
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password, hashed_password):
+    try:
+        with span("password"):
+            return await password_pool.verify(plain_password, hashed_password)
+    except PasswordPoolSaturated:
+        raise password_pool_busy()
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def get_password_hash(password):
+    try:
+        with span("password"):
+            return await password_pool.hash(password)
+    except PasswordPoolSaturated:
+        raise password_pool_busy()
 
 def create_access_token(data: dict):
     to_encode = data.copy()
@@ -302,7 +346,8 @@ def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(securit
     )
     try:
         token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        with span("jwt"):
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
@@ -317,36 +362,39 @@ async def root():
 
 @app.post("/register")
 async def register(user: UserCreate):
-    users = load_users()
-    
-    if user.username in users:
+    if user_repository.get(user.username):
         raise HTTPException(
             status_code=400,
             detail="Username already registered"
         )
     
-    hashed_password = get_password_hash(user.password)
-    users[user.username] = {
-        "email": user.email,
-        "password": hashed_password,
-        "created_at": datetime.utcnow().isoformat(),
-        "conversations": []
-    }
+    hashed_password = await get_password_hash(user.password)
+    created = user_repository.create(
+        user.username,
+        email=user.email,
+        password_hash=hashed_password,
+        created_at=datetime.utcnow().isoformat()
+    )
+    if not created:
+        raise HTTPException(
+            status_code=400,
+            detail="Username already registered"
+        )
     
-    save_users(users)
     return {"message": "User registered successfully"}
 
 @app.post("/login")
 async def login(user: UserLogin):
-    users = load_users()
+    with span("user_lookup"):
+        stored_user = user_repository.get(user.username)
     
-    if user.username not in users:
+    if not stored_user:
         raise HTTPException(
             status_code=400,
             detail="Incorrect username or password"
         )
     
-    if not verify_password(user.password, users[user.username]["password"]):
+    if not await verify_password(user.password, stored_user["password"]):
         raise HTTPException(
             status_code=400,
             detail="Incorrect username or password"
@@ -355,101 +403,104 @@ async def login(user: UserLogin):
     access_token = create_access_token(data={"sub": user.username})
     return {"access_token": access_token, "token_type": "bearer"}
 
+DEBUG_TOKEN = os.getenv("DEBUG_TOKEN")   # 未配置时 /debug/traces 关闭
+
+@app.get("/debug/traces")
+async def debug_traces(limit: int = Query(50, ge=1, le=500), x_debug_token: Optional[str] = Header(None)):
+    """最近采样的慢请求及其各阶段耗时（需配置DEBUG_TOKEN，并在X-Debug-Token头中提供）"""
+    if not DEBUG_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_debug_token or not hmac.compare_digest(x_debug_token.encode(), DEBUG_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return {"traces": recent_traces(limit)}
+
+@app.get("/metrics")
+async def metrics():
+    return Response(content=render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
 @app.get("/characters")
 async def get_characters():
     return CHARACTERS
 
 def detect_skill_usage(message: str, character_skills: List[str]) -> Optional[str]:
-    """检测用户消息中需要使用的技能"""
-    message_lower = message.lower()
+    """检测用户消息中需要使用的技能（关键词分类器单次扫描）"""
+    return detect_skill(classify(message), character_skills)
+
+SKILL_HINTS = {
+    "知识问答": "当前用户正在寻求知识解答。请运用你的专业知识，详细而准确地回答上面的问题。如果是哲学问题，请使用苏格拉底式的问答方法。",
+    "情感支持": "用户似乎需要情感支持。请以温暖、理解和鼓励的方式回应，分享相关的个人经历来帮助用户。",
+    "创意写作": "用户正在寻求创意写作方面的帮助。请提供具体的写作建议、技巧或灵感，帮助用户完成他们的创作。",
+    "哲学思辨": "请使用苏格拉底式问答法，通过提出深刻的问题来引导用户思考。不要直接给出答案，而是帮助用户自己发现真理。",
+    "赛车策略": "用户正在询问赛车相关的问题。请运用你作为F1车手的专业知识和实战经验详细解答，分享具体的技巧、策略和赛道经验。",
+    "幽默互动": "用户希望轻松愉快的对话。请以幽默风趣的方式回应，保持轻松的氛围，分享有趣的经历或观点。",
+    "励志指导": "用户需要励志和指导。请以你的成功经验和人生感悟给出积极建议和鼓励，分享克服困难的故事。"
+}
+
+def enhance_message_with_skill(message: str, skill: Optional[str]) -> str:
+    """把技能提示附在本轮用户消息之后（系统提示保持不变，便于上游前缀缓存）"""
+    hint = SKILL_HINTS.get(skill) if skill else None
+    return f"{message}\n\n（{hint}）" if hint else message
+
+def build_chat_context(request: ChatRequest, current_user: str, character: dict):
+    """组装发送给LLM的消息列表，返回 (messages, conversation_id, detected_skill)
+    顺序为 静态角色提示 → 对话摘要 → 历史对话 → 本轮消息，前缀在同一角色的请求间逐字节相同"""
+    # 检测需要使用的技能
+    with span("skill"):
+        detected_skill = detect_skill_usage(request.message, character["skills"])
     
-    # 知识问答关键词
-    knowledge_keywords = ["什么是", "如何", "为什么", "解释", "告诉我", "问题", "疑问"]
-    # 情感支持关键词
-    emotional_keywords = ["难过", "困惑", "害怕", "担心", "焦虑", "帮助", "安慰", "鼓励"]
-    # 创意写作关键词
-    creative_keywords = ["写", "创作", "诗歌", "故事", "剧本", "灵感", "文学"]
-    # 赛车策略关键词
-    racing_keywords = ["赛车", "策略", "技巧", "比赛", "赛道", "轮胎", "超车", "f1", "formula"]
-    # 幽默互动关键词
-    humor_keywords = ["有趣", "幽默", "搞笑", "轻松", "开心", "娱乐"]
-    # 励志指导关键词
-    motivational_keywords = ["励志", "激励", "成功", "梦想", "坚持", "突破", "挑战"]
+    conversation_id = request.conversation_id or f"{current_user}_{request.character_id}_{int(datetime.utcnow().timestamp())}"
     
-    if any(keyword in message_lower for keyword in knowledge_keywords) and "知识问答" in character_skills:
-        return "知识问答"
-    elif any(keyword in message_lower for keyword in emotional_keywords) and "情感支持" in character_skills:
-        return "情感支持"
-    elif any(keyword in message_lower for keyword in creative_keywords) and "创意写作" in character_skills:
-        return "创意写作"
-    elif any(keyword in message_lower for keyword in racing_keywords) and "赛车策略" in character_skills:
-        return "赛车策略"
-    elif any(keyword in message_lower for keyword in humor_keywords) and "幽默互动" in character_skills:
-        return "幽默互动"
-    elif any(keyword in message_lower for keyword in motivational_keywords) and "励志指导" in character_skills:
-        return "励志指导"
+    messages = [{"role": "system", "content": character["prompt"]}]
     
-    return None
-
-def enhance_prompt_with_skill(base_prompt: str, skill: str, message: str) -> str:
-    """根据检测到的技能增强提示词"""
-    skill_enhancements = {
-        "知识问答": f"\n\n当前用户正在寻求知识解答。请运用你的专业知识，详细而准确地回答用户的问题：'{message}'。如果是哲学问题，请使用苏格拉底式的问答方法。",
-        "情感支持": f"\n\n用户似乎需要情感支持。请以温暖、理解和鼓励的方式回应，分享相关的个人经历来帮助用户：'{message}'。",
-        "创意写作": f"\n\n用户正在寻求创意写作方面的帮助。请提供具体的写作建议、技巧或灵感，帮助用户完成他们的创作：'{message}'。",
-        "哲学思辨": f"\n\n请使用苏格拉底式问答法，通过提出深刻的问题来引导用户思考：'{message}'。不要直接给出答案，而是帮助用户自己发现真理。",
-        "赛车策略": f"\n\n用户正在询问赛车相关的问题。请运用你作为F1车手的专业知识和实战经验，详细解答关于：'{message}'。分享具体的技巧、策略和赛道经验。",
-        "幽默互动": f"\n\n用户希望轻松愉快的对话。请以幽默风趣的方式回应：'{message}'，保持轻松的氛围，分享有趣的经历或观点。",
-        "励志指导": f"\n\n用户需要励志和指导。请以你的成功经验和人生感悟，给用户关于：'{message}'的积极建议和鼓励，分享克服困难的故事。"
-    }
+    # 按角色的token预算取最近对话，更早的部分以滚动摘要代替（从日志尾部读取，与对话长度无关）
+    with span("conversation_read"):
+        try:
+            messages.extend(build_history(conversation_store, conversation_id, request.character_id))
+        except ValueError as e:
+            # 非法的conversation_id（含路径分隔符等）
+            raise HTTPException(status_code=400, detail=str(e))
     
-    return base_prompt + skill_enhancements.get(skill, "")
-
-@app.post("/chat")
-async def chat(request: ChatRequest, current_user: str = Depends(get_current_user)):
-    if not openai_client:
+    # 添加当前用户消息（技能提示附在末尾）
+    messages.append({"role": "user", "content": enhance_message_with_skill(request.message, detected_skill)})
+    
+    return messages, conversation_id, detected_skill
+
+def save_chat_turn(conversation_id: str, current_user: str, request: ChatRequest, ai_response: str, detected_skill: Optional[str]):
+    """追加保存一轮用户/助手对话"""
+    user_time, reply_time = message_timestamps(2)
+    new_messages = [
+        {"role": "user", "content": request.message, "timestamp": user_time, "skill_used": detected_skill},
+        {"role": "assistant", "content": ai_response, "timestamp": reply_time}
+    ]
+    with span("conversation_write"):
+        conversation_store.append(conversation_id, new_messages, user=current_user, character_id=request.character_id)
+
+def get_chat_character(character_id: str) -> dict:
+    if not is_llm_configured():
         raise HTTPException(
             status_code=500,
             detail="LLM API not configured"
         )
     
-    character = CHARACTERS.get(request.character_id)
+    character = CHARACTERS.get(character_id)
     if not character:
         raise HTTPException(
             status_code=404,
             detail="Character not found"
         )
+    set_character(character_id)
+    return character
+
+@app.post("/chat")
+async def chat(request: ChatRequest, current_user: str = Depends(get_current_user)):
+    character = get_chat_character(request.character_id)
     
     try:
-        # 检测需要使用的技能
-        detected_skill = detect_skill_usage(request.message, character["skills"])
-        
-        # 根据技能增强提示词
-        enhanced_prompt = character["prompt"]
-        if detected_skill:
-            enhanced_prompt = enhance_prompt_with_skill(character["prompt"], detected_skill, request.message)
-        
-        # 加载对话历史
-        conversation_id = request.conversation_id or f"{current_user}_{request.character_id}_{int(datetime.utcnow().timestamp())}"
-        conversation_file = os.path.join(CONVERSATIONS_DIR, f"{conversation_id}.json")
-        
-        messages = [{"role": "system", "content": enhanced_prompt}]
-        
-        # 如果有对话历史，添加最近的几轮对话作为上下文
-        if os.path.exists(conversation_file):
-            with open(conversation_file, 'r', encoding='utf-8') as f:
-                existing_data = json.load(f)
-                # 只取最近的4轮对话作为上下文
-                recent_messages = existing_data["messages"][-8:] if len(existing_data["messages"]) > 8 else existing_data["messages"]
-                for msg in recent_messages:
-                    messages.append({"role": msg["role"], "content": msg["content"]})
-        
-        # 添加当前用户消息
-        messages.append({"role": "user", "content": request.message})
+        messages, conversation_id, detected_skill = build_chat_context(request, current_user, character)
         
         # 根据图片显示的模型使用 x-ai/grok-4-fast
-        response = openai_client.chat.completions.create(
-            model="x-ai/grok-4-fast",
+        response = await chat_completion(
+            model=CHAT_MODEL,
             messages=messages,
             max_tokens=800,
             temperature=0.7
@@ -458,57 +509,123 @@ async def chat(request: ChatRequest, current_user: str = Depends(get_current_use
         ai_response = response.choices[0].message.content
         
         # 保存对话
-        new_messages = [
-            {"role": "user", "content": request.message, "timestamp": datetime.utcnow().isoformat(), "skill_used": detected_skill},
-            {"role": "assistant", "content": ai_response, "timestamp": datetime.utcnow().isoformat()}
-        ]
-        
-        conversation_data = {
-            "user": current_user,
-            "character_id": request.character_id,
-            "messages": new_messages
-        }
-        
-        if os.path.exists(conversation_file):
-            with open(conversation_file, 'r', encoding='utf-8') as f:
-                existing_data = json.load(f)
-            existing_data["messages"].extend(new_messages)
-            conversation_data = existing_data
-        
-        with open(conversation_file, 'w', encoding='utf-8') as f:
-            json.dump(conversation_data, f, ensure_ascii=False, indent=2)
+        save_chat_turn(conversation_id, current_user, request, ai_response, detected_skill)
         
         return ChatResponse(response=ai_response, conversation_id=conversation_id)
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Error generating response: {str(e)}"
         )
 
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest, current_user: str = Depends(get_current_user)):
+    """
+    /chat的流式版本（Server-Sent Events）
+    事件顺序：meta（含conversation_id）→ 若干token → done；出错时发送error
+    """
+    character = get_chat_character(request.character_id)
+    
+    try:
+        messages, conversation_id, detected_skill = build_chat_context(request, current_user, character)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error generating response: {str(e)}"
+        )
+    
+    async def event_stream():
+        yield sse_event("meta", {"conversation_id": conversation_id, "skill_used": detected_skill})
+        
+        chunks = []
+        try:
+            async for delta in stream_chat_completion(
+                model=CHAT_MODEL,
+                messages=messages,
+                max_tokens=800,
+                temperature=0.7
+            ):
+                chunks.append(delta)
+                yield sse_event("token", {"delta": delta})
+            
+            ai_response = "".join(chunks)
+            save_chat_turn(conversation_id, current_user, request, ai_response, detected_skill)
+        except AdmissionRejected as e:
+            # 响应头已发出，无法再返回429，改为error事件
+            yield sse_event("error", {"status": e.status_code, "detail": e.detail, "retryAfter": e.retry_after})
+            return
+        except Exception as e:
+            yield sse_event("error", {"detail": f"Error generating response: {str(e)}"})
+            return
+        
+        yield sse_event("done", {"response": ai_response, "conversation_id": conversation_id})
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
 @app.get("/conversations")
-async def get_conversations(current_user: str = Depends(get_current_user)):
-    conversations = []
-    for filename in os.listdir(CONVERSATIONS_DIR):
-        if filename.endswith('.json') and current_user in filename:
-            filepath = os.path.join(CONVERSATIONS_DIR, filename)
-            with open(filepath, 'r', encoding='utf-8') as f:
-                conv_data = json.load(f)
-                conversations.append({
-                    "id": filename.replace('.json', ''),
-                    "character_id": conv_data["character_id"],
-                    "character_name": CHARACTERS[conv_data["character_id"]]["name"],
-                    "last_message": conv_data["messages"][-1]["content"][:100] if conv_data["messages"] else "",
-                    "timestamp": conv_data["messages"][-1]["timestamp"] if conv_data["messages"] else ""
-                })
+async def get_conversations(
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    character_id: Optional[str] = None,
+    current_user: str = Depends(get_current_user)
+):
+    """按时间倒序分页列出当前用户的对话，next_cursor为空表示没有更多"""
+    try:
+        with span("index_query"):
+            rows, next_cursor = conversation_index.list(current_user, limit=limit, cursor=cursor, character_id=character_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    return sorted(conversations, key=lambda x: x["timestamp"], reverse=True)
+    conversations = [{
+        "id": row["id"],
+        "character_id": row["character_id"],
+        "character_name": CHARACTERS.get(row["character_id"], {}).get("name", row["character_id"]),
+        "last_message": row["last_message"],
+        "timestamp": row["timestamp"]
+    } for row in rows]
+    
+    return {"conversations": conversations, "next_cursor": next_cursor}
+
+RACE_RADIO_SYSTEM_PROMPT = """你是F1比赛中的车队无线电通讯系统。
+
+请根据用户给出的当前比赛情况，生成真实的车队与车手之间的无线电对话，包括：
+1. 车队给车手的指令
+2. 车手向车队的反馈
+3. 战术讨论
+4. 比赛状况更新
+
+请用中文回复，保持F1比赛的紧张感和专业性。"""
+
+TEAM_RADIO_RULES = """
+
+当前你正在参加F1比赛。请以F1车手的身份，在比赛中通过无线电回应车队的指令或问题。
+保持简洁、专业，符合F1比赛中的真实通讯风格。"""
+
+def llm_failure_reason(error: Exception) -> str:
+    """降级原因，对应 llm_fallback_total 的 reason 标签"""
+    if isinstance(error, asyncio.TimeoutError):
+        return "timeout"
+    if isinstance(error, AdmissionRejected):
+        return "shed"
+    print(f"LLM调用错误: {error}")
+    return "error"
 
 @app.post("/race/simulate")
 async def simulate_race_communication(request: RaceSimulationRequest, current_user: str = Depends(get_current_user)):
     """模拟比赛中的车队通讯"""
-    if not openai_client:
-        raise HTTPException(status_code=500, detail="LLM API not configured")
+    def rule_communication():
+        return {"communication": "\n".join(
+            f"{radio['teamName']} {radio['driverName']}: {radio['message']}"
+            for radio in f1_ai.rule_strategy_update({})["teamRadio"]
+        )}
+    
+    if not is_llm_configured():
+        return await degraded_result({}, rule_communication, "not_configured")
     
     try:
         # 根据比赛阶段生成车队通讯
@@ -519,71 +636,74 @@ async def simulate_race_communication(request: RaceSimulationRequest, current_us
         进度: {request.progress}%
         """
         
-        prompt = f"""你是F1比赛中的车队无线电通讯系统。当前比赛情况：
-        {race_context}
-        
-        请生成真实的车队与车手之间的无线电对话，包括：
-        1. 车队给车手的指令
-        2. 车手向车队的反馈
-        3. 战术讨论
-        4. 比赛状况更新
-        
-        请用中文回复，保持F1比赛的紧张感和专业性。"""
-        
-        response = openai_client.chat.completions.create(
-            model="x-ai/grok-4-fast",
-            messages=[
-                {"role": "system", "content": prompt},
-                {"role": "user", "content": f"生成当前阶段的车队通讯内容"}
-            ],
-            max_tokens=300,
-            temperature=0.8
-        )
+        try:
+            response = await asyncio.wait_for(chat_completion(
+                model=CHAT_MODEL,
+                messages=[
+                    {"role": "system", "content": RACE_RADIO_SYSTEM_PROMPT},
+                    {"role": "user", "content": f"当前比赛情况：\n{race_context}\n生成当前阶段的车队通讯内容"}
+                ],
+                max_tokens=300,
+                temperature=0.8
+            ), timeout=LLM_DEADLINES["race_simulate"])
+        except (asyncio.TimeoutError, AdmissionRejected, APIError, httpx.HTTPError) as e:
+            # 超时、限流或调用失败时改用规则引擎生成的无线电
+            return await degraded_result({}, rule_communication, llm_failure_reason(e))
         
         return {"communication": response.choices[0].message.content}
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating race communication: {str(e)}")
 
 @app.post("/team/instruction")
 async def send_team_instruction(request: TeamCommunicationRequest, current_user: str = Depends(get_current_user)):
     """发送车队指令给车手"""
-    if not openai_client:
-        raise HTTPException(status_code=500, detail="LLM API not configured")
-    
     driver_character = CHARACTERS.get(request.driver_id)
     if not driver_character:
         raise HTTPException(status_code=404, detail="Driver not found")
+    set_character(request.driver_id)
+    
+    async def rule_reply():
+        reply = await f1_ai.generate_driver_response(
+            request.context.get('message', ''),
+            {"driverName": driver_character["name"], "teamContext": request.context},
+        )
+        return {"driver_response": reply["response"], "driver_name": driver_character["name"]}
+    
+    if not is_llm_configured():
+        return await degraded_result({}, rule_reply, "not_configured")
     
     try:
-        # 构建比赛上下文的提示词
-        race_prompt = f"""
-        {driver_character['prompt']}
-        
-        当前你正在参加F1比赛，比赛情况：
+        # 角色提示和无线电规则不变，比赛情况随车队消息放在最后
+        race_situation = f"""当前比赛情况：
         车队: {request.team_id}
         消息类型: {request.message_type}
         比赛上下文: {request.context}
-        
-        请以F1车手的身份，在比赛中通过无线电回应车队的指令或问题。
-        保持简洁、专业，符合F1比赛中的真实通讯风格。
         """
         
-        response = openai_client.chat.completions.create(
-            model="x-ai/grok-4-fast",
-            messages=[
-                {"role": "system", "content": race_prompt},
-                {"role": "user", "content": f"车队消息: {request.context.get('message', '')}"}
-            ],
-            max_tokens=200,
-            temperature=0.7
-        )
+        try:
+            response = await asyncio.wait_for(chat_completion(
+                model=CHAT_MODEL,
+                messages=[
+                    {"role": "system", "content": driver_character['prompt'] + TEAM_RADIO_RULES},
+                    {"role": "user", "content": f"{race_situation}\n车队消息: {request.context.get('message', '')}"}
+                ],
+                max_tokens=200,
+                temperature=0.7
+            ), timeout=LLM_DEADLINES["team_instruction"])
+        except (asyncio.TimeoutError, AdmissionRejected, APIError, httpx.HTTPError) as e:
+            # 超时、限流或调用失败时改用规则引擎的车手回应
+            return await degraded_result({}, rule_reply, llm_failure_reason(e))
         
         return {
             "driver_response": response.choices[0].message.content,
             "driver_name": driver_character["name"]
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating team communication: {str(e)}")
 
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+将 data/conversations 下旧版整文件 .json 对话迁移为追加写入的 .jsonl 格式
+用法: python migrate_conversations.py [--dir data/conversations] [--keep-legacy]
+"""
+
+import argparse
+import os
+import sys
+
+from conversation_store import ConversationStore, LEGACY_SUFFIX
+
+
+def main():
+    parser = argparse.ArgumentParser(description="迁移旧版对话文件为JSONL格式")
+    parser.add_argument("--dir", default=os.path.join("data", "conversations"), help="对话目录")
+    parser.add_argument("--keep-legacy", action="store_true", help="保留旧的 .json 文件")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.dir):
+        print(f"❌ 目录不存在: {args.dir}")
+        return 1
+
+    store = ConversationStore(args.dir)
+    migrated, skipped, failed = 0, 0, 0
+    for filename in sorted(os.listdir(args.dir)):
+        if not filename.endswith(LEGACY_SUFFIX):
+            continue
+        conversation_id = filename[:-len(LEGACY_SUFFIX)]
+        try:
+            if store.migrate_legacy(conversation_id, remove_legacy=not args.keep_legacy):
+                migrated += 1
+            else:
+                skipped += 1
+        except Exception as e:
+            failed += 1
+            print(f"⚠️  {filename} 迁移失败: {e}")
+
+    print(f"✅ 已迁移 {migrated} 个对话，跳过 {skipped} 个，失败 {failed} 个")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
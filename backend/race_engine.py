@@ -0,0 +1,268 @@
+"""
+服务端向量化比赛模拟引擎
+全部车辆状态保存为NumPy数组，形状为 (n_sims, n_cars)：实时比赛 n_sims=1，
+蒙特卡洛评估时一次推进成百上千场平行比赛。每个tick推进一圈，覆盖节奏系数、
+轮胎衰减与悬崖、燃油减重、进站损失、安全车和差距计算。
+"""
+
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+# 轮胎化合物（与前端 StrategyPrep 的 soft/medium/hard 对应）
+COMPOUNDS = ("soft", "medium", "hard", "intermediate", "wet")
+COMPOUND_INDEX = {name: i for i, name in enumerate(COMPOUNDS)}
+COMPOUND_PACE_OFFSET = np.array([-0.6, 0.0, 0.4, 3.0, 6.0])    # 相对中性胎的单圈时间差(s)
+COMPOUND_DEGRADATION = np.array([0.09, 0.06, 0.04, 0.05, 0.03])  # 每圈胎龄增加的时间(s)
+COMPOUND_LIFE = np.array([18, 28, 40, 30, 35])                   # 超过后进入衰减悬崖(圈)
+CLIFF_PENALTY = 0.35                                             # 悬崖后每圈额外损失(s)
+
+WEATHER_LAP_FACTOR = {"dry": 1.0, "light_rain": 1.06, "heavy_rain": 1.15}
+WEATHER_SAFETY_CAR_FACTOR = {"dry": 1.0, "light_rain": 2.0, "heavy_rain": 4.0}
+
+FUEL_START_KG = 110.0
+FUEL_BURN_PER_LAP = 1.8
+FUEL_EFFECT_PER_KG = 0.03
+PIT_LANE_LOSS = 20.0
+DEFAULT_PIT_SECONDS = 2.5
+SAFETY_CAR_LAPS = 4
+SAFETY_CAR_SLOWDOWN = 1.4
+SAFETY_CAR_GAP = 0.6
+GRID_PACE_STEP = 0.06   # 发车位每后移一位，基础节奏慢的秒数
+
+# 2024赛季车手（与前端 data/f1Data.js 一致，id 为 `${teamId}_${driverId}`）
+DEFAULT_GRID = [
+    {"id": f"{team_id}_{driver_id}", "driverId": driver_id, "name": name, "number": number,
+     "teamName": team_name, "teamColor": color}
+    for team_id, team_name, color, drivers in [
+        ("red_bull", "Red Bull Racing", "#0600EF", [("max_verstappen", "Max Verstappen", 1), ("sergio_perez", "Sergio Pérez", 11)]),
+        ("ferrari", "Ferrari", "#DC143C", [("charles_leclerc", "Charles Leclerc", 16), ("carlos_sainz", "Carlos Sainz Jr.", 55)]),
+        ("mclaren", "McLaren", "#FF8000", [("lando_norris", "Lando Norris", 4), ("oscar_piastri", "Oscar Piastri", 81)]),
+        ("mercedes", "Mercedes", "#00D2BE", [("lewis_hamilton", "Lewis Hamilton", 44), ("george_russell", "George Russell", 63)]),
+        ("aston_martin", "Aston Martin", "#006F62", [("fernando_alonso", "Fernando Alonso", 14), ("lance_stroll", "Lance Stroll", 18)]),
+        ("alpine", "Alpine", "#0090FF", [("pierre_gasly", "Pierre Gasly", 10), ("esteban_ocon", "Esteban Ocon", 31)]),
+        ("williams", "Williams", "#005AFF", [("alex_albon", "Alex Albon", 23), ("franco_colapinto", "Franco Colapinto", 43)]),
+        ("rb", "RB", "#6692FF", [("yuki_tsunoda", "Yuki Tsunoda", 22), ("daniel_ricciardo", "Daniel Ricciardo", 3)]),
+        ("haas", "Haas", "#FFFFFF", [("kevin_magnussen", "Kevin Magnussen", 20), ("nico_hulkenberg", "Nico Hülkenberg", 27)]),
+        ("sauber", "Sauber", "#52E252", [("valtteri_bottas", "Valtteri Bottas", 77), ("guanyu_zhou", "Zhou Guanyu", 24)]),
+    ]
+    for driver_id, name, number in drivers
+]
+
+DEFAULT_STRATEGY = {"plannedPitLaps": [28], "tyreSequence": ["medium", "hard"], "paceK": 1.0}
+
+
+def compound_index(name: Optional[str]) -> int:
+    return COMPOUND_INDEX.get((name or "medium").lower(), COMPOUND_INDEX["medium"])
+
+
+def encode_pit_plans(strategies: Sequence[Dict], max_stops: Optional[int] = None):
+    """把每车策略编码为 (n_cars, K) 的进站圈和换上的轮胎数组，不足处以-1填充"""
+    max_stops = max_stops or max([len(s.get("plannedPitLaps") or []) for s in strategies] + [1])
+    pit_laps = np.full((len(strategies), max_stops), -1, dtype=np.int16)
+    pit_compounds = np.full((len(strategies), max_stops), COMPOUND_INDEX["medium"], dtype=np.int8)
+    start_compounds = np.empty(len(strategies), dtype=np.int8)
+    for i, strategy in enumerate(strategies):
+        laps = list(strategy.get("plannedPitLaps") or [])[:max_stops]
+        tyres = list(strategy.get("tyreSequence") or ["medium"])
+        start_compounds[i] = compound_index(tyres[0])
+        for k, lap in enumerate(laps):
+            pit_laps[i, k] = int(lap)
+            pit_compounds[i, k] = compound_index(tyres[k + 1] if k + 1 < len(tyres) else tyres[-1])
+    return pit_laps, pit_compounds, start_compounds
+
+
+class RaceEngine:
+    def __init__(
+        self,
+        cars: Optional[List[Dict]] = None,
+        strategies: Optional[Dict[str, Dict]] = None,
+        total_laps: int = 57,
+        base_lap_time: float = 93.0,
+        weather: str = "dry",
+        track_temp: float = 42.0,
+        n_sims: int = 1,
+        seed: Optional[int] = None,
+        lap_noise: float = 0.15,
+        degradation_noise: float = 0.0,
+        safety_car_prob: float = 0.0,
+    ):
+        self.cars = list(cars or DEFAULT_GRID)
+        self.car_ids = [car["id"] for car in self.cars]
+        self._car_index = {car_id: i for i, car_id in enumerate(self.car_ids)}
+        self.n_cars = len(self.cars)
+        self.n_sims = n_sims
+        self.total_laps = total_laps
+        self.lap_noise = lap_noise
+        self._dry_lap_time = base_lap_time
+        self._dry_safety_car_prob = safety_car_prob
+        self.set_weather(weather)
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        self.lap = 0
+
+        strategies = strategies or {}
+        per_car = [{**DEFAULT_STRATEGY, **strategies.get(car_id, {})} for car_id in self.car_ids]
+        pit_laps, pit_compounds, start_compounds = encode_pit_plans(per_car)
+        shape = (n_sims, self.n_cars)
+
+        # 赛道温度越高衰减越快；每场平行比赛可叠加随机衰减系数
+        temp_factor = float(np.clip(1.0 + (track_temp - 35.0) * 0.02, 0.8, 1.4))
+        noise = self.rng.normal(0.0, degradation_noise, size=(n_sims, 1)) if degradation_noise else 0.0
+        self.degradation_factor = np.maximum(0.3, temp_factor * (1.0 + noise)) * np.ones(shape)
+
+        self.grid_offset = np.arange(self.n_cars) * GRID_PACE_STEP
+        self.pace_k = np.broadcast_to(np.array([s.get("paceK", 1.0) for s in per_car], dtype=np.float64), shape).copy()
+        self.pit_seconds = np.array([s.get("pitSeconds", DEFAULT_PIT_SECONDS) for s in per_car], dtype=np.float64)
+        self.pit_laps = np.broadcast_to(pit_laps, shape + pit_laps.shape[1:])
+        self.pit_compounds = np.broadcast_to(pit_compounds, shape + pit_compounds.shape[1:])
+
+        self.compound = np.broadcast_to(start_compounds, shape).copy()
+        self.tyre_age = np.zeros(shape)
+        self.fuel = np.broadcast_to(
+            np.array([s.get("fuelLoad", FUEL_START_KG) for s in per_car], dtype=np.float64), shape).copy()
+        # 发车位置差异：按发车顺序错开0.2秒
+        self.total_time = np.broadcast_to(np.arange(self.n_cars) * 0.2, shape).copy()
+        self.last_lap_time = np.zeros(shape)
+        self.pit_stops = np.zeros(shape, dtype=np.int16)
+        self.in_pit = np.zeros(shape, dtype=bool)
+        self.safety_car_laps_left = np.zeros(n_sims, dtype=np.int16)
+
+    # ---- 策略输入 ----
+    def set_pit_plans(self, pit_laps: np.ndarray, pit_compounds: np.ndarray, start_compounds: Optional[np.ndarray] = None):
+        """直接设置进站计划，形状可为 (n_cars, K) 或 (n_sims, n_cars, K)"""
+        shape = (self.n_sims, self.n_cars)
+        self.pit_laps = np.broadcast_to(pit_laps, shape + pit_laps.shape[-1:])
+        self.pit_compounds = np.broadcast_to(pit_compounds, shape + pit_compounds.shape[-1:])
+        if start_compounds is not None and self.lap == 0:
+            self.compound = np.broadcast_to(start_compounds, shape).copy()
+
+    def set_strategy(self, car_id: str, strategy: Dict):
+        """更新单车策略（未来的进站圈、轮胎顺序、节奏系数）"""
+        i = self._car_index[car_id]
+        pit_laps, pit_compounds, start = encode_pit_plans([{**DEFAULT_STRATEGY, **strategy}], self.pit_laps.shape[-1])
+        laps, compounds = self.pit_laps.copy(), self.pit_compounds.copy()
+        laps[:, i, :] = pit_laps[0]
+        compounds[:, i, :] = pit_compounds[0]
+        self.pit_laps, self.pit_compounds = laps, compounds
+        if self.lap == 0:
+            self.compound[:, i] = start[0]
+        if "paceK" in strategy:
+            self.pace_k[:, i] = float(strategy["paceK"])
+
+    def set_weather(self, weather: str):
+        """切换天气（影响之后各圈的基准圈速和安全车概率）"""
+        self.weather = weather if weather in WEATHER_LAP_FACTOR else "dry"
+        self.base_lap_time = self._dry_lap_time * WEATHER_LAP_FACTOR[self.weather]
+        self.safety_car_prob = self._dry_safety_car_prob * WEATHER_SAFETY_CAR_FACTOR[self.weather]
+
+    def apply_strategy_impact(self, car_id: str, pace_multiplier: float):
+        """应用LLM回应中的strategyImpact.paceMultiplier（与前端一致，限制在0.9~1.15）"""
+        i = self._car_index[car_id]
+        self.pace_k[:, i] *= max(0.9, min(1.15, float(pace_multiplier)))
+
+    # ---- 推进 ----
+    @property
+    def finished(self) -> bool:
+        return self.lap >= self.total_laps
+
+    def step(self):
+        """所有平行比赛的所有车辆推进一圈"""
+        if self.finished:
+            return
+        lap = self.lap + 1
+        shape = (self.n_sims, self.n_cars)
+
+        age = self.tyre_age + 1
+        compound = self.compound
+        lap_time = (
+            self.base_lap_time / self.pace_k
+            + self.grid_offset
+            + COMPOUND_PACE_OFFSET[compound]
+            + COMPOUND_DEGRADATION[compound] * self.degradation_factor * age
+            + np.maximum(0, age - COMPOUND_LIFE[compound]) * CLIFF_PENALTY
+            + self.fuel * FUEL_EFFECT_PER_KG
+        )
+        if self.lap_noise:
+            lap_time += self.rng.normal(0.0, self.lap_noise, size=shape)
+
+        # 安全车：随机出动，持续若干圈，期间圈速统一放慢、进站损失减半
+        if self.safety_car_prob:
+            deploy = (self.safety_car_laps_left == 0) & (self.rng.random(self.n_sims) < self.safety_car_prob)
+            self.safety_car_laps_left[deploy] = SAFETY_CAR_LAPS
+        safety_car = self.safety_car_laps_left > 0
+        if safety_car.any():
+            lap_time[safety_car] = self.base_lap_time * SAFETY_CAR_SLOWDOWN
+
+        # 进站
+        matches = self.pit_laps == lap
+        pitting = matches.any(axis=-1)
+        pit_loss = PIT_LANE_LOSS * np.where(safety_car, 0.5, 1.0)[:, None] + self.pit_seconds
+        lap_time += pitting * pit_loss
+
+        self.total_time += lap_time
+        self.last_lap_time = lap_time
+
+        if safety_car.any():
+            self._compress_gaps(safety_car)
+            self.safety_car_laps_left[safety_car] -= 1
+
+        new_compound = np.take_along_axis(self.pit_compounds, matches.argmax(axis=-1)[..., None], axis=-1)[..., 0]
+        self.compound = np.where(pitting, new_compound, compound)
+        self.tyre_age = np.where(pitting, 0, age)
+        self.pit_stops += pitting
+        self.in_pit = pitting
+        self.fuel = np.maximum(0.0, self.fuel - FUEL_BURN_PER_LAP)
+        self.lap = lap
+
+    def _compress_gaps(self, sims: np.ndarray):
+        """安全车期间车队压缩到固定间距"""
+        times = self.total_time[sims]
+        leader = times.min(axis=1, keepdims=True)
+        rank = times.argsort(axis=1).argsort(axis=1)
+        self.total_time[sims] = np.minimum(times, leader + rank * SAFETY_CAR_GAP)
+
+    def run_to_lap(self, lap: int):
+        while self.lap < min(lap, self.total_laps):
+            self.step()
+
+    def run_race(self):
+        self.run_to_lap(self.total_laps)
+        return self.positions()
+
+    # ---- 查询 ----
+    def positions(self) -> np.ndarray:
+        """每场比赛每辆车的名次（1起），形状 (n_sims, n_cars)"""
+        return self.total_time.argsort(axis=1).argsort(axis=1) + 1
+
+    def classification(self, sim: int = 0) -> List[Dict]:
+        """按名次排列的实时排名，字段与前端 liveRanking 一致"""
+        times = self.total_time[sim]
+        order = times.argsort()
+        leader_time = times[order[0]]
+        ranking = []
+        for position, i in enumerate(order, start=1):
+            car = self.cars[i]
+            compound = int(self.compound[sim, i])
+            ranking.append({
+                "id": car["id"],
+                "name": car.get("name"),
+                "teamName": car.get("teamName"),
+                "teamColor": car.get("teamColor"),
+                "position": position,
+                "lap": self.lap,
+                "totalTime": round(float(times[i]), 3),
+                "lastLapTime": round(float(self.last_lap_time[sim, i]), 3),
+                "gapSeconds": round(float(times[i] - leader_time), 3),
+                "inPit": bool(self.in_pit[sim, i]),
+                "pitStops": int(self.pit_stops[sim, i]),
+                "currentTyre": COMPOUNDS[compound],
+                "tyreAge": int(self.tyre_age[sim, i]),
+                "tyreWear": round(float(min(1.0, self.tyre_age[sim, i] / COMPOUND_LIFE[compound])), 3),
+                "paceK": round(float(self.pace_k[sim, i]), 4),
+            })
+        return ranking
+
+    @property
+    def safety_car(self) -> bool:
+        return bool(self.safety_car_laps_left[0] > 0)
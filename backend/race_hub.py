@@ -0,0 +1,293 @@
+"""
+比赛WebSocket推送中心
+客户端通过 /ws/race/{session_id} 订阅一场服务端比赛会话（见 race_session）；首帧为完整快照，
+之后每个tick推进一圈，把带版本号的排名增量、策略更新、车队无线电和事件合并成一帧，
+只序列化一次后扇出给所有订阅者。
+每个订阅者有独立的有界发送队列，慢客户端丢弃最旧的帧，不拖慢其他人。
+"""
+
+import asyncio
+import json
+import os
+import time
+from typing import Dict, List, Optional, Set
+
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
+from pydantic import BaseModel
+
+from admission import NARRATION, set_priority
+from metrics import Counter, Gauge, Histogram
+from race_session import RaceSession, race_sessions
+
+RACE_TICK_SECONDS = float(os.getenv("RACE_TICK_SECONDS", "1.0"))
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv("RACE_SUBSCRIBER_QUEUE_SIZE", "8"))
+STRATEGY_EVERY_N_TICKS = int(os.getenv("RACE_STRATEGY_EVERY_N_TICKS", "6"))
+
+HUB_SUBSCRIBERS = Gauge("race_hub_subscribers", "Connected race subscribers")
+HUB_CHANNELS = Gauge("race_hub_channels", "Active race channels")
+HUB_FRAMES = Counter("race_hub_frames_total", "Frames published per channel tick")
+HUB_DROPPED = Counter("race_hub_dropped_frames_total", "Frames dropped for slow subscribers")
+HUB_TICK_TIME = Histogram(
+    "race_hub_tick_seconds", "Time to simulate, serialize and fan out one tick",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25),
+)
+
+router = APIRouter()
+
+
+class Subscriber:
+    def __init__(self, websocket: WebSocket, queue_size: int = SUBSCRIBER_QUEUE_SIZE):
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+    def offer(self, frame: Optional[str]):
+        """非阻塞入队；队列满时丢弃最旧的一帧。None 表示频道关闭"""
+        if self.queue.full():
+            try:
+                self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+            self.dropped += 1
+            HUB_DROPPED.inc()
+        self.queue.put_nowait(frame)
+
+    async def run_sender(self):
+        """持续发送队列中的帧；连接已半关闭导致发送失败时结束，由 race_socket 移除订阅者"""
+        while True:
+            frame = await self.queue.get()
+            if frame is None:
+                # 比赛会话已删除或被淘汰
+                try:
+                    await self.websocket.close(code=4410)
+                except Exception:
+                    pass
+                return
+            try:
+                await self.websocket.send_text(frame)
+            except Exception as e:
+                print(f"比赛推送发送失败: {e}")
+                return
+
+
+async def drain_client(websocket: WebSocket):
+    """读取并丢弃客户端消息（仅用于保活和检测断开），连接断开时返回"""
+    try:
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+
+
+class RaceChannel:
+    def __init__(self, session: RaceSession, tick_interval: float = RACE_TICK_SECONDS):
+        self.session = session
+        self.session_id = session.id
+        self.engine = session.engine
+        self.tick_interval = tick_interval
+        self.subscribers: Set[Subscriber] = set()
+        self.tick = 0
+        self.version = session.version
+        self._pending_radio: List[Dict] = []
+        self._pending_events: List[Dict] = []
+        self._pending_strategy: Optional[Dict] = None
+        self._strategy_task: Optional[asyncio.Task] = None
+        self._ticker: Optional[asyncio.Task] = None
+
+    # ---- 订阅 ----
+    def add(self, subscriber: Subscriber):
+        self.subscribers.add(subscriber)
+        HUB_SUBSCRIBERS.inc()
+        # 新订阅者先收到完整快照，之后只收增量
+        subscriber.offer(self._encode({"type": "snapshot", **self.session.snapshot()}))
+        if self._ticker is None and not self.engine.finished:
+            self._ticker = asyncio.create_task(self._run())
+
+    def remove(self, subscriber: Subscriber):
+        if subscriber in self.subscribers:
+            self.subscribers.discard(subscriber)
+            HUB_SUBSCRIBERS.dec()
+
+    # ---- 发布 ----
+    def publish_radio(self, message: Dict):
+        """车队无线电在下一个tick随帧推送，同时写入比赛录制"""
+        self._pending_radio.append(message)
+        self.session.record_radio(message)
+
+    def publish_event(self, event: Dict):
+        self._pending_events.append(event)
+        self.session.record_event(event)
+
+    def broadcast(self, frame: Dict):
+        """序列化一次，扇出到所有订阅者"""
+        text = self._encode(frame)
+        for subscriber in list(self.subscribers):
+            subscriber.offer(text)
+        HUB_FRAMES.inc()
+
+    # ---- tick ----
+    async def _run(self):
+        try:
+            while self.subscribers and not self.engine.finished:
+                started = time.perf_counter()
+                self.step()
+                HUB_TICK_TIME.observe(time.perf_counter() - started)
+                await asyncio.sleep(max(0.0, self.tick_interval - (time.perf_counter() - started)))
+        finally:
+            self._ticker = None
+
+    def step(self):
+        """推进一圈并推送合并帧"""
+        self.session.advance(1)
+        self.tick += 1
+        if STRATEGY_EVERY_N_TICKS and self.tick % STRATEGY_EVERY_N_TICKS == 0:
+            self._request_strategy()
+        self.broadcast(self._frame())
+
+    def _frame(self) -> Dict:
+        # 增量从上一帧的版本算起，包含期间通过HTTP推进或下达的指令；历史不足时退回快照
+        delta = self.session.changes_since(self.version)
+        frame = {"type": "tick", "tick": self.tick, "finished": self.engine.finished}
+        frame.update(delta if delta is not None else {"type": "snapshot", **self.session.snapshot()})
+        self.version = self.session.version
+        frame["teamRadio"], self._pending_radio = self._pending_radio, []
+        frame["events"], self._pending_events = self._pending_events, []
+        if self._pending_strategy is not None:
+            frame["strategy"], self._pending_strategy = self._pending_strategy, None
+        return frame
+
+    def _request_strategy(self):
+        """后台请求LLM策略更新，结果随后续的帧推送；上一次未完成时跳过"""
+        if self._strategy_task is not None and not self._strategy_task.done():
+            return
+        from llm_endpoints import LLMStrategyRequest, generate_strategy_update, llm_strategy_flight, llm_strategy_key
+
+        request = LLMStrategyRequest(sessionId=self.session_id, **self.session.strategy_fields())
+
+        async def fetch():
+            set_priority(NARRATION)
+            # LLM繁忙时 generate_strategy_update 降级为规则引擎的策略更新
+            result = await llm_strategy_flight.do(llm_strategy_key(request), lambda: generate_strategy_update(request))
+            for message in result.get("teamRadio", []):
+                self.session.record_radio(message)
+            self._pending_strategy = {
+                "strategyUpdates": result.get("strategyUpdates", []),
+                "teamRadio": result.get("teamRadio", []),
+                "eventPredictions": result.get("eventPredictions", []),
+            }
+
+        self._strategy_task = asyncio.create_task(fetch())
+
+    def close(self):
+        """会话已不存在：停止推进并让所有订阅者断开"""
+        self.stop()
+        for subscriber in list(self.subscribers):
+            subscriber.offer(None)
+
+    def stop(self):
+        for task in (self._ticker, self._strategy_task):
+            if task is not None:
+                task.cancel()
+
+    @staticmethod
+    def _encode(frame: Dict) -> str:
+        return json.dumps(frame, ensure_ascii=False, separators=(",", ":"))
+
+
+class RaceHub:
+    def __init__(self):
+        self.channels: Dict[str, RaceChannel] = {}
+
+    def get(self, session_id: str) -> Optional[RaceChannel]:
+        return self.channels.get(session_id)
+
+    def get_or_create(self, session: RaceSession) -> RaceChannel:
+        channel = self.channels.get(session.id)
+        if channel is None:
+            channel = self.channels[session.id] = RaceChannel(session)
+            HUB_CHANNELS.set(len(self.channels))
+        return channel
+
+    def release(self, channel: RaceChannel):
+        """最后一个订阅者离开时回收频道（比赛会话保留，暂停推进）"""
+        if not channel.subscribers and self.channels.get(channel.session_id) is channel:
+            channel.stop()
+            del self.channels[channel.session_id]
+            HUB_CHANNELS.set(len(self.channels))
+
+    def close(self, session_id: str):
+        """比赛会话被删除或淘汰时关闭其频道"""
+        channel = self.channels.pop(session_id, None)
+        if channel is not None:
+            channel.close()
+            HUB_CHANNELS.set(len(self.channels))
+
+
+race_hub = RaceHub()
+race_sessions.on_remove(race_hub.close)
+
+
+@router.websocket("/ws/race/{session_id}")
+async def race_socket(websocket: WebSocket, session_id: str):
+    """订阅一场比赛的实时推送"""
+    session = race_sessions.get(session_id)
+    if session is None:
+        await websocket.close(code=4404)
+        return
+    await websocket.accept()
+    channel = race_hub.get_or_create(session)
+    subscriber = Subscriber(websocket)
+    channel.add(subscriber)
+    sender = asyncio.create_task(subscriber.run_sender())
+    receiver = asyncio.create_task(drain_client(websocket))
+    try:
+        # 任一方向结束（客户端断开或发送失败）即退出
+        await asyncio.wait({sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in (sender, receiver):
+            task.cancel()
+        await asyncio.gather(sender, receiver, return_exceptions=True)
+        channel.remove(subscriber)
+        race_hub.release(channel)
+
+
+class RadioPublishRequest(BaseModel):
+    teamName: str
+    driverName: str
+    message: str
+    teamColor: Optional[str] = None
+
+
+class EventPublishRequest(BaseModel):
+    type: str
+    description: str
+    drivers: List[str] = []
+
+
+@router.post("/api/race/hub/{session_id}/radio")
+async def publish_radio(session_id: str, request: RadioPublishRequest):
+    """向比赛的所有订阅者推送一条车队无线电；暂无订阅者时只写入比赛录制"""
+    session = race_sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Race session not found")
+    channel = race_hub.get(session_id)
+    if channel is None:
+        session.record_radio(request.model_dump())
+        return {"queued": False, "subscribers": 0}
+    channel.publish_radio(request.model_dump())
+    return {"queued": True, "subscribers": len(channel.subscribers)}
+
+
+@router.post("/api/race/hub/{session_id}/event")
+async def publish_event(session_id: str, request: EventPublishRequest):
+    """向比赛的所有订阅者推送一个比赛事件；暂无订阅者时只写入比赛录制"""
+    session = race_sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Race session not found")
+    event = {**request.model_dump(), "lap": session.engine.lap}
+    channel = race_hub.get(session_id)
+    if channel is None:
+        session.record_event(event)
+        return {"queued": False, "subscribers": 0}
+    channel.publish_event(event)
+    return {"queued": True, "subscribers": len(channel.subscribers)}
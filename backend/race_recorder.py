@@ -0,0 +1,301 @@
+"""
+比赛二进制录制与回放
+每场比赛会话写一个只追加的二进制日志：
+  文件头   magic(4) 版本(u16) 车辆数(u16) 总圈数(u16) 保留(u16) 种子(u64) 创建时间(f64) 元数据长度(u32) + 元数据JSON
+  圈记录   类型=1(u8) 圈数(u16) 安全车(u8) 天气(u8) + 每车一条定长记录
+  消息记录 类型=2无线电/3事件(u8) 圈数(u16) 长度(u32) + JSON
+回放时 mmap 日志并建立圈偏移索引，任意圈段直接按偏移解码，无需重新模拟。
+"""
+
+import asyncio
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from fastapi import APIRouter, HTTPException, Query, WebSocket, WebSocketDisconnect
+
+from race_engine import COMPOUNDS, COMPOUND_LIFE, WEATHER_LAP_FACTOR
+
+RECORDINGS_DIR = os.getenv("RACE_RECORDINGS_DIR", os.path.join("data", "recordings"))
+RACE_RECORDING_ENABLED = os.getenv("RACE_RECORDING", "1") == "1"
+REPLAY_TICK_SECONDS = float(os.getenv("RACE_REPLAY_TICK_SECONDS", os.getenv("RACE_TICK_SECONDS", "1.0")))
+
+MAGIC = b"F1RL"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sHHHHQdI")
+TICK_HEADER = struct.Struct("<BHBB")
+MESSAGE_HEADER = struct.Struct("<BHI")
+# 名次 轮胎 是否进站 进站次数 胎龄 磨损(千分比) 总时间 上圈时间 与头车差距 节奏系数
+CAR_RECORD = struct.Struct("<BBBBHHdfff")
+CAR_DTYPE = np.dtype([
+    ("position", "u1"), ("compound", "u1"), ("inPit", "u1"), ("pitStops", "u1"),
+    ("tyreAge", "<u2"), ("tyreWear", "<u2"), ("totalTime", "<f8"),
+    ("lastLapTime", "<f4"), ("gapSeconds", "<f4"), ("paceK", "<f4"),
+])
+
+RECORD_TICK = 1
+RECORD_RADIO = 2
+RECORD_EVENT = 3
+
+WEATHERS = list(WEATHER_LAP_FACTOR)
+_SESSION_ID = re.compile(r"^[0-9a-f]{32}$")
+
+router = APIRouter()
+
+
+def recording_path(session_id: str, directory: str = RECORDINGS_DIR) -> str:
+    if not _SESSION_ID.match(session_id):
+        raise ValueError(f"invalid session id: {session_id!r}")
+    return os.path.join(directory, f"{session_id}.f1r")
+
+
+class RaceRecorder:
+    """追加写入一场比赛的录制日志"""
+
+    def __init__(self, path: str, engine, metadata: Dict):
+        self.path = path
+        self.n_cars = engine.n_cars
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        meta = json.dumps({**metadata, "cars": engine.cars}, ensure_ascii=False).encode("utf-8")
+        header = HEADER.pack(MAGIC, FORMAT_VERSION, engine.n_cars, engine.total_laps, 0,
+                             int(engine.seed or 0) & 0xFFFFFFFFFFFFFFFF, time.time(), len(meta))
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            self._write_all(fd, header + meta)
+        finally:
+            os.close(fd)
+
+    def record_tick(self, engine):
+        """写入当前圈所有车辆的状态（直接读取引擎数组，第0场模拟）"""
+        times = engine.total_time[0]
+        positions = np.empty(engine.n_cars, dtype=np.int64)
+        positions[times.argsort()] = np.arange(1, engine.n_cars + 1)
+        leader = times.min()
+        compound = engine.compound[0]
+        life = np.array([COMPOUND_LIFE[int(c)] for c in compound], dtype=np.float64)
+        cars = np.empty(engine.n_cars, dtype=CAR_DTYPE)
+        cars["position"] = positions
+        cars["compound"] = compound
+        cars["inPit"] = engine.in_pit[0]
+        cars["pitStops"] = engine.pit_stops[0]
+        cars["tyreAge"] = engine.tyre_age[0]
+        cars["tyreWear"] = np.minimum(1.0, engine.tyre_age[0] / life) * 1000
+        cars["totalTime"] = times
+        cars["lastLapTime"] = engine.last_lap_time[0]
+        cars["gapSeconds"] = times - leader
+        cars["paceK"] = engine.pace_k[0]
+        weather = WEATHERS.index(engine.weather)
+        self._append(TICK_HEADER.pack(RECORD_TICK, engine.lap, int(engine.safety_car), weather) + cars.tobytes())
+
+    def record_radio(self, lap: int, message: Dict):
+        self._append_message(RECORD_RADIO, lap, message)
+
+    def record_event(self, lap: int, event: Dict):
+        self._append_message(RECORD_EVENT, lap, event)
+
+    def _append_message(self, kind: int, lap: int, payload: Dict):
+        body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self._append(MESSAGE_HEADER.pack(kind, lap, len(body)) + body)
+
+    def _append(self, record: bytes):
+        # 每条记录一次 O_APPEND 写入，会话不常驻文件描述符
+        with self._lock:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+            try:
+                self._write_all(fd, record)
+            finally:
+                os.close(fd)
+
+    @staticmethod
+    def _write_all(fd: int, data: bytes):
+        view = memoryview(data)
+        while view:
+            written = os.write(fd, view)
+            view = view[written:]
+
+
+class RaceRecording:
+    """mmap 只读打开录制日志，建立圈偏移索引"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n_cars, total_laps, _, seed, created_at, meta_len = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"not a race recording: {path}")
+        self.n_cars = n_cars
+        self.total_laps = total_laps
+        self.seed = seed
+        self.created_at = created_at
+        self.metadata = json.loads(bytes(self._mm[HEADER.size:HEADER.size + meta_len]))
+        self.cars = self.metadata.get("cars", [])
+        self.tick_size = TICK_HEADER.size + n_cars * CAR_DTYPE.itemsize
+        # 每个圈记录的偏移，以及紧随其后（下一圈之前）的消息记录偏移
+        self.ticks: List[Tuple[int, int]] = []
+        self.messages: List[List[int]] = []
+        self._build_index(HEADER.size + meta_len)
+
+    def _build_index(self, offset: int):
+        size = len(self._mm)
+        pending: List[int] = []
+        while offset < size:
+            kind = self._mm[offset]
+            if kind == RECORD_TICK:
+                if offset + self.tick_size > size:
+                    break  # 写入中途的残缺记录
+                lap = struct.unpack_from("<H", self._mm, offset + 1)[0]
+                self.ticks.append((lap, offset))
+                self.messages.append([])
+                offset += self.tick_size
+            elif kind in (RECORD_RADIO, RECORD_EVENT):
+                if offset + MESSAGE_HEADER.size > size:
+                    break
+                _, _, length = MESSAGE_HEADER.unpack_from(self._mm, offset)
+                if offset + MESSAGE_HEADER.size + length > size:
+                    break
+                (self.messages[-1] if self.messages else pending).append(offset)
+                offset += MESSAGE_HEADER.size + length
+            else:
+                break
+        if pending and self.messages:
+            self.messages[0][:0] = pending
+
+    @property
+    def laps(self) -> List[int]:
+        return [lap for lap, _ in self.ticks]
+
+    def _tick_range(self, from_lap: Optional[int], to_lap: Optional[int]) -> range:
+        start = 0 if from_lap is None else next((i for i, (lap, _) in enumerate(self.ticks) if lap >= from_lap), len(self.ticks))
+        end = len(self.ticks) if to_lap is None else next((i for i, (lap, _) in enumerate(self.ticks) if lap > to_lap), len(self.ticks))
+        return range(start, end)
+
+    def car_states(self, from_lap: Optional[int] = None, to_lap: Optional[int] = None) -> np.ndarray:
+        """按圈堆叠的车辆状态结构化数组 (圈数, 车辆数)，供批量分析使用"""
+        indices = self._tick_range(from_lap, to_lap)
+        states = np.empty((len(indices), self.n_cars), dtype=CAR_DTYPE)
+        for row, i in enumerate(indices):
+            offset = self.ticks[i][1] + TICK_HEADER.size
+            states[row] = np.frombuffer(self._mm, dtype=CAR_DTYPE, count=self.n_cars, offset=offset)
+        return states
+
+    def frames(self, from_lap: Optional[int] = None, to_lap: Optional[int] = None) -> Iterator[Dict]:
+        """逐圈解码为与实时推送一致的帧"""
+        for i in self._tick_range(from_lap, to_lap):
+            yield self._decode_frame(i)
+
+    def _decode_frame(self, i: int) -> Dict:
+        lap, offset = self.ticks[i]
+        _, _, safety_car, weather = TICK_HEADER.unpack_from(self._mm, offset)
+        ranking = []
+        for car, values in zip(self.cars, CAR_RECORD.iter_unpack(
+                self._mm[offset + TICK_HEADER.size:offset + self.tick_size])):
+            position, compound, in_pit, pit_stops, tyre_age, wear, total, last_lap, gap, pace = values
+            ranking.append({
+                "id": car["id"],
+                "name": car.get("name"),
+                "teamName": car.get("teamName"),
+                "teamColor": car.get("teamColor"),
+                "position": position,
+                "lap": lap,
+                "totalTime": round(total, 3),
+                "lastLapTime": round(last_lap, 3),
+                "gapSeconds": round(gap, 3),
+                "inPit": bool(in_pit),
+                "pitStops": pit_stops,
+                "currentTyre": COMPOUNDS[compound],
+                "tyreAge": tyre_age,
+                "tyreWear": wear / 1000,
+                "paceK": round(pace, 4),
+            })
+        ranking.sort(key=lambda row: row["position"])
+
+        radio, events = [], []
+        for message_offset in self.messages[i]:
+            kind, _, length = MESSAGE_HEADER.unpack_from(self._mm, message_offset)
+            start = message_offset + MESSAGE_HEADER.size
+            payload = json.loads(bytes(self._mm[start:start + length]))
+            (radio if kind == RECORD_RADIO else events).append(payload)
+
+        return {
+            "type": "replay",
+            "lap": lap,
+            "totalLaps": self.total_laps,
+            "safetyCar": bool(safety_car),
+            "weather": WEATHERS[weather] if weather < len(WEATHERS) else "dry",
+            "classification": ranking,
+            "teamRadio": radio,
+            "events": events,
+        }
+
+    def summary(self) -> Dict:
+        return {
+            "seed": self.seed,
+            "createdAt": self.created_at,
+            "totalLaps": self.total_laps,
+            "recordedLaps": len(self.ticks),
+            "cars": self.cars,
+            "metadata": {key: value for key, value in self.metadata.items() if key != "cars"},
+        }
+
+    def close(self):
+        self._mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_recording(session_id: str) -> RaceRecording:
+    try:
+        path = recording_path(session_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Recording not found")
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Recording not found")
+    try:
+        return RaceRecording(path)
+    except (ValueError, struct.error) as e:
+        raise HTTPException(status_code=500, detail=f"录制文件损坏: {str(e)}")
+
+
+@router.get("/api/race/recordings/{session_id}")
+async def get_recording(session_id: str,
+                        from_lap: Optional[int] = Query(None, ge=0),
+                        to_lap: Optional[int] = Query(None, ge=0)):
+    """读取录制的任意圈段"""
+    with open_recording(session_id) as recording:
+        return {**recording.summary(), "frames": list(recording.frames(from_lap, to_lap))}
+
+
+@router.websocket("/ws/race/replay/{session_id}")
+async def replay_socket(websocket: WebSocket, session_id: str,
+                        speed: float = 1.0, from_lap: Optional[int] = None, to_lap: Optional[int] = None):
+    """按N倍速回放录制"""
+    try:
+        recording = open_recording(session_id)
+    except HTTPException:
+        await websocket.close(code=4404)
+        return
+    await websocket.accept()
+    interval = REPLAY_TICK_SECONDS / max(0.1, speed)
+    try:
+        with recording:
+            await websocket.send_json({"type": "header", **recording.summary()})
+            for frame in recording.frames(from_lap, to_lap):
+                await websocket.send_text(json.dumps(frame, ensure_ascii=False, separators=(",", ":")))
+                await asyncio.sleep(interval)
+            await websocket.send_json({"type": "end"})
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
@@ -0,0 +1,366 @@
+"""
+服务端比赛会话
+比赛只在创建时上传一次（车辆、策略、天气），之后客户端只发送增量操作（推进圈数、车手指令），
+服务端返回带版本号的增量变化。所有端点通过 sessionId 读取同一份比赛状态。
+每个会话以固定种子创建，并把逐圈状态、无线电和事件录制到二进制日志（见 race_recorder）。
+"""
+
+import os
+import secrets
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Callable, Dict, List, Optional
+
+from fastapi import APIRouter, HTTPException, Query
+from pydantic import BaseModel
+
+from metrics import Counter, Gauge
+from race_engine import RaceEngine
+from race_recorder import RACE_RECORDING_ENABLED, RaceRecorder, recording_path
+from radio_memory import radio_memory
+
+RACE_SESSION_MAX = int(os.getenv("RACE_SESSION_MAX", "1000"))
+RACE_SESSION_IDLE_TTL = float(os.getenv("RACE_SESSION_IDLE_TTL", "3600"))
+RACE_SESSION_DELTA_HISTORY = int(os.getenv("RACE_SESSION_DELTA_HISTORY", "120"))
+
+SESSIONS_ACTIVE = Gauge("race_sessions_active", "Race sessions held in memory")
+SESSIONS_EVICTED = Counter("race_sessions_evicted_total", "Race sessions evicted", ["reason"])
+SESSION_SYNC = Counter("race_session_sync_total", "Race session reads by response kind", ["kind"])
+
+router = APIRouter()
+
+
+class RaceSession:
+    def __init__(self, session_id: str, engine: RaceEngine, track_temp: float = 42.0,
+                 recorder: Optional[RaceRecorder] = None):
+        self.id = session_id
+        self.engine = engine
+        self.track_temp = track_temp
+        self.recorder = recorder
+        self.version = 0
+        self.created_at = time.time()
+        self.last_access = time.monotonic()
+        self._deltas: deque = deque(maxlen=RACE_SESSION_DELTA_HISTORY)
+        self._state = self._current_state()
+        if recorder is not None:
+            recorder.record_tick(engine)
+
+    # ---- 读取 ----
+    @property
+    def phase(self) -> str:
+        if self.engine.finished:
+            return "finish"
+        return "start" if self.engine.lap == 0 else "race"
+
+    @property
+    def weather(self) -> Dict:
+        return {"condition": self.engine.weather, "trackTemp": self.track_temp}
+
+    def touch(self):
+        self.last_access = time.monotonic()
+
+    def snapshot(self) -> Dict:
+        return {
+            "sessionId": self.id,
+            "version": self.version,
+            "snapshot": True,
+            "seed": self.engine.seed,
+            **self._state["race"],
+            "classification": list(self._state["cars"].values()),
+        }
+
+    def changes_since(self, version: int) -> Optional[Dict]:
+        """合并version之后的所有增量；历史已被淘汰时返回None，客户端需重新拉取快照"""
+        if version > self.version:
+            return None
+        if version == self.version:
+            return {"sessionId": self.id, "fromVersion": version, "version": self.version, "changes": {}}
+        if not self._deltas or self._deltas[0]["version"] > version + 1:
+            return None
+
+        merged: Dict = {}
+        for delta in self._deltas:
+            if delta["version"] <= version:
+                continue
+            for key, value in delta["changes"].items():
+                if key == "cars":
+                    cars = merged.setdefault("cars", {})
+                    for car_id, fields in value.items():
+                        cars.setdefault(car_id, {}).update(fields)
+                elif key == "instructions":
+                    merged.setdefault("instructions", []).extend(value)
+                else:
+                    merged[key] = value
+        return {"sessionId": self.id, "fromVersion": version, "version": self.version, "changes": merged}
+
+    def find_car(self, car_id: str) -> Optional[Dict]:
+        """按车辆ID或车手ID查找实时排名行"""
+        row = self._state["cars"].get(car_id)
+        if row is not None:
+            return row
+        for car in self.engine.cars:
+            if car.get("driverId") == car_id or car.get("name") == car_id:
+                return self._state["cars"].get(car["id"])
+        return None
+
+    def team_context(self, car_id: str) -> Dict:
+        """车手回应使用的车队情境（字段与前端 teamContext 一致）"""
+        row = self.find_car(car_id)
+        if row is None:
+            return {"currentLap": self.engine.lap, "totalLaps": self.engine.total_laps}
+        return {
+            "name": row.get("teamName") or "",
+            "currentLap": self.engine.lap,
+            "totalLaps": self.engine.total_laps,
+            "position": row["position"],
+            "gap": f"+{row['gapSeconds']:.2f}s",
+            "tyreCondition": row["currentTyre"],
+            "tyreWear": row["tyreWear"],
+        }
+
+    def race_context(self) -> Dict:
+        return {
+            "weather": self.weather,
+            "raceFlag": "safety_car" if self.engine.safety_car else "green",
+            "phase": self.phase,
+        }
+
+    def strategy_fields(self) -> Dict:
+        """LLMStrategyRequest / RaceEventRequest 需要的比赛字段"""
+        return {
+            "currentLap": self.engine.lap,
+            "weather": self.weather,
+            "classification": list(self._state["cars"].values()),
+            "phase": self.phase,
+        }
+
+    # ---- 修改 ----
+    def advance(self, laps: int = 1) -> int:
+        for _ in range(laps):
+            if self.engine.finished:
+                break
+            self.engine.step()
+            if self.recorder is not None:
+                self.recorder.record_tick(self.engine)
+        return self._commit()
+
+    def set_weather(self, condition: str) -> int:
+        self.engine.set_weather(condition)
+        self.record_event({"type": "weather", "condition": self.engine.weather})
+        return self._commit()
+
+    def record_radio(self, message: Dict):
+        if self.recorder is not None:
+            self.recorder.record_radio(self.engine.lap, message)
+
+    def record_event(self, event: Dict):
+        if self.recorder is not None:
+            self.recorder.record_event(self.engine.lap, event)
+
+    def apply_instruction(self, car_id: str, strategy: Optional[Dict] = None,
+                          pace_multiplier: Optional[float] = None, message: Optional[str] = None) -> int:
+        row = self.find_car(car_id)
+        if row is None:
+            raise KeyError(car_id)
+        if strategy:
+            self.engine.set_strategy(row["id"], strategy)
+        if pace_multiplier is not None:
+            self.engine.apply_strategy_impact(row["id"], pace_multiplier)
+        instruction = {"carId": row["id"], "lap": self.engine.lap}
+        if strategy:
+            instruction["strategy"] = strategy
+        if pace_multiplier is not None:
+            instruction["paceMultiplier"] = pace_multiplier
+        if message:
+            instruction["message"] = message
+        self.record_event({"type": "instruction", **instruction})
+        return self._commit([instruction])
+
+    def _current_state(self) -> Dict:
+        return {
+            "race": {
+                "lap": self.engine.lap,
+                "totalLaps": self.engine.total_laps,
+                "phase": self.phase,
+                "weather": self.weather,
+                "safetyCar": self.engine.safety_car,
+            },
+            "cars": {row["id"]: row for row in self.engine.classification()},
+        }
+
+    def _commit(self, instructions: Optional[List[Dict]] = None) -> int:
+        """与上一版本比较，记录字段级增量"""
+        state = self._current_state()
+        changes: Dict = {key: value for key, value in state["race"].items() if self._state["race"].get(key) != value}
+        cars = {}
+        for car_id, row in state["cars"].items():
+            previous = self._state["cars"].get(car_id, {})
+            fields = {key: value for key, value in row.items() if previous.get(key) != value}
+            if fields:
+                cars[car_id] = fields
+        if cars:
+            changes["cars"] = cars
+        if instructions:
+            changes["instructions"] = instructions
+        self._state = state
+        self.touch()
+        if changes:
+            self.version += 1
+            self._deltas.append({"version": self.version, "changes": changes})
+        return self.version
+
+
+class RaceSessionStore:
+    def __init__(self, max_sessions: int = RACE_SESSION_MAX, idle_ttl: float = RACE_SESSION_IDLE_TTL):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self._sessions: "OrderedDict[str, RaceSession]" = OrderedDict()
+        self._remove_listeners: List[Callable[[str], None]] = []
+
+    def on_remove(self, listener: Callable[[str], None]):
+        """注册会话被删除或淘汰时的回调（如推送中心关闭频道）"""
+        self._remove_listeners.append(listener)
+
+    def create(self, engine: RaceEngine, track_temp: float = 42.0, metadata: Optional[Dict] = None) -> RaceSession:
+        self._evict()
+        session_id = uuid.uuid4().hex
+        recorder = None
+        if RACE_RECORDING_ENABLED:
+            recorder = RaceRecorder(recording_path(session_id), engine,
+                                    {"sessionId": session_id, "trackTemp": track_temp, **(metadata or {})})
+        session = RaceSession(session_id, engine, track_temp, recorder)
+        self._sessions[session.id] = session
+        SESSIONS_ACTIVE.set(len(self._sessions))
+        return session
+
+    def get(self, session_id: str) -> Optional[RaceSession]:
+        session = self._sessions.get(session_id)
+        if session is not None:
+            self._sessions.move_to_end(session_id)
+            session.touch()
+        return session
+
+    def remove(self, session_id: str) -> bool:
+        removed = self._discard(session_id)
+        SESSIONS_ACTIVE.set(len(self._sessions))
+        return removed
+
+    def _evict(self):
+        cutoff = time.monotonic() - self.idle_ttl
+        for session_id in [sid for sid, s in self._sessions.items() if s.last_access < cutoff]:
+            self._discard(session_id)
+            SESSIONS_EVICTED.labels("idle").inc()
+        while len(self._sessions) >= self.max_sessions:
+            self._discard(next(iter(self._sessions)))
+            SESSIONS_EVICTED.labels("capacity").inc()
+        SESSIONS_ACTIVE.set(len(self._sessions))
+
+    def _discard(self, session_id: str) -> bool:
+        """删除和淘汰共用：丢弃会话、其车手无线电记忆，并通知推送中心关闭频道"""
+        removed = self._sessions.pop(session_id, None) is not None
+        radio_memory.forget_session(session_id)
+        for listener in self._remove_listeners:
+            listener(session_id)
+        return removed
+
+
+race_sessions = RaceSessionStore()
+
+
+def get_race_session(session_id: str) -> RaceSession:
+    session = race_sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Race session not found")
+    return session
+
+
+def session_delta(session: RaceSession, since: Optional[int]) -> Dict:
+    """返回since之后的增量；since缺省或历史不足时返回完整快照"""
+    if since is not None:
+        delta = session.changes_since(since)
+        if delta is not None:
+            SESSION_SYNC.labels("delta").inc()
+            return delta
+    SESSION_SYNC.labels("snapshot").inc()
+    return session.snapshot()
+
+
+class RaceSessionCreateRequest(BaseModel):
+    cars: Optional[List[dict]] = None
+    strategies: Optional[Dict[str, dict]] = None
+    totalLaps: int = 57
+    weather: str = "dry"
+    trackTemp: float = 42.0
+    seed: Optional[int] = None
+
+
+class RaceSessionAdvanceRequest(BaseModel):
+    laps: int = 1
+    since: Optional[int] = None
+    weather: Optional[str] = None
+
+
+class RaceSessionInstructionRequest(BaseModel):
+    carId: str
+    strategy: Optional[dict] = None
+    paceMultiplier: Optional[float] = None
+    message: Optional[str] = None
+    since: Optional[int] = None
+
+
+@router.post("/api/race/sessions")
+async def create_race_session(request: RaceSessionCreateRequest):
+    """创建比赛会话，返回初始快照（未指定种子时随机生成并返回，便于复现）"""
+    seed = request.seed if request.seed is not None else secrets.randbits(32)
+    try:
+        engine = RaceEngine(
+            cars=request.cars,
+            strategies=request.strategies,
+            total_laps=request.totalLaps,
+            weather=request.weather,
+            track_temp=request.trackTemp,
+            seed=seed,
+        )
+    except (KeyError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"比赛参数无效: {str(e)}")
+    session = race_sessions.create(engine, request.trackTemp, {"weather": request.weather})
+    return session.snapshot()
+
+
+@router.get("/api/race/sessions/{session_id}")
+async def get_race_session_state(session_id: str, since: Optional[int] = Query(None, ge=0)):
+    """获取比赛状态：带since时只返回之后的增量"""
+    return session_delta(get_race_session(session_id), since)
+
+
+@router.post("/api/race/sessions/{session_id}/advance")
+async def advance_race_session(session_id: str, request: RaceSessionAdvanceRequest):
+    """推进比赛若干圈（可同时切换天气）"""
+    if not 0 <= request.laps <= 100:
+        raise HTTPException(status_code=400, detail="laps must be between 0 and 100")
+    session = get_race_session(session_id)
+    since = session.version if request.since is None else request.since
+    if request.weather:
+        session.set_weather(request.weather)
+    session.advance(request.laps)
+    return session_delta(session, since)
+
+
+@router.post("/api/race/sessions/{session_id}/instruction")
+async def instruct_race_session(session_id: str, request: RaceSessionInstructionRequest):
+    """下达车手指令（更新策略或节奏系数）"""
+    session = get_race_session(session_id)
+    since = session.version if request.since is None else request.since
+    try:
+        session.apply_instruction(request.carId, request.strategy, request.paceMultiplier, request.message)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Car not found")
+    return session_delta(session, since)
+
+
+@router.delete("/api/race/sessions/{session_id}")
+async def delete_race_session(session_id: str):
+    if not race_sessions.remove(session_id):
+        raise HTTPException(status_code=404, detail="Race session not found")
+    return {"deleted": True}
@@ -5,11 +5,17 @@ F1比赛策略与AI车手反应系统
 
 import random
 import json
-from typing import Dict, List, Any
+import os
+from typing import Dict, List, Any, Optional
 from datetime import datetime
+from response_cache import TTLCache, canonical_key, temperature_bucket
+from strategy_optimizer import optimize_strategies, cars_from_grid, format_recommendations
+from keyword_classifier import classify, is_profane, instruction_type as instruction_type_for
 
 class F1StrategyAI:
-    def __init__(self):
+    def __init__(self, seed: Optional[int] = None):
+        # 独立随机源：相同种子下规则生成的策略、无线电和回应可复现
+        self.rng = random.Random(seed)
         self.driver_personalities = {
             "aggressive": {
                 "traits": ["冲动", "激进", "不服输"],
@@ -35,25 +41,41 @@ class F1StrategyAI:
             "mclaren": {"culture": "年轻活力", "communication": "轻松友好"},
             "alpine": {"culture": "法式优雅", "communication": "战术细腻"}
         }
+        
+        self.analysis_cache = TTLCache(
+            "analyze_strategy",
+            maxsize=int(os.getenv("ANALYZE_STRATEGY_CACHE_SIZE", "512")),
+            ttl=float(os.getenv("ANALYZE_STRATEGY_CACHE_TTL", "300")),
+        )
 
-    async def analyze_strategy(self, race_context: Dict) -> Dict:
+    async def analyze_strategy(self, race_context: Dict, use_cache: bool = True) -> Dict:
         """
-        基于比赛情况生成策略分析
+        基于比赛情况生成策略分析（相同条件命中缓存，赛道温度按5°C分桶）
         """
+        cache_key = canonical_key({**race_context, 'trackTemp': temperature_bucket(race_context.get('trackTemp', 42))})
+        if use_cache:
+            hit, cached = self.analysis_cache.get(cache_key)
+            if hit:
+                return cached
+        else:
+            self.analysis_cache.record_bypass()
+        
         weather = race_context.get('weather', 'dry')
         track_temp = race_context.get('trackTemp', 42)
         race_length = race_context.get('raceLength', 57)
         
         # 模拟LLM分析（实际应调用GPT-4）
         analysis = self._generate_strategy_analysis(weather, track_temp, race_length)
-        recommendations = self._generate_recommendations(race_context)
+        recommendations = await self._generate_recommendations(race_context)
         
-        return {
+        result = {
             "analysis": analysis,
             "recommendations": recommendations,
             "strategyUpdates": self._generate_strategy_updates(race_context),
             "teamRadio": self._generate_team_radio(race_context)
         }
+        self.analysis_cache.set(cache_key, result)
+        return result
 
     def _generate_strategy_analysis(self, weather: str, track_temp: int, race_length: int) -> str:
         """生成赛道分析"""
@@ -73,33 +95,23 @@ class F1StrategyAI:
             
         return base_analysis
 
-    def _generate_recommendations(self, context: Dict) -> List[Dict]:
-        """生成个性化建议"""
-        recommendations = []
+    async def _generate_recommendations(self, context: Dict) -> List[Dict]:
+        """基于蒙特卡洛推演的个性化建议（前6位）"""
         grid_order = context.get('gridOrder', [])
+        if not grid_order:
+            return []
         
-        for i, car_info in enumerate(grid_order[:6]):  # 前6位
-            if i < 2:
-                rec = {
-                    "driver": car_info['driver'],
-                    "suggestion": "保持领先优势，采用保守一停策略",
-                    "impact": "降低风险，确保积分"
-                }
-            elif i < 4:
-                rec = {
-                    "driver": car_info['driver'], 
-                    "suggestion": "尝试undercut策略，早停抢位",
-                    "impact": "有机会提升2-3个位置"
-                }
-            else:
-                rec = {
-                    "driver": car_info['driver'],
-                    "suggestion": "激进二停策略，利用新胎优势",
-                    "impact": "高风险高回报，可能大幅提升"
-                }
-            recommendations.append(rec)
-            
-        return recommendations
+        cars, strategies = cars_from_grid(grid_order, context.get('currentStrategies', []))
+        optimization = await optimize_strategies(
+            cars,
+            strategies,
+            total_laps=context.get('raceLength', 57),
+            weather=context.get('weather', 'dry'),
+            track_temp=context.get('trackTemp', 42),
+            rollouts=context.get('rollouts'),
+            targets=range(min(6, len(cars))),
+        )
+        return format_recommendations(optimization)
 
     def _generate_strategy_updates(self, context: Dict) -> List[Dict]:
         """生成策略更新"""
@@ -109,13 +121,14 @@ class F1StrategyAI:
         # 模拟基于当前比赛情况的策略调整
         if current_lap > 10:
             # 随机选择几辆车进行策略微调
-            sample_cars = random.sample(list(context.get('classification', []))[:10], 3)
+            top10 = list(context.get('classification') or [])[:10]
+            sample_cars = self.rng.sample(top10, min(3, len(top10)))
             for car in sample_cars:
                 update = {
                     "carId": car.get('id'),
                     "changes": {
-                        "paceK": random.uniform(0.98, 1.05),
-                        "plannedPitLaps": [current_lap + random.randint(3, 8)]
+                        "paceK": self.rng.uniform(0.98, 1.05),
+                        "plannedPitLaps": [current_lap + self.rng.randint(3, 8)]
                     }
                 }
                 updates.append(update)
@@ -140,20 +153,74 @@ class F1StrategyAI:
         ]
         
         # 随机生成2-4条无线电
-        for _ in range(random.randint(2, 4)):
+        for _ in range(self.rng.randint(2, 4)):
             team_names = ["Ferrari", "Mercedes", "McLaren", "Alpine", "Aston Martin"]
             team_colors = ["#DC143C", "#00D2BE", "#FF8000", "#0090FF", "#006F62"]
             
-            team_idx = random.randint(0, len(team_names) - 1)
+            team_idx = self.rng.randint(0, len(team_names) - 1)
             radio_messages.append({
                 "teamName": team_names[team_idx],
-                "driverName": f"Driver {random.randint(1, 20)}",
-                "message": random.choice(radio_templates),
+                "driverName": f"Driver {self.rng.randint(1, 20)}",
+                "message": self.rng.choice(radio_templates),
                 "teamColor": team_colors[team_idx]
             })
             
         return radio_messages
 
+    def rule_strategy_update(self, context: Dict) -> Dict:
+        """规则生成的实时策略更新（LLM超时或失败时使用）"""
+        return {
+            "strategyUpdates": self._generate_strategy_updates(context),
+            "teamRadio": self._generate_team_radio(context),
+            "eventPredictions": [],
+        }
+
+    def rule_strategy_analysis(self, context: Dict) -> Dict:
+        """规则生成的赛前策略分析（推荐由蒙特卡洛优化结果提供）"""
+        return {
+            "analysis": self._generate_strategy_analysis(
+                context.get('weather', 'dry'), context.get('trackTemp', 42), context.get('raceLength', 57)
+            ),
+        }
+
+    def generate_race_event(self, context: Dict) -> Dict:
+        """规则生成比赛事件：按天气和圈数加权选择事件类型，从前十名中选取受影响车手"""
+        current_lap = context.get('currentLap', 0)
+        weather = context.get('weather') or {}
+        condition = weather.get('condition', 'dry') if isinstance(weather, dict) else str(weather)
+
+        events = {
+            "mechanical": ("机械故障", "{driver}报告动力单元异常，圈速明显下降", "位置可能大幅下滑", "车队要求切换引擎模式并继续观察"),
+            "collision": ("碰撞事故", "{driver}在1号弯与对手发生轻微接触", "前翼受损，可能需要提前进站", "车队评估损伤，准备更换前翼"),
+            "weather": ("天气变化", "赛道上空开始飘雨，部分弯道抓地力下降", "轮胎策略面临调整", "各车队开始准备半雨胎"),
+            "tyre": ("轮胎问题", "{driver}的后轮出现明显起粒", "圈速下降，进站窗口提前", "车队通知车手保护后胎，准备进站"),
+            "mistake": ("战术失误", "{driver}进站时轮胎未能及时就位", "损失约3秒", "车队向车手致歉并调整后续策略"),
+        }
+        weights = {
+            "mechanical": 1.0,
+            "collision": 1.5 if current_lap < 5 else 1.0,
+            "weather": 2.5 if condition in ("light_rain", "heavy_rain") else 0.5,
+            "tyre": 2.0 if current_lap > 20 else 0.5,
+            "mistake": 1.0,
+        }
+        event_type = self.rng.choices(list(weights), weights=list(weights.values()))[0]
+        label, description, impact, reaction = events[event_type]
+
+        top10 = list(context.get('classification') or [])[:10]
+        drivers = []
+        if top10 and "{driver}" in description:
+            car = self.rng.choice(top10)
+            drivers.append(car.get('name') or car.get('driverName') or car.get('id') or "车手")
+        return {
+            "type": event_type,
+            "title": label,
+            "description": description.format(driver=drivers[0] if drivers else "一位车手"),
+            "drivers": drivers,
+            "impact": impact,
+            "teamReaction": reaction,
+            "lap": current_lap,
+        }
+
     async def generate_driver_response(self, user_input: str, driver_context: Dict) -> Dict:
         """
         生成车手对用户输入的真实反应
@@ -165,8 +232,9 @@ class F1StrategyAI:
         current_lap = driver_context.get('teamContext', {}).get('currentLap', 0)
         
         # 检测输入类型
-        profanity_detected = self._detect_profanity(user_input)
-        instruction_type = self._classify_instruction(user_input)
+        categories = classify(user_input)
+        profanity_detected = is_profane(categories)
+        instruction_type = instruction_type_for(categories) or 'general'
         
         if profanity_detected:
             return self._handle_profanity_response(driver_name, team_name)
@@ -175,23 +243,6 @@ class F1StrategyAI:
         else:
             return self._handle_general_response(user_input, driver_name, team_name)
 
-    def _detect_profanity(self, text: str) -> bool:
-        """检测不当用词"""
-        profanity_words = ['草泥马', '傻逼', '白痴', '蠢货', 'fuck', 'shit', 'damn']
-        return any(word in text.lower() for word in profanity_words)
-
-    def _classify_instruction(self, text: str) -> str:
-        """分类指令类型"""
-        if any(word in text for word in ['进站', 'pit', 'box']):
-            return 'pit'
-        elif any(word in text for word in ['推进', '加速', 'push', 'attack']):
-            return 'push'
-        elif any(word in text for word in ['防守', '保持', 'defend', 'hold']):
-            return 'defend'
-        elif any(word in text for word in ['节油', '省油', 'fuel', 'save']):
-            return 'fuel_save'
-        return 'general'
-
     def _handle_profanity_response(self, driver_name: str, team_name: str) -> Dict:
         """处理不当用词的专业反应"""
         responses = [
@@ -202,7 +253,7 @@ class F1StrategyAI:
         ]
         
         return {
-            "response": random.choice(responses),
+            "response": self.rng.choice(responses),
             "mood": "professional_but_firm",
             "strategyImpact": {
                 "paceMultiplier": 0.98  # 轻微影响专注度
@@ -242,7 +293,7 @@ class F1StrategyAI:
         }
         
         return {
-            "response": random.choice(responses.get(instruction_type, responses['push'])),
+            "response": self.rng.choice(responses.get(instruction_type, responses['push'])),
             "mood": "focused",
             "strategyImpact": {
                 "paceMultiplier": impact_multipliers.get(instruction_type, 1.0)
@@ -259,10 +310,10 @@ class F1StrategyAI:
         ]
         
         return {
-            "response": random.choice(general_responses),
+            "response": self.rng.choice(general_responses),
             "mood": "neutral",
             "strategyImpact": None
         }
 
-# 全局实例
-f1_ai = F1StrategyAI()
+# 全局实例（设置 F1_AI_SEED 可固定随机序列）
+f1_ai = F1StrategyAI(seed=int(os.environ["F1_AI_SEED"]) if os.getenv("F1_AI_SEED") else None)
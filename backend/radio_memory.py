@@ -0,0 +1,118 @@
+"""
+车手无线电记忆
+按 (比赛会话, 车手) 在内存中保存最近的无线电往来（环形缓冲），driver_response 直接取用作为对话历史，
+客户端无需每次上传。长时间无人访问的记忆被淘汰，总内存超过上限时按最久未使用淘汰。
+"""
+
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Tuple
+
+from metrics import Counter, Gauge
+
+RADIO_MEMORY_MESSAGES = int(os.getenv("RADIO_MEMORY_MESSAGES", "10"))
+RADIO_MEMORY_IDLE_TTL = float(os.getenv("RADIO_MEMORY_IDLE_TTL", "3600"))
+RADIO_MEMORY_MAX_BYTES = int(os.getenv("RADIO_MEMORY_MAX_BYTES", str(16 * 1024 * 1024)))
+RADIO_MEMORY_MESSAGE_CHARS = 600   # 单条消息截断长度，限制单个缓冲区的大小
+
+MEMORY_THREADS = Gauge("radio_memory_threads", "Driver radio histories held in memory")
+MEMORY_BYTES = Gauge("radio_memory_bytes", "Approximate size of stored radio messages")
+MEMORY_EVICTED = Counter("radio_memory_evicted_total", "Radio histories evicted", ["reason"])
+
+MESSAGE_OVERHEAD_BYTES = 64
+
+
+class RadioThread:
+    """一位车手在一场比赛中的无线电记录"""
+    __slots__ = ("messages", "size", "last_access")
+
+    def __init__(self, max_messages: int):
+        self.messages: deque = deque(maxlen=max_messages)
+        self.size = 0
+        self.last_access = time.monotonic()
+
+    def append(self, role: str, content: str) -> int:
+        """追加一条消息，返回大小变化（环形缓冲挤出的旧消息会被扣除）"""
+        content = content[:RADIO_MEMORY_MESSAGE_CHARS]
+        added = len(content.encode("utf-8")) + MESSAGE_OVERHEAD_BYTES
+        removed = 0
+        if len(self.messages) == self.messages.maxlen:
+            removed = self._message_size(self.messages[0])
+        self.messages.append({"role": role, "content": content})
+        self.size += added - removed
+        return added - removed
+
+    @staticmethod
+    def _message_size(message: Dict) -> int:
+        return len(message["content"].encode("utf-8")) + MESSAGE_OVERHEAD_BYTES
+
+
+class RadioMemory:
+    def __init__(self, max_messages: int = RADIO_MEMORY_MESSAGES, idle_ttl: float = RADIO_MEMORY_IDLE_TTL,
+                 max_bytes: int = RADIO_MEMORY_MAX_BYTES):
+        self.max_messages = max_messages
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._threads: "OrderedDict[Tuple[str, str], RadioThread]" = OrderedDict()
+
+    def history(self, session_id: Optional[str], driver_id: str) -> List[Dict]:
+        """按时间顺序返回该车手的无线电历史；没有会话ID时不记忆"""
+        if not session_id:
+            return []
+        self._evict()
+        thread = self._threads.get((session_id, driver_id))
+        if thread is None:
+            return []
+        self._touch((session_id, driver_id), thread)
+        return list(thread.messages)
+
+    def record(self, session_id: Optional[str], driver_id: str, message: str, reply: Optional[str]):
+        """记录一轮车队消息和车手回应"""
+        if not session_id:
+            return
+        key = (session_id, driver_id)
+        thread = self._threads.get(key)
+        if thread is None:
+            thread = self._threads[key] = RadioThread(self.max_messages)
+        self._touch(key, thread)
+        self.total_bytes += thread.append("user", message)
+        if reply:
+            self.total_bytes += thread.append("assistant", reply)
+        self._evict()
+
+    def forget_session(self, session_id: str):
+        """比赛会话结束时丢弃其所有车手的记忆"""
+        for key in [key for key in self._threads if key[0] == session_id]:
+            self._drop(key)
+        self._update_gauges()
+
+    def _touch(self, key, thread: RadioThread):
+        thread.last_access = time.monotonic()
+        self._threads.move_to_end(key)
+
+    def _drop(self, key):
+        thread = self._threads.pop(key)
+        self.total_bytes -= thread.size
+
+    def _evict(self):
+        # 按最近访问排序，最久未用的在最前面
+        cutoff = time.monotonic() - self.idle_ttl
+        while self._threads:
+            key, thread = next(iter(self._threads.items()))
+            if thread.last_access >= cutoff:
+                break
+            self._drop(key)
+            MEMORY_EVICTED.labels("idle").inc()
+        while self.total_bytes > self.max_bytes and len(self._threads) > 1:
+            self._drop(next(iter(self._threads)))
+            MEMORY_EVICTED.labels("capacity").inc()
+        self._update_gauges()
+
+    def _update_gauges(self):
+        MEMORY_THREADS.set(len(self._threads))
+        MEMORY_BYTES.set(self.total_bytes)
+
+
+radio_memory = RadioMemory()
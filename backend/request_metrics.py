@@ -0,0 +1,98 @@
+"""
+请求级指标
+纯ASGI中间件按路由模板记录请求延迟和状态码；当前请求的路由和AI角色通过contextvar
+传给LLM客户端作为指标标签。另有事件循环延迟监控。
+"""
+
+import asyncio
+import time
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from metrics import Counter, Gauge, Histogram
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests by route and status", ["method", "route", "status"])
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency (until the body is sent)", ["method", "route"])
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests currently being served")
+EVENT_LOOP_LAG = Histogram(
+    "event_loop_lag_seconds", "Delay between scheduled and actual wake-up of the lag probe",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+EVENT_LOOP_LAG_LAST = Gauge("event_loop_lag_last_seconds", "Most recent event loop lag sample")
+
+UNMATCHED_ROUTE = "unmatched"
+
+# 当前请求的ASGI scope；路由匹配后 scope["endpoint"] 才可用，因此按需解析
+_current_scope: ContextVar[Optional[dict]] = ContextVar("current_scope", default=None)
+_current_character: ContextVar[str] = ContextVar("current_character", default="-")
+_route_paths: Dict[object, str] = {}
+
+
+def _route_path(scope: dict) -> str:
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return UNMATCHED_ROUTE
+    path = _route_paths.get(endpoint)
+    if path is None:
+        app = scope.get("app")
+        for route in getattr(app, "routes", []):
+            if getattr(route, "endpoint", None) is not None and hasattr(route, "path"):
+                _route_paths.setdefault(route.endpoint, route.path)
+        path = _route_paths.get(endpoint, UNMATCHED_ROUTE)
+    return path
+
+
+def current_route() -> str:
+    """当前请求的路由模板（如 /api/race/sessions/{session_id}），请求外返回 "-" """
+    scope = _current_scope.get()
+    return _route_path(scope) if scope is not None else "-"
+
+
+def current_character() -> str:
+    return _current_character.get()
+
+
+def set_character(character_id: Optional[str]):
+    """标记当前请求对应的AI角色（聊天接口），用作LLM指标标签"""
+    _current_character.set(character_id or "-")
+
+
+class RequestMetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        token = _current_scope.set(scope)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = _route_path(scope)
+            HTTP_LATENCY.labels(scope["method"], route).observe(time.perf_counter() - started)
+            HTTP_REQUESTS.labels(scope["method"], route, str(status)).inc()
+            _current_scope.reset(token)
+
+
+async def monitor_event_loop_lag(interval: float = 0.5):
+    """周期性休眠并测量实际唤醒的延迟；阻塞事件循环的代码会直接体现在这里"""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - expected)
+        EVENT_LOOP_LAG.observe(lag)
+        EVENT_LOOP_LAG_LAST.set(lag)
@@ -0,0 +1,92 @@
+"""
+TTL + LRU 响应缓存
+键为规范化请求（排序键的JSON）的SHA-256，容量有上限，按最近使用淘汰，每个缓存独立TTL。
+请求头 Cache-Control: no-cache / no-store 或 X-No-Cache: 1 可跳过缓存。
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+from metrics import Counter, Gauge
+
+CACHE_REQUESTS = Counter("response_cache_requests_total", "Response cache lookups", ["cache", "result"])
+CACHE_EVICTIONS = Counter("response_cache_evictions_total", "Entries evicted by LRU or TTL", ["cache", "reason"])
+CACHE_SIZE = Gauge("response_cache_entries", "Entries currently held", ["cache"])
+
+_MISSING = object()
+
+
+def canonical_key(payload: Any) -> str:
+    """规范化后取哈希：字典键排序、去掉多余空白"""
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def temperature_bucket(temp: Any, width: int = 5) -> Any:
+    """把赛道温度归入固定宽度的区间，相近温度共用缓存"""
+    try:
+        return int(float(temp) // width * width)
+    except (TypeError, ValueError):
+        return temp
+
+
+def cache_bypassed(headers) -> bool:
+    """请求是否声明跳过缓存"""
+    if headers is None:
+        return False
+    cache_control = headers.get("cache-control", "").lower()
+    if "no-cache" in cache_control or "no-store" in cache_control:
+        return True
+    return headers.get("x-no-cache", "").lower() in ("1", "true", "yes")
+
+
+class TTLCache:
+    def __init__(self, name: str, maxsize: int = 1024, ttl: float = 300.0):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """返回 (是否命中, 值)"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    CACHE_REQUESTS.labels(self.name, "hit").inc()
+                    return True, value
+                del self._data[key]
+                CACHE_EVICTIONS.labels(self.name, "expired").inc()
+                CACHE_SIZE.labels(self.name).set(len(self._data))
+            self.misses += 1
+        CACHE_REQUESTS.labels(self.name, "miss").inc()
+        return False, None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                CACHE_EVICTIONS.labels(self.name, "lru").inc()
+            CACHE_SIZE.labels(self.name).set(len(self._data))
+
+    def record_bypass(self):
+        CACHE_REQUESTS.labels(self.name, "bypass").inc()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            CACHE_SIZE.labels(self.name).set(0)
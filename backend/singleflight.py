@@ -0,0 +1,47 @@
+"""
+单飞（single-flight）请求合并
+同一键的并发调用只触发一次上游调用，其余调用等待并共享同一结果
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+from metrics import Counter, Gauge
+
+SINGLEFLIGHT_CALLS = Counter("singleflight_calls_total", "Coalesced calls by role (leader runs, follower shares)", ["group", "role"])
+SINGLEFLIGHT_DUPLICATE_RATIO = Gauge("singleflight_duplicate_ratio", "Share of calls served by an in-flight leader", ["group"])
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """执行fn()或加入同键的进行中调用；调用方被取消不会取消共享的上游调用"""
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fn())
+            self._inflight[key] = future
+            future.add_done_callback(lambda done, key=key: self._forget(key, done))
+            self.leaders += 1
+            SINGLEFLIGHT_CALLS.labels(self.name, "leader").inc()
+        else:
+            self.followers += 1
+            SINGLEFLIGHT_CALLS.labels(self.name, "follower").inc()
+        SINGLEFLIGHT_DUPLICATE_RATIO.labels(self.name).set(self.duplicate_ratio)
+        return await asyncio.shield(future)
+
+    @property
+    def duplicate_ratio(self) -> float:
+        total = self.leaders + self.followers
+        return self.followers / total if total else 0.0
+
+    def _forget(self, key: str, future: asyncio.Future):
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        # 所有等待者都已取消时避免“未读取的异常”警告
+        if not future.cancelled():
+            future.exception()
@@ -0,0 +1,306 @@
+"""
+蒙特卡洛进站策略优化器
+为每辆车枚举候选轮胎顺序和进站圈，在 race_engine 上做大量随机比赛推演
+（安全车概率、衰减噪声、圈速噪声），按期望完赛名次和方差排序。
+每辆车的评估是一个独立任务，分发到进程池并受总时间预算约束。
+"""
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import permutations
+from typing import Dict, List, Optional, Sequence, Set
+
+import numpy as np
+
+from race_engine import RaceEngine, WEATHER_LAP_FACTOR, encode_pit_plans
+from tracing import span
+
+# 默认推演数按CPU数缩放（每核16场，最多64）：单核上20辆车也能在时间预算内评估完，结果不被标记partial
+OPTIMIZER_ROLLOUTS = int(os.getenv("STRATEGY_OPTIMIZER_ROLLOUTS") or min(64, 16 * (os.cpu_count() or 1)))
+OPTIMIZER_MAX_ROLLOUTS = int(os.getenv("STRATEGY_OPTIMIZER_MAX_ROLLOUTS", "1024"))
+OPTIMIZER_WORKERS = int(os.getenv("STRATEGY_OPTIMIZER_WORKERS", str(os.cpu_count() or 1)))
+OPTIMIZER_TIME_BUDGET = float(os.getenv("STRATEGY_OPTIMIZER_TIME_BUDGET", "5.0"))
+SAFETY_CAR_PROB = 0.015         # 每圈安全车出动概率（干地）
+DEGRADATION_NOISE = 0.15        # 每场推演的衰减系数波动
+MAX_STOPS = 3
+
+# 前端 StrategyPrep 策略模板对应的轮胎顺序
+TEMPLATE_TYRES = {
+    "aggressive": ["soft", "soft", "medium"],
+    "conservative": ["medium", "medium", "hard"],
+    "oneStop": ["medium", "hard"],
+    "undercut": ["soft", "medium", "hard"],
+}
+
+DRY_COMPOUNDS = ("soft", "medium", "hard")
+ONE_STOP_WINDOWS = (0.3, 0.4, 0.5, 0.6)
+TWO_STOP_WINDOWS = ((0.25, 0.55), (0.3, 0.65), (0.35, 0.7))
+TWO_STOP_SEQUENCES = (
+    ("soft", "medium", "hard"), ("soft", "hard", "medium"), ("medium", "hard", "soft"),
+    ("medium", "soft", "hard"), ("soft", "medium", "soft"), ("medium", "medium", "hard"),
+)
+
+_executor: Optional[ProcessPoolExecutor] = None
+_submitted: Set[Future] = set()   # 已提交、尚未完成的进程池任务，关闭时逐个取消
+_submitted_lock = threading.Lock()   # 完成回调在执行器的管理线程中调用
+
+
+def candidate_strategies(total_laps: int, weather: str = "dry") -> List[Dict]:
+    """枚举候选策略（干地需至少使用两种配方）"""
+    # 与引擎一致：只有 light_rain/heavy_rain 算湿地，cloudy 等未知天气按干地处理
+    if weather in WEATHER_LAP_FACTOR and weather != "dry":
+        wet = "wet" if weather == "heavy_rain" else "intermediate"
+        one_stop = [(wet, wet), (wet, "intermediate"), ("intermediate", "medium")]
+        two_stop = [(wet, wet, wet), (wet, "intermediate", "medium")]
+    else:
+        one_stop = list(permutations(DRY_COMPOUNDS, 2))
+        two_stop = list(TWO_STOP_SEQUENCES)
+
+    candidates = []
+    for tyres in one_stop:
+        for fraction in ONE_STOP_WINDOWS:
+            candidates.append({"tyreSequence": list(tyres), "plannedPitLaps": [max(1, round(total_laps * fraction))]})
+    for tyres in two_stop:
+        for first, second in TWO_STOP_WINDOWS:
+            candidates.append({
+                "tyreSequence": list(tyres),
+                "plannedPitLaps": [max(1, round(total_laps * first)), max(2, round(total_laps * second))],
+            })
+    return candidates
+
+
+def normalize_strategy(strategy: Dict) -> Dict:
+    """把前端策略（模板名+进站圈）补全为引擎需要的轮胎顺序"""
+    normalized = dict(strategy)
+    pit_laps = list(strategy.get("plannedPitLaps") or strategy.get("pitLaps") or [])
+    tyres = strategy.get("tyreSequence") or TEMPLATE_TYRES.get(strategy.get("strategy") or strategy.get("template"))
+    if not tyres:
+        tyres = ["medium", "hard", "medium"][:len(pit_laps) + 1]
+    normalized["plannedPitLaps"] = pit_laps
+    normalized["tyreSequence"] = list(tyres)
+    return normalized
+
+
+def evaluate_car(params: Dict) -> Dict:
+    """
+    进程池任务：评估一辆车的全部候选策略（其余车保持当前策略）。
+    一次构造 (候选数 × 推演数) 场平行比赛，整体向量化推进。
+    """
+    cars, strategies, car_index = params["cars"], params["strategies"], params["car_index"]
+    candidates, rollouts = params["candidates"], params["rollouts"]
+    n_candidates = len(candidates)
+    engine = RaceEngine(
+        cars=cars,
+        strategies=strategies,
+        total_laps=params["total_laps"],
+        weather=params["weather"],
+        track_temp=params["track_temp"],
+        n_sims=n_candidates * rollouts,
+        seed=params["seed"],
+        degradation_noise=DEGRADATION_NOISE,
+        safety_car_prob=SAFETY_CAR_PROB,
+    )
+
+    car_ids = [car["id"] for car in cars]
+    base = [normalize_strategy(strategies.get(car_id, {})) for car_id in car_ids]
+    base_laps, base_compounds, base_start = encode_pit_plans(base, MAX_STOPS)
+    cand_laps, cand_compounds, cand_start = encode_pit_plans(candidates, MAX_STOPS)
+
+    # 每个候选重复rollouts次：sim = candidate * rollouts + r
+    pit_laps = np.repeat(base_laps[None], n_candidates * rollouts, axis=0)
+    pit_compounds = np.repeat(base_compounds[None], n_candidates * rollouts, axis=0)
+    start = np.repeat(base_start[None], n_candidates * rollouts, axis=0)
+    pit_laps[:, car_index] = np.repeat(cand_laps, rollouts, axis=0)
+    pit_compounds[:, car_index] = np.repeat(cand_compounds, rollouts, axis=0)
+    start[:, car_index] = np.repeat(cand_start, rollouts, axis=0)
+    engine.set_pit_plans(pit_laps, pit_compounds, start)
+
+    positions = engine.run_race()[:, car_index].reshape(n_candidates, rollouts).astype(np.float64)
+    means = positions.mean(axis=1)
+    variances = positions.var(axis=1)
+    return {
+        "car_index": car_index,
+        "results": [
+            {**candidates[c], "expectedPosition": float(means[c]), "positionVariance": float(variances[c])}
+            for c in range(n_candidates)
+        ],
+    }
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=OPTIMIZER_WORKERS)
+    return _executor
+
+
+def _submit(executor: ProcessPoolExecutor, params: Dict) -> Future:
+    future = executor.submit(evaluate_car, params)
+    with _submitted_lock:
+        _submitted.add(future)
+    future.add_done_callback(_forget_submitted)
+    return future
+
+
+def _forget_submitted(future: Future):
+    with _submitted_lock:
+        _submitted.discard(future)
+
+
+def _empty_result(rollouts: int, candidate_count: int) -> Dict:
+    return {
+        "cars": [],
+        "rolloutsPerCandidate": rollouts,
+        "candidateCount": candidate_count,
+        "elapsedSeconds": 0.0,
+        "partial": False,
+    }
+
+
+async def optimize_strategies(
+    cars: List[Dict],
+    strategies: Dict[str, Dict],
+    total_laps: int = 57,
+    weather: str = "dry",
+    track_temp: float = 42.0,
+    rollouts: Optional[int] = None,
+    top_k: int = 3,
+    seed: int = 0,
+    time_budget: Optional[float] = None,
+    targets: Optional[Sequence[int]] = None,
+) -> Dict:
+    """
+    为每辆车（或targets指定的车辆下标）返回按期望名次排序的前top_k个策略，其余车辆仍参与推演。
+    超出时间预算仍未完成的车辆不出现在结果中，并标记 partial。
+    """
+    rollouts = min(OPTIMIZER_MAX_ROLLOUTS, max(1, rollouts or OPTIMIZER_ROLLOUTS))
+    time_budget = OPTIMIZER_TIME_BUDGET if time_budget is None else time_budget
+    candidates = candidate_strategies(total_laps, weather)
+    strategies = {car["id"]: normalize_strategy(strategies.get(car["id"], {})) for car in cars}
+    current = [{**strategies[car["id"]], "current": True} for car in cars]
+    indices = list(range(len(cars)) if targets is None else targets)
+    if not indices:
+        # 空发车顺序：没有可评估的车辆（asyncio.wait 不接受空集合）
+        return _empty_result(rollouts, len(candidates))
+
+    executor = _get_executor()
+    started = time.perf_counter()
+    submitted = [
+        _submit(executor, {
+            "cars": cars,
+            "strategies": strategies,
+            "car_index": i,
+            # 当前策略也参与评估，作为对照
+            "candidates": candidates + [current[i]],
+            "rollouts": rollouts,
+            "total_laps": total_laps,
+            "weather": weather,
+            "track_temp": track_temp,
+            "seed": seed + i,
+        })
+        for i in indices
+    ]
+    futures = [asyncio.wrap_future(future) for future in submitted]
+    with span("optimizer"):
+        done, pending = await asyncio.wait(futures, timeout=time_budget)
+    # 超出预算：取消进程池中尚未开始的任务（已在运行的无法中断，结果被丢弃）
+    for future, source in zip(futures, submitted):
+        if future in pending:
+            future.cancel()
+            source.cancel()
+
+    ranked = []
+    for future in done:
+        if future.cancelled() or future.exception():
+            continue
+        evaluated = future.result()
+        results = evaluated["results"]
+        baseline = next(r for r in results if r.get("current"))
+        options = sorted(
+            (r for r in results if not r.get("current")),
+            key=lambda r: (r["expectedPosition"], r["positionVariance"]),
+        )[:top_k]
+        car = cars[evaluated["car_index"]]
+        ranked.append({
+            "carId": car["id"],
+            "driver": car.get("name", car["id"]),
+            "gridPosition": evaluated["car_index"] + 1,
+            "current": _public(baseline),
+            "strategies": [_public(r) for r in options],
+        })
+    ranked.sort(key=lambda entry: entry["gridPosition"])
+
+    return {
+        "cars": ranked,
+        "rolloutsPerCandidate": rollouts,
+        "candidateCount": len(candidates),
+        "elapsedSeconds": round(time.perf_counter() - started, 3),
+        "partial": bool(pending),
+    }
+
+
+def _public(result: Dict) -> Dict:
+    return {
+        "tyreSequence": result["tyreSequence"],
+        "plannedPitLaps": result["plannedPitLaps"],
+        "stops": len(result["plannedPitLaps"]),
+        "expectedPosition": round(result["expectedPosition"], 2),
+        "positionVariance": round(result["positionVariance"], 3),
+    }
+
+
+def cars_from_grid(grid_order: Sequence[Dict], current_strategies: Sequence[Dict]):
+    """
+    从策略分析请求的 gridOrder/currentStrategies 构造引擎车辆和策略。
+    前端的 gridOrder 不带车辆ID，与 currentStrategies 按顺序一一对应。
+    """
+    grid = sorted(grid_order, key=lambda car: car.get("position", 0))
+    cars, strategies = [], {}
+    for i, entry in enumerate(grid):
+        strategy = current_strategies[i] if i < len(current_strategies) else {}
+        car_id = entry.get("carId") or entry.get("id") or strategy.get("carId") or entry.get("driver") or f"car_{i + 1}"
+        cars.append({"id": car_id, "name": entry.get("driver", car_id), "teamName": entry.get("team")})
+        strategies[car_id] = strategy
+    # gridOrder中带ID时按ID匹配策略
+    by_id = {s.get("carId"): s for s in current_strategies if s.get("carId")}
+    for car in cars:
+        if car["id"] in by_id:
+            strategies[car["id"]] = by_id[car["id"]]
+    return cars, strategies
+
+
+def shutdown_optimizer():
+    global _executor
+    if _executor is not None:
+        # shutdown 的 cancel_futures 参数需要 Python 3.9，这里自行取消未开始的任务
+        with _submitted_lock:
+            pending = list(_submitted)
+        for future in pending:
+            future.cancel()
+        _executor.shutdown(wait=False)
+        _executor = None
+
+
+def format_recommendations(optimization: Dict, limit: Optional[int] = None) -> List[Dict]:
+    """把优化结果转换为前端使用的 driver/suggestion/impact 建议"""
+    recommendations = []
+    for entry in optimization.get("cars", [])[:limit]:
+        if not entry["strategies"]:
+            continue
+        best, current = entry["strategies"][0], entry["current"]
+        tyres = "→".join(best["tyreSequence"])
+        laps = "、".join(str(lap) for lap in best["plannedPitLaps"])
+        gain = current["expectedPosition"] - best["expectedPosition"]
+        if gain > 0.05:
+            impact = f"期望名次 P{best['expectedPosition']:.1f}，较当前策略提升 {gain:.1f} 位（方差 {best['positionVariance']:.2f}）"
+        else:
+            impact = f"当前策略已接近最优，期望名次 P{current['expectedPosition']:.1f}"
+        recommendations.append({
+            "driver": entry["driver"],
+            "suggestion": f"{best['stops']}停策略 {tyres}，第{laps}圈进站",
+            "impact": impact,
+        })
+    return recommendations
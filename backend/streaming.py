@@ -0,0 +1,16 @@
+"""
+流式响应工具（Server-Sent Events）
+"""
+
+import json
+from typing import Any
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",  # 禁止反向代理缓冲
+}
+
+
+def sse_event(event: str, data: Any) -> str:
+    """编码一帧SSE消息，data序列化为单行JSON"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
@@ -0,0 +1,113 @@
+"""
+轻量级请求阶段追踪
+每个请求一个Trace（通过contextvar传递），代码中用 span("名称") 记录各阶段耗时；
+响应头 Server-Timing 带出响应开始前已完成的阶段，慢请求按采样率存入环形缓冲区，
+通过 /debug/traces 查看。
+"""
+
+import os
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+TRACE_SLOW_SECONDS = float(os.getenv("TRACE_SLOW_SECONDS", "1.0"))
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "200"))
+TRACE_MAX_SPANS = 200
+
+
+class Trace:
+    __slots__ = ("method", "path", "started_at", "_start", "spans", "status", "duration")
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.spans: List[tuple] = []   # (名称, 相对开始时间, 耗时)，单位秒
+        self.status: Optional[int] = None
+        self.duration: Optional[float] = None
+
+    def add(self, name: str, start: float, duration: float):
+        if len(self.spans) < TRACE_MAX_SPANS:
+            self.spans.append((name, start - self._start, duration))
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._start
+
+    def server_timing(self) -> str:
+        """Server-Timing 头：各阶段加总（毫秒），最后是截至此刻的总耗时"""
+        totals: Dict[str, float] = {}
+        for name, _, duration in self.spans:
+            totals[name] = totals.get(name, 0.0) + duration
+        parts = [f"{name};dur={duration * 1000:.1f}" for name, duration in totals.items()]
+        parts.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(parts)
+
+    def to_dict(self) -> Dict:
+        return {
+            "method": self.method,
+            "path": self.path,
+            "startedAt": self.started_at,
+            "status": self.status,
+            "durationMs": round((self.duration or 0.0) * 1000, 2),
+            "spans": [
+                {"name": name, "startMs": round(start * 1000, 2), "durationMs": round(duration * 1000, 2)}
+                for name, start, duration in self.spans
+            ],
+        }
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+_slow_traces: deque = deque(maxlen=TRACE_BUFFER_SIZE)
+
+
+@contextmanager
+def span(name: str):
+    """记录一个阶段；不在请求内时不做任何事"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, start, time.perf_counter() - start)
+
+
+def recent_traces(limit: int = 50) -> List[Dict]:
+    """最近的慢请求，新的在前"""
+    return [trace.to_dict() for trace in list(_slow_traces)[-limit:][::-1]]
+
+
+class TracingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace(scope["method"], scope["path"])
+        token = _current_trace.set(trace)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                trace.status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", trace.server_timing().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            trace.duration = trace.elapsed()
+            _current_trace.reset(token)
+            if trace.duration >= TRACE_SLOW_SECONDS and random.random() < TRACE_SAMPLE_RATE:
+                _slow_traces.append(trace)
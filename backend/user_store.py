@@ -0,0 +1,123 @@
+"""
+用户存储
+SQLite按用户名主键索引，单用户原子写入；读取带进程内LRU缓存，注册/登录成本与用户总数无关。
+首次启动时从旧版 data/users.json 一次性导入。
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from db import SQLiteDatabase
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    email TEXT NOT NULL,
+    password TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS users_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class UserRepository:
+    def __init__(self, db: SQLiteDatabase, cache_size: int = 10000):
+        self.db = db
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, Dict]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.db.executescript(_SCHEMA)
+
+    def get(self, username: str) -> Optional[Dict]:
+        """按用户名读取；只缓存已存在的用户，避免其他worker注册后读到过期的“不存在”"""
+        with self._cache_lock:
+            user = self._cache.get(username)
+            if user is not None:
+                self._cache.move_to_end(username)
+                return user
+
+        row = self.db.execute(
+            "SELECT username, email, password, created_at FROM users WHERE username = ?", (username,)
+        ).fetchone()
+        if row is None:
+            return None
+        user = dict(row)
+        self._remember(user)
+        return user
+
+    def create(self, username: str, email: str, password_hash: str, created_at: str) -> bool:
+        """原子插入新用户，用户名已存在时返回False"""
+        try:
+            self.db.execute(
+                "INSERT INTO users (username, email, password, created_at) VALUES (?, ?, ?, ?)",
+                (username, email, password_hash, created_at),
+            )
+        except sqlite3.IntegrityError:
+            return False
+        self._remember({"username": username, "email": email, "password": password_hash, "created_at": created_at})
+        return True
+
+    def upsert(self, username: str, email: str, password_hash: str, created_at: str):
+        """插入或整体替换单个用户"""
+        self.db.execute(
+            """
+            INSERT INTO users (username, email, password, created_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(username) DO UPDATE SET
+                email = excluded.email,
+                password = excluded.password,
+                created_at = excluded.created_at
+            """,
+            (username, email, password_hash, created_at),
+        )
+        with self._cache_lock:
+            self._cache.pop(username, None)
+
+    def import_json(self, users_file: str) -> int:
+        """从旧版users.json一次性导入（多worker同时启动时只有一个会执行）"""
+        if not os.path.exists(users_file):
+            return 0
+        conn = self.db.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            done = conn.execute("SELECT value FROM users_meta WHERE key = 'json_imported'").fetchone()
+            if done:
+                conn.execute("ROLLBACK")
+                return 0
+            try:
+                with open(users_file, 'r', encoding='utf-8') as f:
+                    users = json.load(f)
+            except (OSError, ValueError):
+                users = {}
+            if not isinstance(users, dict):
+                print(f"跳过格式错误的用户文件 {users_file}")
+                users = {}
+            count = 0
+            for username, info in users.items():
+                if not isinstance(info, dict) or not info.get("password"):
+                    print(f"跳过格式错误的用户记录: {username}")
+                    continue
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO users (username, email, password, created_at) VALUES (?, ?, ?, ?)",
+                    (username, info.get("email", ""), info["password"], info.get("created_at", "")),
+                )
+                count += cursor.rowcount
+            conn.execute("INSERT INTO users_meta (key, value) VALUES ('json_imported', '1')")
+            conn.execute("COMMIT")
+            return count
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _remember(self, user: Dict):
+        with self._cache_lock:
+            self._cache[user["username"]] = user
+            self._cache.move_to_end(user["username"])
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
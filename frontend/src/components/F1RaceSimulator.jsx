@@ -29,6 +29,11 @@ import { F1_TEAMS, F1_RACES_2024, RACE_PHASES } from '../data/f1Data';
 import PathTrack from './PathTrack.jsx';
 import StrategyPrep from './StrategyPrep.jsx';
 
+// 每场比赛一个无线电会话ID，后端按它和车手保存对话记忆
+const newRadioSessionId = () => (
+  window.crypto?.randomUUID ? window.crypto.randomUUID() : `${Date.now()}-${Math.random().toString(16).slice(2)}`
+);
+
 const F1RaceSimulator = ({
   selectedTeam,
   selectedRace,
@@ -50,6 +55,7 @@ const F1RaceSimulator = ({
   // UI状态
   const [selectedDriverForChat, setSelectedDriverForChat] = useState(null);
   const [chatMessages, setChatMessages] = useState([]);
+  const radioSessionIdRef = useRef(newRadioSessionId());
   const [userInput, setUserInput] = useState('');
   const [isAIThinking, setIsAIThinking] = useState(false);
   
@@ -183,6 +189,7 @@ const F1RaceSimulator = ({
     setIsRaceActive(false);
     setLiveRanking([]);
     setChatMessages([]);
+    radioSessionIdRef.current = newRadioSessionId();
     setRaceEvents([]);
     setRaceFlag('green');
     setSelectedDriverForChat(null);
@@ -222,10 +229,7 @@ const F1RaceSimulator = ({
         message,
         driverId: selectedDriverForChat.id || selectedDriverForChat.name?.toLowerCase().replace(' ', '_'),
         driverName: selectedDriverForChat.name,
-        conversationHistory: chatMessages.slice(-10).map(msg => ({
-          role: msg.type === 'user' ? 'user' : 'assistant',
-          content: msg.message
-        })),
+        radioSessionId: radioSessionIdRef.current,
         teamContext: {
           name: team.name,
           position: liveRanking.find(r => r.id === selectedDriverForChat.id)?.position || 10,
@@ -19,6 +19,11 @@ import {
   Warning
 } from '@mui/icons-material';
 
+// 每场比赛一个无线电会话ID，后端按它和车手保存对话记忆
+const newRadioSessionId = () => (
+  window.crypto?.randomUUID ? window.crypto.randomUUID() : `${Date.now()}-${Math.random().toString(16).slice(2)}`
+);
+
 const RealTimeChat = ({ 
   selectedDriver,
   teamData,
@@ -30,7 +35,7 @@ const RealTimeChat = ({
   const [userInput, setUserInput] = useState('');
   const [isAIThinking, setIsAIThinking] = useState(false);
   const [driverMood, setDriverMood] = useState('focused');
-  const [conversationContext, setConversationContext] = useState([]);
+  const radioSessionIdRef = useRef(newRadioSessionId());
   const messagesEndRef = useRef(null);
 
   const scrollToBottom = () => {
@@ -53,7 +58,7 @@ const RealTimeChat = ({
         mood: 'professional'
       };
       setMessages([welcomeMessage]);
-      setConversationContext([]);
+      radioSessionIdRef.current = newRadioSessionId();
     }
   }, [selectedDriver, teamData]);
 
@@ -75,12 +80,6 @@ const RealTimeChat = ({
     setIsAIThinking(true);
 
     try {
-      // 构建完整的对话上下文
-      const contextMessages = [
-        ...conversationContext.slice(-10), // 保留最近10条对话
-        { role: 'user', content: input }
-      ];
-
       const response = await fetch('/api/chat/driver_response', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
@@ -88,7 +87,7 @@ const RealTimeChat = ({
           message: input,
           driverId: selectedDriver.id,
           driverName: selectedDriver.name,
-          conversationHistory: contextMessages,
+          radioSessionId: radioSessionIdRef.current,
           teamContext: {
             name: teamData.name,
             position: raceContext.currentPosition || 10,
@@ -125,13 +124,6 @@ const RealTimeChat = ({
         
         setMessages(prev => [...prev, aiMessage]);
         setDriverMood(result.mood);
-        
-        // 更新对话上下文
-        setConversationContext(prev => [
-          ...prev.slice(-8),
-          { role: 'user', content: input },
-          { role: 'assistant', content: result.response }
-        ]);
 
         // 如果有策略影响，通知父组件
         if (result.strategyImpact && onStrategyImpact) {